@@ -0,0 +1,92 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from newrelic.admin import command, usage
+
+
+@command('run-aggregator', 'config_file [socket_path]',
+"""Runs the local aggregator for the host. Worker processes of a pre-fork
+web server which have the 'aggregator.enabled' setting forward the data for
+each harvest to the aggregator over a Unix domain socket, rather than each
+reporting to the data collector themselves. The aggregator merges the data
+for all workers and reports it once per harvest. Each worker still connects
+to the data collector itself, to obtain its configuration and so it can
+report the data itself whenever the aggregator is unavailable.
+
+The aggregator and the workers must run as the same user. The socket is
+created at <socket_path> if supplied, otherwise at the path given by the
+'aggregator.socket_path' setting, or if not set, in a directory under the
+temporary directory which is only accessible by the current user. If
+<config_file> is '-' the path to the agent configuration file is taken
+from the environment variable NEW_RELIC_CONFIG_FILE.""")
+def run_aggregator(args):
+    import os
+    import signal
+    import sys
+    import threading
+
+    if len(args) == 0:
+        usage('run-aggregator')
+        sys.exit(1)
+
+    from newrelic.config import initialize
+    from newrelic.core.agent import agent_instance
+    from newrelic.core.aggregator import AggregatorServer, socket_path_for
+    from newrelic.core.config import global_settings
+
+    config_file = args[0]
+    environment = os.environ.get('NEW_RELIC_ENVIRONMENT')
+
+    if config_file == '-':
+        config_file = os.environ.get('NEW_RELIC_CONFIG_FILE')
+
+    initialize(config_file, environment, ignore_errors=False)
+
+    settings = global_settings()
+
+    # The aggregator reports the data it receives itself, so must never
+    # attempt to forward its own harvest data.
+
+    settings.aggregator.enabled = False
+
+    if len(args) >= 2:
+        settings.aggregator.socket_path = args[1]
+
+    agent = agent_instance()
+
+    agent.activate_application(settings.app_name)
+
+    server = AggregatorServer(socket_path_for(settings.aggregator),
+            agent.merge_forwarded_harvest)
+
+    server.start()
+
+    print('Aggregator listening on %r.' % server.path)
+
+    stopped = threading.Event()
+
+    def _stop(signum, frame):
+        stopped.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    while not stopped.is_set():
+        stopped.wait(1.0)
+
+    server.stop()
+
+    agent.shutdown_agent(settings.shutdown_timeout)
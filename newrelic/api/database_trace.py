@@ -19,6 +19,7 @@ from newrelic.common.async_wrapper import async_wrapper
 from newrelic.api.time_trace import TimeTrace, current_trace
 from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 from newrelic.core.database_node import DatabaseNode
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
 from newrelic.core.stack_trace import current_stack
 
 _logger = logging.getLogger(__name__)
@@ -50,6 +51,8 @@ class DatabaseTrace(TimeTrace):
 
     __async_explain_plan_logged = False
 
+    parameterized = False
+
     def __init__(self, sql, dbapi2_module=None,
                  connect_params=None, cursor_params=None,
                  sql_parameters=None, execute_params=None,
@@ -112,6 +115,11 @@ class DatabaseTrace(TimeTrace):
     def finalize_data(self, transaction, exc=None, value=None, tb=None):
         self.stack_trace = None
 
+        # Statements executed with parameters usually contain no literals,
+        # which allows the obfuscation of the SQL to be done more quickly.
+
+        self.parameterized = self.sql_parameters is not None
+
         connect_params = None
         cursor_params = None
         sql_parameters = None
@@ -200,10 +208,10 @@ class DatabaseTrace(TimeTrace):
         return True
 
     def create_node(self):
-        return DatabaseNode(
+        node = DatabaseNode(
                 dbapi2_module=self.dbapi2_module,
                 sql=self.sql,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -219,7 +227,12 @@ class DatabaseTrace(TimeTrace):
                 database_name=self.database_name,
                 guid=self.guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES)
+
+        if self.parameterized:
+            node.statement.parameterized = True
+
+        return node
 
 
 def DatabaseTraceWrapper(wrapped, sql, dbapi2_module=None):
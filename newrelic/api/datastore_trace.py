@@ -18,6 +18,7 @@ from newrelic.common.async_wrapper import async_wrapper
 from newrelic.api.time_trace import TimeTrace, current_trace
 from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 from newrelic.core.datastore_node import DatastoreNode
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
 
 
 class DatastoreTrace(TimeTrace):
@@ -112,7 +113,7 @@ class DatastoreTrace(TimeTrace):
                 product=self.product,
                 target=self.target,
                 operation=self.operation,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -122,7 +123,7 @@ class DatastoreTrace(TimeTrace):
                 database_name=self.database_name,
                 guid=self.guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes,)
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES,)
 
 
 def DatastoreTraceWrapper(wrapped, product, target, operation):
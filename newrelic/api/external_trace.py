@@ -18,6 +18,7 @@ from newrelic.common.async_wrapper import async_wrapper
 from newrelic.api.cat_header_mixin import CatHeaderMixin
 from newrelic.api.time_trace import TimeTrace, current_trace
 from newrelic.core.external_node import ExternalNode
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
 from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 
 
@@ -52,7 +53,7 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
                 library=self.library,
                 url=self.url,
                 method=self.method,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -60,7 +61,7 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
                 params=self.params,
                 guid=self.guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES)
 
 
 def ExternalTraceWrapper(wrapped, library, url, method=None):
@@ -19,6 +19,7 @@ from newrelic.api.time_trace import TimeTrace, current_trace
 from newrelic.common.object_names import callable_name
 from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 from newrelic.core.function_node import FunctionNode
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
 
 
 class FunctionTrace(TimeTrace):
@@ -69,7 +70,7 @@ class FunctionTrace(TimeTrace):
         return FunctionNode(
                 group=self.group,
                 name=self.name,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -78,8 +79,8 @@ class FunctionTrace(TimeTrace):
                 params=self.params,
                 rollup=self.rollup,
                 guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                agent_attributes=self.agent_attributes or EMPTY_ATTRIBUTES,
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES)
 
 
 def FunctionTraceWrapper(wrapped, name=None, group=None, label=None,
@@ -17,6 +17,7 @@ import functools
 from newrelic.common.async_wrapper import async_wrapper
 from newrelic.api.time_trace import TimeTrace, current_trace
 from newrelic.core.memcache_node import MemcacheNode
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
 from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 
 
@@ -42,14 +43,14 @@ class MemcacheTrace(TimeTrace):
     def create_node(self):
         return MemcacheNode(
                 command=self.command,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
                 guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                agent_attributes=self.agent_attributes or EMPTY_ATTRIBUTES,
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES)
 
 
 def MemcacheTraceWrapper(wrapped, command):
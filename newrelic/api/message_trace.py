@@ -19,6 +19,7 @@ from newrelic.api.cat_header_mixin import CatHeaderMixin
 from newrelic.api.time_trace import TimeTrace, current_trace
 from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 from newrelic.core.message_node import MessageNode
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
 
 
 class MessageTrace(CatHeaderMixin, TimeTrace):
@@ -72,7 +73,7 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
         return MessageNode(
                 library=self.library,
                 operation=self.operation,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -81,8 +82,8 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
                 destination_type=self.destination_type,
                 params=self.params,
                 guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                agent_attributes=self.agent_attributes or EMPTY_ATTRIBUTES,
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES)
 
 
 def MessageTraceWrapper(wrapped, library, operation, destination_type,
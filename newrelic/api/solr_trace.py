@@ -17,6 +17,8 @@ import newrelic.core.solr_node
 import newrelic.api.time_trace
 import newrelic.api.object_wrapper
 
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
+
 
 class SolrTrace(newrelic.api.time_trace.TimeTrace):
 
@@ -42,14 +44,14 @@ class SolrTrace(newrelic.api.time_trace.TimeTrace):
         return newrelic.core.solr_node.SolrNode(
                 library=self.library,
                 command=self.command,
-                children=self.children,
+                children=self.children or EMPTY_CHILDREN,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
                 guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes,)
+                agent_attributes=self.agent_attributes or EMPTY_ATTRIBUTES,
+                user_attributes=self.user_attributes or EMPTY_ATTRIBUTES,)
 
 
 class SolrTraceWrapper(object):
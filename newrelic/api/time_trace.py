@@ -19,6 +19,7 @@ import sys
 import newrelic.packages.six as six
 import traceback
 from newrelic.core.trace_cache import trace_cache
+from newrelic.core.aggregate_node import fold_node
 from newrelic.core.attribute import (
         process_user_attribute, MAX_NUM_USER_ATTRIBUTES)
 from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
@@ -28,23 +29,30 @@ _logger = logging.getLogger(__name__)
 
 class TimeTrace(object):
 
+    # The initial state of a trace is given by class attributes, so that
+    # only state which changes, and the containers which are added to, are
+    # allocated for each trace.
+
+    root = None
+    child_count = 0
+    merged_child_count = 0
+    aggregation_index = None
+    start_time = 0.0
+    end_time = 0.0
+    duration = 0.0
+    exclusive = 0.0
+    thread_id = None
+    activated = False
+    exited = False
+    is_async = False
+    has_async_children = False
+    min_child_start_time = float('inf')
+    exc_data = (None, None, None)
+    should_record_segment_params = False
+
     def __init__(self, parent=None):
         self.parent = parent
-        self.root = None
-        self.child_count = 0
         self.children = []
-        self.start_time = 0.0
-        self.end_time = 0.0
-        self.duration = 0.0
-        self.exclusive = 0.0
-        self.thread_id = None
-        self.activated = False
-        self.exited = False
-        self.is_async = False
-        self.has_async_children = False
-        self.min_child_start_time = float('inf')
-        self.exc_data = (None, None, None)
-        self.should_record_segment_params = False
         # 16-digit random hex. Padded with zeros in the front.
         self.guid = '%016x' % random.getrandbits(64)
         self.agent_attributes = {}
@@ -60,9 +68,23 @@ class TimeTrace(object):
         return transaction and transaction.settings
 
     def _is_leaf(self):
-        return self.child_count == len(self.children)
+        return self.child_count == (len(self.children) +
+                self.merged_child_count)
 
     def __enter__(self):
+        # A trace can only be used once. Entering it again, whether still
+        # active or already completed, would corrupt the trace hierarchy
+        # of the transaction.
+
+        if self.activated:
+            _logger.error('Runtime instrumentation error. The __enter__() '
+                    'method of %r was called after the trace had already '
+                    'been entered. Report this issue to New Relic '
+                    'support.\n%s', self,
+                    ''.join(traceback.format_stack()[:-1]))
+
+            return self
+
         self.parent = parent = self.parent or current_trace()
         if not parent:
             return self
@@ -125,6 +147,12 @@ class TimeTrace(object):
 
             return
 
+        # The trace may already have been exited where it was entered again
+        # after being entered once.
+
+        if self.exited:
+            return
+
         transaction = self.root.transaction
 
         # If the transaction has gone out of scope (recorded), there's not much
@@ -344,7 +372,8 @@ class TimeTrace(object):
         self.agent_attributes[key] = value
 
     def has_outstanding_children(self):
-        return len(self.children) != self.child_count
+        return (len(self.children) + self.merged_child_count !=
+                self.child_count)
 
     def _ready_to_complete(self):
         # we shouldn't continue if we're still running
@@ -419,7 +448,15 @@ class TimeTrace(object):
 
         if node:
             transaction._process_node(node)
-            parent.process_child(node, self.is_async)
+
+            # Once the transaction has more nodes than allowed, nodes for
+            # repeated calls under the same parent are folded together.
+
+            budget = transaction._node_budget
+            fold = budget and transaction._trace_node_count > budget
+
+            parent.process_child(node, self.is_async, fold,
+                    transaction._retain_node(node))
 
         # ----------------------------------------------------------------------
         # SYNC  | The parent will not have exited yet, so no node will be
@@ -470,8 +507,17 @@ class TimeTrace(object):
             self.parent.update_async_exclusive_time(min_child_start_time,
                     exclusive_duration_remaining)
 
-    def process_child(self, node, is_async):
-        self.children.append(node)
+    def process_child(self, node, is_async, fold=False, retain=True):
+        if not retain:
+            self.merged_child_count += 1
+        elif fold:
+            if self.aggregation_index is None:
+                self.aggregation_index = {}
+            if fold_node(self.children, self.aggregation_index, node):
+                self.merged_child_count += 1
+        else:
+            self.children.append(node)
+
         if is_async:
 
             # record the lowest start time
@@ -479,7 +525,7 @@ class TimeTrace(object):
                     node.start_time)
 
             # if there are no children running, finalize exclusive time
-            if self.child_count == len(self.children):
+            if not self.has_outstanding_children():
 
                 exclusive_duration = node.end_time - self.min_child_start_time
 
@@ -496,7 +542,8 @@ class TimeTrace(object):
 
         # if there's more than 1 child node outstanding
         # then the children are async w.r.t each other
-        if (self.child_count - len(self.children)) > 1:
+        if (self.child_count - len(self.children) -
+                self.merged_child_count) > 1:
             self.has_async_children = True
         # else, the current trace that's being scheduled is not going to be
         # async. note that this implies that all previous traces have
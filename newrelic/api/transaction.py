@@ -33,6 +33,7 @@ import newrelic.core.database_node
 import newrelic.core.error_node
 
 from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
+from newrelic.core.streamed_metrics import StreamedMetrics
 from newrelic.core.trace_cache import (trace_cache,
         TraceCacheNoActiveTraceError,
         TraceCacheActiveTraceError)
@@ -184,6 +185,12 @@ class Transaction(object):
         self.stopped = False
 
         self._trace_node_count = 0
+        self._node_budget = 0
+
+        self._streamed_metrics = None
+        self._retained_node_count = 0
+        self._retained_node_limit = None
+        self._metrics_only = False
 
         self._errors = []
         self._slow_sql = []
@@ -302,6 +309,20 @@ class Transaction(object):
 
                 if self._settings:
                     self.enabled = True
+                    self._node_budget = (self._settings.agent_limits.
+                            nodes_per_transaction)
+
+                    # Only as many nodes as could be included in the
+                    # transaction trace or reported as span events need
+                    # be retained when metrics are generated
+                    # incrementally.
+
+                    if self._settings.stats_engine.incremental_metrics:
+                        self._retained_node_limit = max(
+                                self._settings.agent_limits.
+                                transaction_traces_nodes,
+                                self._settings.event_harvest_config.
+                                harvest_limits.span_event_data)
 
     def __del__(self):
         self._dead = True
@@ -317,6 +338,21 @@ class Transaction(object):
         if not self.enabled:
             return self
 
+        # Where only metrics are required for transactions which aren't
+        # sampled, the sampling decision is made up front so that no
+        # nodes need be retained for such transactions. Span events for
+        # all transactions are required by infinite tracing, and
+        # Synthetics transactions always have a transaction trace.
+
+        settings = self._settings
+
+        if (settings.stats_engine.unsampled_metrics_only and
+                settings.distributed_tracing.enabled and
+                not settings.infinite_tracing.enabled and
+                not self.synthetics_resource_id):
+            self._compute_sampled_and_priority()
+            self._metrics_only = True
+
         # Record the start time for transaction.
 
         self.start_time = time.time()
@@ -540,7 +576,8 @@ class Transaction(object):
                 custom_metrics=self._custom_metrics,
                 guid=self.guid,
                 cpu_time=self._cpu_user_time_value,
-                suppress_transaction_trace=self.suppress_transaction_trace,
+                suppress_transaction_trace=(self.suppress_transaction_trace or
+                        self._metrics_only_unsampled),
                 client_cross_process_id=self.client_cross_process_id,
                 referring_transaction_guid=self.referring_transaction_guid,
                 record_tt=self.record_tt,
@@ -570,6 +607,7 @@ class Transaction(object):
                 trace_id=self.trace_id,
                 loop_time=self._loop_time,
                 root=root_node,
+                streamed_metrics=self._streamed_metrics,
         )
 
         # Clear settings as we are all done and don't need it
@@ -764,11 +802,17 @@ class Transaction(object):
                 queue_wait = 0
         return queue_wait
 
+    @property
+    def _metrics_only_unsampled(self):
+        return self._metrics_only and not self._sampled
+
     @property
     def should_record_segment_params(self):
-        # Only record parameters when it is safe to do so
+        # Only record parameters when it is safe to do so, and when the
+        # segments will be reported.
         return (self.settings and
-                not self.settings.high_security)
+                not self.settings.high_security and
+                not self._metrics_only_unsampled)
 
     @property
     def trace_intrinsics(self):
@@ -1213,8 +1257,14 @@ class Transaction(object):
 
         self._trace_id = data.get('tr')
 
+        # Where the sampling decision was made on entering the
+        # transaction so that only metrics are recorded when it isn't
+        # sampled, nodes may already have been dropped. The decision is
+        # then final, else a sampled transaction could have only part of
+        # its trace.
+
         priority = data.get('pr')
-        if priority is not None:
+        if priority is not None and not self._metrics_only:
             self._priority = priority
             self._sampled = data.get('sa')
 
@@ -1565,12 +1615,44 @@ class Transaction(object):
     def _intern_string(self, value):
         return self._string_cache.setdefault(value, value)
 
+    def _retain_node(self, node):
+        """Returns whether the node should be retained as part of the
+        trace hierarchy. Where it isn't, the metrics for the node and any
+        children it holds are accumulated immediately.
+
+        """
+
+        limit = self._retained_node_limit
+
+        # No nodes are retained for transactions which aren't sampled
+        # where only metrics are required for them.
+
+        if self._metrics_only_unsampled:
+            limit = 0
+
+        if limit is None or self._retained_node_count < limit:
+            self._retained_node_count += 1
+            return True
+
+        if self._streamed_metrics is None:
+            self._streamed_metrics = StreamedMetrics(self.type,
+                    self._settings)
+
+        self._streamed_metrics.merge_node(node)
+
+        return False
+
     def _process_node(self, node):
         self._trace_node_count += 1
-        node.node_count = self._trace_node_count
         self.total_time += node.exclusive
 
         if type(node) is newrelic.core.database_node.DatabaseNode:
+            # The position of the node is only needed when deciding
+            # whether to generate explain plans for slow SQL. Other node
+            # types don't have an instance dictionary to record it in.
+
+            node.node_count = self._trace_node_count
+
             settings = self._settings
             if not settings.collect_traces:
                 return
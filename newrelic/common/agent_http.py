@@ -16,6 +16,7 @@ from __future__ import print_function
 
 import os
 import sys
+import threading
 import time
 import zlib
 from pprint import pprint
@@ -92,6 +93,7 @@ class BaseClient(object):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
     ):
         self._audit_log_fp = audit_log_fp
 
@@ -108,14 +110,27 @@ class BaseClient(object):
         pass
 
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(
+        params, payload, body, compression_time, payload_size=None
+    ):
         pass
 
     @classmethod
     def log_request(
-        cls, fp, method, url, params, payload, headers, body=None, compression_time=None
+        cls,
+        fp,
+        method,
+        url,
+        params,
+        payload,
+        headers,
+        body=None,
+        compression_time=None,
+        payload_size=None,
     ):
-        cls._supportability_request(params, payload, body, compression_time)
+        cls._supportability_request(
+            params, payload, body, compression_time, payload_size
+        )
 
         if not fp:
             return
@@ -240,6 +255,7 @@ class HttpClient(BaseClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
     ):
         self._host = host
         port = self._port = port
@@ -252,8 +268,11 @@ class HttpClient(BaseClient):
         self._prefix = ""
 
         self._headers = dict(self.BASE_HEADERS)
+        # The pool is sized to allow for requests to different endpoints
+        # of the data collector being made concurrently.
         self._connection_kwargs = connection_kwargs = {
             "timeout": timeout,
+            "maxsize": max(max_connections or 1, 1),
         }
         self._urlopen_kwargs = urlopen_kwargs = {}
 
@@ -301,6 +320,7 @@ class HttpClient(BaseClient):
         self._proxy = proxy
 
         self._connection_attr = None
+        self._connection_lock = threading.Lock()
 
     @staticmethod
     def _parse_proxy(scheme, host, port, username, password):
@@ -343,17 +363,21 @@ class HttpClient(BaseClient):
         if self._connection_attr:
             return self._connection_attr
 
-        retries = urllib3.Retry(
-            total=False, connect=None, read=None, redirect=0, status=None
-        )
-        self._connection_attr = self.CONNECTION_CLS(
-            self._host,
-            self._port,
-            strict=True,
-            retries=retries,
-            **self._connection_kwargs
-        )
-        return self._connection_attr
+        with self._connection_lock:
+            if self._connection_attr:
+                return self._connection_attr
+
+            retries = urllib3.Retry(
+                total=False, connect=None, read=None, redirect=0, status=None
+            )
+            self._connection_attr = self.CONNECTION_CLS(
+                self._host,
+                self._port,
+                strict=True,
+                retries=retries,
+                **self._connection_kwargs
+            )
+            return self._connection_attr
 
     def close_connection(self):
         if self._connection_attr:
@@ -370,12 +394,21 @@ class HttpClient(BaseClient):
         headers,
         body=None,
         compression_time=None,
+        payload_size=None,
     ):
         if not self._prefix:
             url = self.CONNECTION_CLS.scheme + "://" + self._host + url
 
         return super(HttpClient, self).log_request(
-            fp, method, url, params, payload, headers, body, compression_time
+            fp,
+            method,
+            url,
+            params,
+            payload,
+            headers,
+            body,
+            compression_time,
+            payload_size,
         )
 
     @staticmethod
@@ -392,6 +425,53 @@ class HttpClient(BaseClient):
 
         return data, compression_time
 
+    def _compress_chunks(self, chunks):
+        # The payload is supplied as an iterable of byte string chunks.
+        # Chunks are buffered until the compression threshold is
+        # exceeded, after which they are passed through an incremental
+        # compressor as they are generated, so that the uncompressed
+        # payload is never held in memory in full.
+
+        chunks = iter(chunks)
+        buffered = []
+        payload_size = 0
+
+        for chunk in chunks:
+            buffered.append(chunk)
+            payload_size += len(chunk)
+
+            if payload_size > self._compression_threshold:
+                break
+        else:
+            return b"".join(buffered), None, payload_size
+
+        level = self._compression_level or zlib.Z_DEFAULT_COMPRESSION
+        wbits = 31 if self._compression_method == "gzip" else 15
+
+        compression_time = 0.0
+        compression_start = time.time()
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        body = [compressor.compress(chunk) for chunk in buffered]
+        buffered = None
+
+        compression_time += max(time.time(), compression_start) - compression_start
+
+        for chunk in chunks:
+            payload_size += len(chunk)
+
+            compression_start = time.time()
+            body.append(compressor.compress(chunk))
+            compression_time += (
+                max(time.time(), compression_start) - compression_start
+            )
+
+        compression_start = time.time()
+        body.append(compressor.flush())
+        compression_time += max(time.time(), compression_start) - compression_start
+
+        return b"".join(body), compression_time, payload_size
+
     def send_request(
         self,
         method="POST",
@@ -410,10 +490,25 @@ class HttpClient(BaseClient):
         if headers:
             merged_headers.update(headers)
         path = self._prefix + path
+
+        # Streamed payloads are only materialized in full where they
+        # need to be written to the audit log.
+        if payload is not None and not isinstance(payload, bytes):
+            if self._audit_log_fp:
+                payload = b"".join(payload)
+
         body = payload
         compression_time = None
+        payload_size = None
         if payload is not None:
-            if len(payload) > self._compression_threshold:
+            if not isinstance(payload, bytes):
+                body, compression_time, payload_size = self._compress_chunks(payload)
+                payload = None
+                if compression_time is not None:
+                    content_encoding = self._compression_method
+                else:
+                    content_encoding = "Identity"
+            elif len(payload) > self._compression_threshold:
                 body, compression_time = self._compress(
                     payload,
                     method=self._compression_method,
@@ -434,6 +529,7 @@ class HttpClient(BaseClient):
             merged_headers,
             body,
             compression_time,
+            payload_size,
         )
 
         if body and len(body) > self._max_payload_size_in_bytes:
@@ -489,6 +585,7 @@ class InsecureHttpClient(HttpClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
     ):
         proxy = self._parse_proxy(proxy_scheme, proxy_host, None, None, None)
         if proxy and proxy.scheme == "https":
@@ -515,12 +612,15 @@ class InsecureHttpClient(HttpClient):
             compression_method,
             max_payload_size_in_bytes,
             audit_log_fp,
+            max_connections,
         )
 
 
 class SupportabilityMixin(object):
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(
+        params, payload, body, compression_time, payload_size=None
+    ):
         # *********
         # Used only for supportability metrics. Do not use to drive business
         # logic!
@@ -530,9 +630,12 @@ class SupportabilityMixin(object):
         if agent_method and body:
             # Compression was applied
             if compression_time is not None:
+                if payload_size is None:
+                    payload_size = len(payload)
+
                 internal_metric(
                     "Supportability/Python/Collector/ZLIB/Bytes/%s" % agent_method,
-                    len(payload),
+                    payload_size,
                 )
                 internal_metric(
                     "Supportability/Python/Collector/ZLIB/Compress/%s" % agent_method,
@@ -620,6 +723,9 @@ class DeveloperModeClient(SupportabilityMixin, BaseClient):
         headers=None,
         payload=None,
     ):
+        if payload is not None and not isinstance(payload, bytes):
+            payload = b"".join(payload)
+
         request_id = self.log_request(
             self._audit_log_fp,
             "POST",
@@ -657,6 +763,9 @@ class ServerlessModeClient(DeveloperModeClient):
         headers=None,
         payload=None,
     ):
+        if payload is not None and not isinstance(payload, bytes):
+            payload = b"".join(payload)
+
         result = super(ServerlessModeClient, self).send_request(
             method=method, path=path, params=params, headers=headers, payload=payload
         )
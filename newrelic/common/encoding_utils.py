@@ -105,6 +105,52 @@ def json_encode(obj, **kwargs):
     return json.dumps(obj, **_kwargs)
 
 
+def _json_encode_pieces(obj, depth, kwargs):
+    # Lists, tuples and generators down to the requested depth are
+    # expanded element by element so that only a single element need be
+    # held in encoded form at any one time. Anything below that depth,
+    # or of any other type, is passed through json_encode() as a whole
+    # so that the faster C implementation of the encoder is still used
+    # for the bulk of the work.
+
+    if depth and isinstance(obj, (list, tuple, types.GeneratorType)):
+        yield '['
+        separator = ''
+        for item in obj:
+            yield separator
+            for piece in _json_encode_pieces(item, depth - 1, kwargs):
+                yield piece
+            separator = ','
+        yield ']'
+    else:
+        yield json_encode(obj, **kwargs)
+
+
+def json_encode_chunks(obj, chunk_size=64 * 1024, depth=2, **kwargs):
+    """Incrementally encodes the object as JSON, returning an iterator
+    over UTF-8 byte string chunks of roughly chunk_size characters. The
+    joined chunks are the same as for json_encode(obj).encode('utf-8'),
+    but the full encoded payload is never held in memory at one time.
+    Only the outermost containers, as given by depth, are streamed.
+
+    """
+
+    buffered = []
+    buffered_size = 0
+
+    for piece in _json_encode_pieces(obj, depth, kwargs):
+        buffered.append(piece)
+        buffered_size += len(piece)
+
+        if buffered_size >= chunk_size:
+            yield ''.join(buffered).encode('utf-8')
+            buffered = []
+            buffered_size = 0
+
+    if buffered:
+        yield ''.join(buffered).encode('utf-8')
+
+
 def json_decode(s, **kwargs):
     # Nothing special to do here at this point but use a wrapper to be
     # consistent with encoding and allow for changes later.
@@ -0,0 +1,97 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements utility functions for the files the agent
+itself writes, such as the data spool and the socket of the local
+aggregator, which may hold harvest data and so must only be accessible
+by the user the agent is running as.
+
+"""
+
+import errno
+import os
+import stat
+import tempfile
+
+
+def _current_uid():
+    getuid = getattr(os, 'getuid', None)
+    return getuid() if getuid is not None else None
+
+
+def private_temporary_directory(name):
+    """Returns the path of a directory for the current user under the
+    system temporary directory. As the temporary directory is shared by
+    all users, the directory name includes the user ID.
+
+    """
+
+    uid = _current_uid()
+
+    if uid is not None:
+        name = '%s-%d' % (name, uid)
+
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def private_directory(path):
+    """Creates the directory if it does not exist, such that it is only
+    accessible by the current user. Where the directory already exists
+    it must be owned by the current user, else OSError is raised, as
+    another user may otherwise be able to read or replace the files in
+    it. Access to an existing directory by any other user is revoked.
+
+    """
+
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+    uid = _current_uid()
+
+    if uid is None:
+        return path
+
+    # The directory is checked without following symbolic links, so a
+    # link planted by another user to a directory they can write to is
+    # never accepted.
+
+    info = os.lstat(path)
+
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != uid:
+        raise OSError(errno.EPERM, 'Directory is not owned by the '
+                'current user', path)
+
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+
+    return path
+
+
+def open_private_file(path, mode='ab'):
+    """Opens the file for appending or writing, creating it if it does
+    not exist such that it is only accessible by the current user.
+
+    """
+
+    flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+
+    if mode.startswith('a'):
+        flags |= os.O_APPEND
+    else:
+        flags |= os.O_TRUNC
+
+    return os.fdopen(os.open(path, flags, 0o600), mode)
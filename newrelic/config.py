@@ -472,6 +472,8 @@ def _process_configuration(section):
                      'getboolean', None)
     _process_setting(section, 'agent_limits.transaction_traces_nodes',
                      'getint', None)
+    _process_setting(section, 'agent_limits.nodes_per_transaction',
+                     'getint', None)
     _process_setting(section, 'agent_limits.sql_query_length_maximum',
                      'getint', None)
     _process_setting(section, 'agent_limits.slow_sql_stack_trace',
@@ -484,6 +486,14 @@ def _process_configuration(section):
                      'getint', None)
     _process_setting(section, 'agent_limits.slow_sql_data',
                      'getint', None)
+    _process_setting(section, 'agent_limits.sql_statement_cache_entries',
+                     'getint', None)
+    _process_setting(section, 'agent_limits.sql_statement_cache_size',
+                     'getint', None)
+    _process_setting(section, 'agent_limits.explain_plan_cache_entries',
+                     'getint', None)
+    _process_setting(section, 'agent_limits.explain_plan_cache_max_age',
+                     'getfloat', None)
     _process_setting(section, 'agent_limits.merge_stats_maximum',
                      'getint', None)
     _process_setting(section, 'agent_limits.errors_per_transaction',
@@ -502,6 +512,10 @@ def _process_configuration(section):
                      'getint', None)
     _process_setting(section, 'agent_limits.data_compression_level',
                      'getint', None)
+    _process_setting(section, 'agent_limits.payload_chunk_size',
+                     'getint', None)
+    _process_setting(section, 'agent_limits.max_concurrent_sends',
+                     'getint', None)
     _process_setting(section, 'console.listener_socket',
                      'get', _map_console_listener_socket)
     _process_setting(section, 'console.allow_interpreter_cmd',
@@ -587,6 +601,44 @@ def _process_configuration(section):
                     'getboolean', None)
     _process_setting(section, 'event_loop_visibility.blocking_threshold',
                     'getfloat', None)
+    _process_setting(section, 'stats_engine.sharded',
+                    'getboolean', None)
+    _process_setting(section, 'stats_engine.compact_metrics',
+                    'getboolean', None)
+    _process_setting(section, 'stats_engine.incremental_metrics',
+                    'getboolean', None)
+    _process_setting(section, 'stats_engine.unsampled_metrics_only',
+                    'getboolean', None)
+    _process_setting(section, 'harvest_pipeline.enabled',
+                    'getboolean', None)
+    _process_setting(section, 'harvest_pipeline.queue_size',
+                    'getint', None)
+    _process_setting(section, 'explain_plan_worker.enabled',
+                    'getboolean', None)
+    _process_setting(section, 'explain_plan_worker.queue_size',
+                    'getint', None)
+    _process_setting(section, 'explain_plan_worker.timeout',
+                    'getfloat', None)
+    _process_setting(section, 'data_spool.enabled',
+                    'getboolean', None)
+    _process_setting(section, 'data_spool.directory',
+                    'get', None)
+    _process_setting(section, 'data_spool.max_size',
+                    'getint', None)
+    _process_setting(section, 'data_spool.max_age',
+                    'getfloat', None)
+    _process_setting(section, 'data_spool.max_attempts',
+                    'getint', None)
+    _process_setting(section, 'aggregator.enabled',
+                    'getboolean', None)
+    _process_setting(section, 'aggregator.socket_path',
+                    'get', None)
+    _process_setting(section, 'aggregator.timeout',
+                    'getfloat', None)
+    _process_setting(section, 'trace_cache.context_variables',
+                    'getboolean', None)
+    _process_setting(section, 'adaptive_sampler.sharded',
+                    'getboolean', None)
     _process_setting(section,
                     'event_harvest_config.harvest_limits.analytic_event_data',
                     'getint', None)
@@ -2025,6 +2077,13 @@ GREENLET_HOOK = ('greenlet', 'newrelic.core.trace_cache', 'greenlet_loaded')
 
 
 def _process_trace_cache_import_hooks():
+    if _settings.trace_cache.context_variables:
+        if not trace_cache.use_context_trace_cache():
+            _logger.warning('The trace_cache.context_variables setting '
+                    'is enabled, but context variables are not available '
+                    'in this version of Python. The default trace cache '
+                    'will be used.')
+
     _process_module_definition(*GREENLET_HOOK)
 
     if GREENLET_HOOK not in _module_import_hook_results:
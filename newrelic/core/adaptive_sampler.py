@@ -79,3 +79,128 @@ class AdaptiveSampler(object):
                                        self.sampling_target)
         self.computed_count = 0
         self.sampled_count = 0
+
+
+class _SamplerShard(object):
+    def __init__(self, epoch, now):
+        self.epoch = epoch
+        self.computed_count = 0
+        self.last_flush = now
+
+
+class ShardedAdaptiveSampler(AdaptiveSampler):
+    """Adaptive sampler which avoids acquiring a lock for every transaction.
+    Each thread counts the transactions it computes the sampling decision
+    for in its own shard, with the counts being added to the totals for the
+    sampling period every 'flush_interval' transactions, or where the
+    thread computes fewer transactions than that, at least every
+    'flush_fraction' of the sampling period. The lock is otherwise only
+    acquired when a transaction is to be sampled, so that the number of
+    transactions sampled in a period is still strictly limited, and when
+    a new sampling period starts.
+
+    The counts of transactions held by shards are not included in the
+    totals until they are flushed, so the sampling probabilities are
+    computed from counts which may be behind by up to 'flush_interval'
+    transactions, or that fraction of the period, for each thread.
+    Flushing on time as well means that where there are many threads,
+    each computing few transactions, the counts held by shards are never
+    a large part of the totals for the period.
+
+    """
+
+    flush_interval = 16
+    flush_fraction = 1.0 / 60
+
+    def __init__(self, sampling_target, sampling_period):
+        super(ShardedAdaptiveSampler, self).__init__(sampling_target,
+                sampling_period)
+
+        self._epoch = 0
+        self._local = threading.local()
+
+        self.flush_delay = sampling_period * self.flush_fraction
+
+    def _shard(self, now=None):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            if now is None:
+                now = time.time()
+            shard = self._local.shard = _SamplerShard(self._epoch, now)
+
+        # Counts held for a previous sampling period are discarded.
+
+        if shard.epoch != self._epoch:
+            shard.epoch = self._epoch
+            shard.computed_count = 0
+
+        return shard
+
+    def _flush(self, shard, now):
+        # Must be called with the lock held.
+
+        if shard.epoch == self._epoch:
+            self.computed_count += shard.computed_count
+
+        shard.computed_count = 0
+        shard.last_flush = now
+
+    def compute_sampled(self):
+        now = time.time()
+
+        if now - self.last_reset >= self.period:
+            with self._lock:
+                self.reset_if_required()
+
+        shard = self._shard(now)
+
+        # The decision is first made from the totals for the period as
+        # they stand, without acquiring the lock. The sampled count only
+        # ever increases within a period, so a transaction rejected here
+        # would also have been rejected with the lock held.
+
+        sampled_count = self.sampled_count
+
+        if sampled_count >= self.max_sampled:
+            sampled = False
+
+        elif sampled_count < self.sampling_target:
+            sampled = random.randrange(
+                    self.computed_count_last) < self.sampling_target
+
+        else:
+            computed_count = max(self.computed_count +
+                    shard.computed_count, 1)
+            sampled = random.randrange(
+                    computed_count) < self.adaptive_target
+
+        if sampled:
+            with self._lock:
+                self._flush(shard, now)
+
+                if self.sampled_count >= self.max_sampled:
+                    sampled = False
+
+                else:
+                    self.sampled_count += 1
+
+                    if self.sampled_count > self.sampling_target:
+                        ratio = (float(self.sampling_target) /
+                                self.sampled_count)
+                        self.adaptive_target = (
+                                self.sampling_target ** ratio -
+                                self.sampling_target ** 0.5)
+
+        shard.computed_count += 1
+
+        if (shard.computed_count >= self.flush_interval or
+                now - shard.last_flush >= self.flush_delay):
+            with self._lock:
+                self._flush(shard, now)
+
+        return sampled
+
+    def _reset(self):
+        super(ShardedAdaptiveSampler, self)._reset()
+        self._epoch += 1
@@ -564,6 +564,28 @@ class Agent(object):
             application.harvest(flexible=True)
             application.harvest(flexible=False)
 
+    def merge_forwarded_harvest(self, app_name, message):
+        """Merges a harvest snapshot forwarded by a worker process to the
+        local aggregator into the data for the named application. The
+        application is activated when the first snapshot for it is
+        received. Returns False where the snapshot could not be merged
+        as the application has not yet connected, in which case it is
+        rejected and the worker reports the data itself.
+
+        """
+
+        application = self._applications.get(app_name, None)
+
+        if application is None:
+            self.activate_application(app_name,
+                    message.get('linked_applications', []))
+            return False
+
+        if not application.active:
+            return False
+
+        return application.merge_forwarded_harvest(message)
+
     def normalize_name(self, app_name, name, rule_type='url'):
         application = self._applications.get(app_name, None)
         if application is None:
@@ -22,6 +22,7 @@ from newrelic.core.internal_metrics import internal_count_metric
 from newrelic.common.encoding_utils import (
     json_decode,
     json_encode,
+    json_encode_chunks,
     serverless_payload_encode,
 )
 from newrelic.common.utilization import (
@@ -38,6 +39,7 @@ from newrelic.core.config import (
     finalize_application_settings,
     global_settings_dump,
 )
+from newrelic.core.data_spool import DataSpool
 from newrelic.network.exceptions import (
     DiscardDataForRequest,
     ForceAgentDisconnect,
@@ -140,6 +142,23 @@ class AgentProtocol(object):
         ("method", "protocol_version", "marshal_format", "run_id")
     )
 
+    # Endpoints for which the payload may be large enough that it is
+    # encoded and compressed incrementally rather than as a whole.
+    STREAMED_METHODS = frozenset(
+        (
+            "metric_data",
+            "analytic_event_data",
+            "custom_event_data",
+            "error_event_data",
+            "span_event_data",
+        )
+    )
+
+    # Endpoints for which payloads which could not be sent are written
+    # to the data spool, if enabled. The payloads for each of these hold
+    # the agent run ID as the first item.
+    SPOOLED_METHODS = STREAMED_METHODS
+
     SECURITY_SETTINGS = (
         "capture_params",
         "transaction_tracer.record_sql",
@@ -176,6 +195,7 @@ class AgentProtocol(object):
             compression_method=settings.compressed_content_encoding,
             max_payload_size_in_bytes=settings.max_payload_size_in_bytes,
             audit_log_fp=audit_log_fp,
+            max_connections=settings.agent_limits.max_concurrent_sends,
         )
 
         self._params = {
@@ -197,6 +217,14 @@ class AgentProtocol(object):
 
         self._headers["Content-Type"] = "application/json"
         self._run_token = settings.agent_run_id
+        self._payload_chunk_size = settings.agent_limits.payload_chunk_size
+
+        if settings.data_spool.enabled and settings.app_name:
+            self.data_spool = DataSpool.for_application(
+                settings.app_name, settings.data_spool
+            )
+        else:
+            self.data_spool = None
 
         # Logging
         self._proxy_host = settings.proxy_host
@@ -216,8 +244,8 @@ class AgentProtocol(object):
     def close_connection(self):
         self.client.close_connection()
 
-    def send(self, method, payload=()):
-        params, headers, payload = self._to_http(method, payload)
+    def send(self, method, payload=(), spool=True):
+        params, headers, payload = self._to_http(method, payload, spool)
 
         try:
             response = self.client.send_request(
@@ -225,6 +253,8 @@ class AgentProtocol(object):
             )
         except NetworkInterfaceException:
             # All HTTP errors are currently retried
+            if spool and self._spool_payload(method, payload):
+                return None
             raise RetryDataForRequest
 
         status, data = response
@@ -254,15 +284,54 @@ class AgentProtocol(object):
                 },
             )
             exception = self.STATUS_CODE_RESPONSE.get(status, DiscardDataForRequest)
+            if exception is RetryDataForRequest and spool:
+                if self._spool_payload(method, payload):
+                    return None
             raise exception
         if status == 200:
             return json_decode(data.decode("utf-8"))["return_value"]
 
-    def _to_http(self, method, payload=()):
+    def _spool_payload(self, method, payload):
+        # Where the payload could be written to the data spool, it will
+        # be replayed once the data collector can be reached, so the
+        # send is treated as having succeeded rather than the data being
+        # retained in memory for the next harvest.
+        if self.data_spool is None or method not in self.SPOOLED_METHODS:
+            return False
+
+        return self.data_spool.append(method, payload)
+
+    def replay_data_spool(self):
+        """Sends any payloads held in the data spool, updating them with
+        the agent run ID for the current session.
+
+        """
+
+        if self.data_spool is None:
+            return 0
+
+        def _send(method, payload):
+            payload = json_decode(payload.decode("utf-8"))
+            payload[0] = self._run_token
+            self.send(method, payload, spool=False)
+
+        return self.data_spool.replay(_send)
+
+    def _to_http(self, method, payload=(), spool=False):
         params = dict(self._params)
         params["method"] = method
         if self._run_token:
             params["run_id"] = self._run_token
+        # Payloads which may need to be written to the data spool are
+        # not streamed, so the encoded payload is still available if the
+        # send fails.
+        streamed = self._payload_chunk_size and method in self.STREAMED_METHODS
+        if streamed and not (spool and self.data_spool is not None):
+            return (
+                params,
+                self._headers,
+                json_encode_chunks(payload, chunk_size=self._payload_chunk_size),
+            )
         return params, self._headers, json_encode(payload).encode("utf-8")
 
     @staticmethod
@@ -0,0 +1,202 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module provides the node type used to stand in for repeated calls
+under the same parent once a transaction has recorded more nodes than
+allowed by the 'agent_limits.nodes_per_transaction' setting. Rather than
+retaining a node for every call, the calls which would produce the same
+metrics are folded into a single aggregate node holding the call count
+and the total, exclusive, minimum and maximum times, so that the metrics
+for the transaction remain exact.
+
+"""
+
+import newrelic.core.trace_node
+
+from newrelic.core.metric import AggregateTimeMetric
+from newrelic.core.node_mixin import EMPTY_CHILDREN, GenericNodeMixin
+
+
+def _without_children(node):
+    if not node.children:
+        return node
+
+    values = list(node)
+    values[node._fields.index('children')] = EMPTY_CHILDREN
+
+    return type(node)(*values)
+
+
+def fold_node(children, index, node):
+    """Adds the node to the list of children of a parent node, folding it
+    into any node already in the list which it has the same aggregation
+    key as. The index maps aggregation keys to the position of the node
+    in the list. Returns True if the node was folded into an existing
+    node rather than being added to the list.
+
+    """
+
+    key = node.aggregation_key
+    position = None
+
+    if key is not None:
+        try:
+            position = index.get(key)
+        except TypeError:
+            key = None
+
+    if position is None:
+        if key is not None:
+            index[key] = len(children)
+        children.append(node)
+        return False
+
+    existing = children[position]
+
+    if type(existing) is not AggregateNode:
+        existing = children[position] = AggregateNode(existing)
+
+    existing.fold(node)
+
+    return True
+
+
+class AggregateNode(GenericNodeMixin):
+
+    """Node standing in for a number of calls which have the same
+    aggregation key. The first of the nodes folded in is retained, less its
+    children, and used to generate the metrics, transaction trace segment
+    and span event for the calls. The children of all the nodes are
+    themselves folded in as children of the aggregate node.
+
+    """
+
+    __slots__ = ('node', 'children', 'call_count', 'start_time', 'end_time',
+            'duration', 'exclusive', 'min_duration', 'max_duration',
+            'sum_of_squares', '_index')
+
+    def __init__(self, node):
+        self.node = _without_children(node)
+        self.children = []
+        self.call_count = 1
+        self.start_time = node.start_time
+        self.end_time = node.end_time
+        self.duration = node.duration
+        self.exclusive = node.exclusive
+        self.min_duration = node.duration
+        self.max_duration = node.duration
+        self.sum_of_squares = node.duration ** 2
+
+        self._index = {}
+
+        for child in node.children:
+            fold_node(self.children, self._index, child)
+
+    @property
+    def aggregation_key(self):
+        return self.node.aggregation_key
+
+    @property
+    def name(self):
+        return self.node.name
+
+    @property
+    def guid(self):
+        return self.node.guid
+
+    @property
+    def agent_attributes(self):
+        return self.node.agent_attributes
+
+    @property
+    def user_attributes(self):
+        return self.node.user_attributes
+
+    def fold(self, node):
+        """Folds another node with the same aggregation key, which may
+        itself be an aggregate node, into this node.
+
+        """
+
+        if type(node) is AggregateNode:
+            self.call_count += node.call_count
+            self.min_duration = min(self.min_duration, node.min_duration)
+            self.max_duration = max(self.max_duration, node.max_duration)
+            self.sum_of_squares += node.sum_of_squares
+        else:
+            self.call_count += 1
+            self.min_duration = min(self.min_duration, node.duration)
+            self.max_duration = max(self.max_duration, node.duration)
+            self.sum_of_squares += node.duration ** 2
+
+        self.start_time = min(self.start_time, node.start_time)
+        self.end_time = max(self.end_time, node.end_time)
+        self.duration += node.duration
+        self.exclusive += node.exclusive
+
+        for child in node.children:
+            fold_node(self.children, self._index, child)
+
+    def time_metrics(self, stats, root, parent):
+        """Return a generator yielding the timed metrics for all the
+        calls folded into this node as well as all the child nodes.
+
+        """
+
+        # The metrics for a single call are generated from the retained
+        # node and replaced with the aggregated times. Metrics for which
+        # the exclusive time isn't given have exclusive time the same as
+        # the duration.
+
+        for metric in self.node.time_metrics(stats, root, parent):
+            exclusive = None
+            if metric.exclusive is not None:
+                exclusive = self.exclusive
+
+            yield AggregateTimeMetric(name=metric.name, scope=metric.scope,
+                    call_count=self.call_count, duration=self.duration,
+                    exclusive=exclusive, min_duration=self.min_duration,
+                    max_duration=self.max_duration,
+                    sum_of_squares=self.sum_of_squares)
+
+        for child in self.children:
+            for metric in child.time_metrics(stats, root, self):
+                yield metric
+
+    def trace_node(self, stats, root, connections):
+        trace_node = self.node.trace_node(stats, root, connections)
+
+        children = []
+
+        for child in self.children:
+            if root.trace_node_count > root.trace_node_limit:
+                break
+            children.append(child.trace_node(stats, root, connections))
+
+        params = dict(trace_node.params or {})
+        params['exclusive_duration_millis'] = 1000.0 * self.exclusive
+        params['call_count'] = self.call_count
+
+        return trace_node._replace(
+                end_time=newrelic.core.trace_node.node_end_time(root, self),
+                params=params, children=children)
+
+    def span_event(self, settings, base_attrs=None, parent_guid=None,
+            attr_class=dict):
+        attrs = self.node.span_event(settings, base_attrs=base_attrs,
+                parent_guid=parent_guid, attr_class=attr_class)
+
+        attrs[0]['duration'] = self.duration
+
+        return attrs
@@ -0,0 +1,426 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements forwarding of harvest snapshots from the
+worker processes of a pre-fork web server to a single local aggregator
+process for the host. The aggregator merges the data from all workers
+into the stats engine of its own application and is the only process
+which reports to the data collector.
+
+Snapshots are sent over a Unix domain socket as length prefixed frames,
+each holding a small JSON encoded envelope identifying the application
+and process, followed by the snapshot in the binary snapshot format. The
+aggregator acknowledges each frame once the snapshot has been merged, or
+rejects it where the snapshot cannot yet be merged, such as before the
+aggregator has connected to the data collector for the application. A
+worker which cannot reach the aggregator, or does not receive an
+acknowledgment, reports the snapshot to the data collector itself, as it
+would when not using an aggregator.
+
+As a worker must be able to report the data itself, and obtains the
+configuration for the application from the data collector, each worker
+still connects to the data collector. It is only the reporting of the
+harvest data which is moved to the aggregator.
+
+The snapshots hold harvest data, so the aggregator and the workers must
+run as the same user. The socket is only accessible by that user, and
+where supported, the user at the other end of each connection is
+verified by both the aggregator and the worker.
+
+"""
+
+import logging
+import os
+import socket
+import struct
+import threading
+
+from newrelic.common.encoding_utils import json_encode, json_decode
+from newrelic.common.file_utils import (private_directory,
+        private_temporary_directory)
+from newrelic.core.internal_metrics import (internal_count_metric,
+        internal_metric)
+from newrelic.core.snapshot_format import encode_snapshot, decode_snapshot
+
+_logger = logging.getLogger(__name__)
+
+_FRAME_HEADER = struct.Struct('!II')
+
+_ACKNOWLEDGMENT = b'\x01'
+_REJECTION = b'\x00'
+
+# The credentials returned for the SO_PEERCRED socket option on Linux,
+# being the process ID, user ID and group ID of the peer.
+
+_PEER_CREDENTIALS = struct.Struct('3i')
+
+
+def socket_path_for(settings):
+    """Returns the path of the Unix domain socket the aggregator listens
+    on, given the aggregator settings. Where no path is set, the socket
+    is created in a directory under the temporary directory which is
+    only accessible by the current user, creating it if necessary.
+    Raises OSError if that directory is owned by another user.
+
+    """
+
+    if settings.socket_path:
+        return settings.socket_path
+
+    directory = private_directory(private_temporary_directory(
+            'newrelic-aggregator'))
+
+    return os.path.join(directory, 'aggregator.sock')
+
+
+def peer_uid(sock):
+    """Returns the user ID of the process at the other end of the Unix
+    domain socket, or None where this cannot be determined on this
+    platform.
+
+    """
+
+    option = getattr(socket, 'SO_PEERCRED', None)
+
+    if option is None:
+        return None
+
+    credentials = sock.getsockopt(socket.SOL_SOCKET, option,
+            _PEER_CREDENTIALS.size)
+
+    return _PEER_CREDENTIALS.unpack(credentials)[1]
+
+
+def encode_frame(envelope, data):
+    """Encodes the envelope and the forwarded data of the stats engine
+    snapshot as a frame for sending to the aggregator.
+
+    """
+
+    envelope = json_encode(envelope).encode('utf-8')
+    snapshot = encode_snapshot(data)
+
+    return b''.join((_FRAME_HEADER.pack(len(envelope), len(snapshot)),
+            envelope, snapshot))
+
+
+def _read_exactly(sock, length):
+    chunks = []
+
+    while length:
+        chunk = sock.recv(min(length, 64 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    """Reads the next frame from the socket, returning the envelope with
+    the decoded forwarded data added as 'stats'. Returns None if the peer
+    closed the connection.
+
+    """
+
+    header = _read_exactly(sock, _FRAME_HEADER.size)
+
+    if header is None:
+        return None
+
+    envelope_length, snapshot_length = _FRAME_HEADER.unpack(header)
+
+    data = _read_exactly(sock, envelope_length + snapshot_length)
+
+    if data is None:
+        return None
+
+    message = json_decode(data[:envelope_length].decode('utf-8'))
+    message['stats'] = decode_snapshot(data[envelope_length:])
+
+    return message
+
+
+class AggregatorClient(object):
+
+    """Connection from a worker process to the local aggregator. The
+    connection is created on first use and is re-created where it is
+    found to be broken, or where it was inherited from a parent process
+    across a fork.
+
+    """
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._socket = None
+        self._pid = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+
+        try:
+            sock.connect(self.path)
+
+            # The data is only forwarded to an aggregator running as the
+            # same user, so that another user who managed to create the
+            # socket first cannot receive it. Where the user of the peer
+            # cannot be determined, the owner of the socket is checked.
+
+            uid = peer_uid(sock)
+
+            if uid is None:
+                uid = os.lstat(self.path).st_uid
+
+            if uid != os.getuid():
+                raise RuntimeError('Aggregator is not running as the '
+                        'current user.')
+
+        except Exception:
+            sock.close()
+            raise
+
+        return sock
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._socket is not None and self._pid == os.getpid():
+            try:
+                self._socket.close()
+            except Exception:
+                pass
+
+        self._socket = None
+        self._pid = None
+
+    def forward(self, app_name, data, linked_applications=(),
+            transaction_count=0):
+        """Forwards the data for a stats engine snapshot, as returned by
+        its forwarded_data() method, to the aggregator. Returns False if
+        the snapshot could not be sent, in which case the caller remains
+        responsible for the data. This includes where the aggregator
+        rejected the snapshot.
+
+        """
+
+        envelope = {
+            'app_name': app_name,
+            'linked_applications': list(linked_applications),
+            'pid': os.getpid(),
+            'transaction_count': transaction_count,
+        }
+
+        try:
+            frame = encode_frame(envelope, data)
+        except Exception:
+            _logger.exception('Unable to encode harvest snapshot for %r '
+                    'for forwarding to the aggregator. Please report '
+                    'this problem to New Relic support for further '
+                    'investigation.', app_name)
+            return False
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._socket = None
+
+            try:
+                if self._socket is None:
+                    self._socket = self._connect()
+                    self._pid = os.getpid()
+
+                self._socket.sendall(frame)
+
+                reply = self._socket.recv(1)
+
+                if reply == _REJECTION:
+                    _logger.debug('Harvest snapshot for %r was rejected by '
+                            'the aggregator at %r.', app_name, self.path)
+
+                    internal_count_metric('Supportability/Python/'
+                            'Aggregator/Rejected', 1)
+
+                    return False
+
+                if reply != _ACKNOWLEDGMENT:
+                    raise RuntimeError('Connection closed by aggregator.')
+
+            except Exception:
+                _logger.debug('Unable to forward harvest snapshot for %r '
+                        'to the aggregator at %r.', app_name, self.path,
+                        exc_info=True)
+
+                self._close()
+
+                internal_count_metric('Supportability/Python/Aggregator/'
+                        'Unavailable', 1)
+
+                return False
+
+        internal_count_metric('Supportability/Python/Aggregator/'
+                'Forwarded', 1)
+        internal_metric('Supportability/Python/Aggregator/Bytes',
+                len(frame))
+
+        return True
+
+
+class AggregatorServer(object):
+
+    """Listens on a Unix domain socket for harvest snapshots forwarded
+    by worker processes, passing each to the merge callback along with
+    the name of the application it is for. The merge callback returns
+    False where the snapshot could not be merged, in which case the
+    snapshot is rejected so the worker remains responsible for it.
+
+    """
+
+    def __init__(self, path, merge):
+        self.path = path
+        self._merge = merge
+
+        self._socket = None
+        self._thread = None
+        self._shutdown = False
+
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only processes run as the same user may forward data. The
+        # umask is applied so the socket is never accessible by anyone
+        # else, even briefly.
+
+        umask = os.umask(0o177)
+
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+
+        sock.listen(128)
+
+        self._socket = sock
+
+        self._thread = threading.Thread(target=self._run,
+                name='NR-Aggregator/%s' % self.path)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._shutdown = True
+
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+            self._socket.close()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        # Any open connections are closed so that workers do not forward
+        # any more snapshots which will never be merged.
+
+        with self._lock:
+            connections = list(self._connections)
+
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _run(self):
+        while not self._shutdown:
+            try:
+                connection, _ = self._socket.accept()
+            except Exception:
+                if self._shutdown:
+                    return
+                _logger.debug('Unable to accept connection for the '
+                        'aggregator at %r.', self.path, exc_info=True)
+                continue
+
+            thread = threading.Thread(target=self._handle,
+                    args=(connection,), name='NR-Aggregator-Worker')
+            thread.setDaemon(True)
+            thread.start()
+
+    def _handle(self, connection):
+        with self._lock:
+            self._connections.add(connection)
+
+        try:
+            uid = peer_uid(connection)
+
+            if uid is not None and uid != os.getuid():
+                _logger.warning('Rejected connection to the aggregator at '
+                        '%r from a process running as user ID %r. Worker '
+                        'processes must run as the same user as the '
+                        'aggregator.', self.path, uid)
+                return
+
+            while not self._shutdown:
+                message = read_frame(connection)
+
+                if message is None:
+                    return
+
+                # A snapshot which can't be merged is rejected, so that
+                # the worker process reports the data itself. Nothing is
+                # merged where the snapshot is malformed.
+
+                try:
+                    merged = self._merge(message['app_name'], message)
+                except Exception:
+                    merged = False
+                    _logger.exception('Unable to merge harvest snapshot '
+                            'forwarded by process %r for %r. Please report '
+                            'this problem to New Relic support for further '
+                            'investigation.', message.get('pid'),
+                            message.get('app_name'))
+
+                if merged is False:
+                    connection.sendall(_REJECTION)
+                else:
+                    connection.sendall(_ACKNOWLEDGMENT)
+
+        except Exception:
+            _logger.debug('Connection to the aggregator at %r was closed '
+                    'unexpectedly.', self.path, exc_info=True)
+
+        finally:
+            with self._lock:
+                self._connections.discard(connection)
+
+            connection.close()
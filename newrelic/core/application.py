@@ -37,17 +37,63 @@ from newrelic.network.exceptions import (ForceAgentRestart,
 from newrelic.core.environment import environment_settings
 from newrelic.core.rules_engine import RulesEngine, SegmentCollapseEngine
 from newrelic.core.stats_engine import StatsEngine, CustomMetrics
+from newrelic.core.aggregator import AggregatorClient, socket_path_for
+from newrelic.core.harvest_pipeline import (HarvestJob, HarvestPipeline,
+        HarvestSends)
 from newrelic.core.internal_metrics import (InternalTrace,
         InternalTraceContext, internal_metric, internal_count_metric)
 from newrelic.core.profile_sessions import profile_session_manager
 
-from newrelic.core.database_utils import SQLConnections
+from newrelic.core.database_utils import (explain_plan_cache_metrics,
+        explain_plan_connections, explain_plan_worker_metrics,
+        sql_statement_cache_metrics)
 from newrelic.common.object_names import callable_name
-from newrelic.core.adaptive_sampler import AdaptiveSampler
+from newrelic.core.adaptive_sampler import (AdaptiveSampler,
+        ShardedAdaptiveSampler)
 
 _logger = logging.getLogger(__name__)
 
 
+class StatsEngineShard(object):
+
+    """Holds a long lived stats engine owned by a single thread. The
+    transactions for the thread are merged into the shard and the data is
+    only moved into the application stats engine at the time of a
+    harvest. The lock is only ever contended by the harvest thread.
+
+    """
+
+    def __init__(self, stats_engine):
+        self.lock = threading.Lock()
+        self.thread = threading.current_thread()
+        self.stats_engine = stats_engine
+        self.transaction_count = 0
+        self.last_transaction = 0.0
+        self.retired = False
+
+    def detach(self, stats_engine):
+        """Swaps in a new empty stats engine, returning the prior stats
+        engine along with the transaction count and time of the last
+        transaction recorded against it. A shard which has recorded no
+        transactions since it was last detached is retired, and must not
+        be recorded into again.
+
+        """
+
+        with self.lock:
+            result = (self.stats_engine, self.transaction_count,
+                    self.last_transaction)
+
+            if not self.transaction_count:
+                self.retired = True
+
+            self.stats_engine = stats_engine
+            self.transaction_count = 0
+            self.last_transaction = 0.0
+
+        return result
+
+
 class Application(object):
 
     """Class which maintains recorded data for a single application.
@@ -96,6 +142,15 @@ class Application(object):
         self._stats_custom_lock = threading.RLock()
         self._stats_custom_engine = StatsEngine()
 
+        self._stats_shards_lock = threading.Lock()
+        self._stats_shards = []
+        self._stats_shards_local = threading.local()
+
+        self._harvest_pipeline = None
+        self._deferred_shutdown = None
+
+        self._aggregator_client = None
+
         self._agent_commands_lock = threading.Lock()
         self._data_samplers_lock = threading.Lock()
         self._data_samplers_started = False
@@ -474,12 +529,24 @@ class Application(object):
                     configuration,
                     reset_stream=True)
 
+            # Discard any per thread stats engines as they would hold
+            # data and settings from the prior agent run.
+
+            with self._stats_shards_lock:
+                self._stats_shards = []
+                self._stats_shards_local = threading.local()
+
             if configuration.serverless_mode.enabled:
                 sampling_target_period = 60.0
             else:
                 sampling_target_period = \
                     configuration.sampling_target_period_in_seconds
-            self.adaptive_sampler = AdaptiveSampler(
+            if configuration.adaptive_sampler.sharded:
+                sampler_type = ShardedAdaptiveSampler
+            else:
+                sampler_type = AdaptiveSampler
+
+            self.adaptive_sampler = sampler_type(
                     configuration.sampling_target,
                     sampling_target_period)
 
@@ -823,6 +890,9 @@ class Application(object):
 
         self.validate_process()
 
+        if settings.stats_engine.sharded:
+            return self._record_transaction_sharded(data, settings)
+
         internal_metrics = CustomMetrics()
 
         with InternalTraceContext(internal_metrics):
@@ -834,7 +904,8 @@ class Application(object):
                     # don't unnecessarily lock out another thread.
 
                     stats = self._stats_engine.create_workarea()
-                    stats.record_transaction(data)
+                    stats.record_transaction(data,
+                            self._stats_engine.span_events.minimum_priority)
 
                 except Exception:
                     _logger.exception('The generation of transaction data has '
@@ -872,6 +943,133 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
+    def _stats_shard(self):
+        """Returns the stats engine shard for the current thread, creating
+        and registering it with the application if this is the first
+        transaction recorded by the thread, or if the prior shard for the
+        thread has since been retired.
+
+        """
+
+        local = self._stats_shards_local
+
+        shard = getattr(local, 'shard', None)
+
+        if shard is not None and not shard.retired:
+            return shard
+
+        shard = StatsEngineShard(self._stats_engine.create_workarea())
+
+        with self._stats_shards_lock:
+            if local is self._stats_shards_local:
+                self._stats_shards.append(shard)
+
+        local.shard = shard
+
+        return shard
+
+    def _record_transaction_sharded(self, data, settings):
+        """Record a single transaction into the stats engine shard for the
+        current thread. No application wide lock is acquired, the data
+        being merged into the application stats engine at harvest time.
+
+        """
+
+        shard = self._stats_shard()
+
+        internal_metrics = CustomMetrics()
+
+        with InternalTraceContext(internal_metrics):
+            with InternalTrace('Supportability/Python/RecordTransaction/Calls/record'):
+                # The transaction is still recorded into a workarea of its
+                # own, as the events for the transaction are created from
+                # the metrics in the stats table it is recorded into. The
+                # stats table of the shard holds the metrics for all prior
+                # transactions recorded by the thread.
+
+                stats = self._stats_engine.create_workarea()
+
+                try:
+                    stats.record_transaction(data,
+                            shard.stats_engine.span_events.minimum_priority)
+
+                except Exception:
+                    _logger.exception('The generation of transaction data '
+                            'has failed. This would indicate some sort of '
+                            'internal implementation issue with the agent. '
+                            'Please report this problem to New Relic '
+                            'support for further investigation.')
+
+                    if settings.debug.record_transaction_failure:
+                        raise
+
+        # The shard may be retired by the harvest thread before its lock
+        # is acquired, in which case a new shard is registered for the
+        # thread.
+
+        shard.lock.acquire()
+
+        while shard.retired:
+            shard.lock.release()
+            shard = self._stats_shard()
+            shard.lock.acquire()
+
+        try:
+            shard.transaction_count += 1
+            shard.last_transaction = data.end_time
+
+            shard.stats_engine.merge(stats)
+
+            shard.stats_engine.merge_custom_metrics(
+                    internal_metrics.metrics())
+
+        finally:
+            shard.lock.release()
+
+    def _merge_stats_shards(self):
+        """Moves the data accumulated in the per thread stats engine shards
+        into the application stats engine. Must be called with the stats
+        lock held. Shards owned by threads which have since exited, or
+        which recorded nothing over the harvest period, are discarded once
+        their data has been merged.
+
+        """
+
+        with self._stats_shards_lock:
+            shards = list(self._stats_shards)
+
+        if not shards:
+            return
+
+        # Work out which threads have exited before detaching, so that
+        # a thread can't record further data into a shard after we have
+        # decided to discard it.
+
+        exited = [shard for shard in shards if not shard.thread.is_alive()]
+
+        for shard in shards:
+            stats, transaction_count, last_transaction = shard.detach(
+                    self._stats_engine.create_workarea())
+
+            self._transaction_count += transaction_count
+            self._last_transaction = max(self._last_transaction,
+                    last_transaction)
+
+            self._stats_engine.merge_shard(stats)
+
+        # Under gevent and eventlet each greenlet has its own shard, and
+        # as the dummy thread object for a greenlet is always reported
+        # as alive, the idle shards must also be discarded else a shard
+        # would be retained for every greenlet ever run.
+
+        discarded = [shard for shard in shards
+                if shard.retired or shard in exited]
+
+        if discarded:
+            with self._stats_shards_lock:
+                self._stats_shards = [shard for shard in self._stats_shards
+                        if shard not in discarded]
+
     def cmd_start_profiler(self, command_id=0, **kwargs):
         """Triggered by the start_profiler agent command to start a
         thread profiling session.
@@ -977,7 +1175,26 @@ class Application(object):
         if shutdown:
             self._pending_shutdown = True
 
-        if not self._active_session or not self._harvest_enabled:
+        # Where the data collector asked for the session to be restarted
+        # or disconnected while sending from the sender thread of the
+        # harvest pipeline, the shutdown is made here.
+
+        deferred_shutdown = self._deferred_shutdown
+
+        if deferred_shutdown is not None:
+            self._deferred_shutdown = None
+
+            session, restart = deferred_shutdown
+
+            if session is self._active_session:
+                self.internal_agent_shutdown(restart=restart)
+
+            if self._agent_shutdown:
+                return
+
+        session = self._active_session
+
+        if not session or not self._harvest_enabled:
             _logger.debug('Cannot perform a data harvest for %r as '
                     'there is no active session.', self._app_name)
 
@@ -1003,16 +1220,21 @@ class Application(object):
 
                 _logger.debug('Snapshotting for harvest[%s] of %r.', call_metric, self._app_name)
 
-                configuration = self._active_session.configuration
-                transaction_count = self._transaction_count
+                configuration = session.configuration
 
                 with self._stats_lock:
+                    self._merge_stats_shards()
+
+                    transaction_count = self._transaction_count
+
                     self._transaction_count = 0
 
                     self._last_transaction = 0.0
 
                     stats = self._stats_engine.harvest_snapshot(flexible)
 
+                global_events_account = 0
+
                 if not flexible:
                     with self._stats_custom_lock:
                         global_events_account = self._global_events_account
@@ -1086,402 +1308,686 @@ class Application(object):
                                     'Supportability/Uninstrumented/'
                                     '%s' % uninstrumented, 1)
 
+                    # Report how effective the caches of SQL statements
+                    # and explain plans have been since the last harvest.
+
+                    for name, count in sql_statement_cache_metrics():
+                        internal_count_metric(name, count)
+
+                    for name, count in explain_plan_cache_metrics():
+                        internal_count_metric(name, count)
+
+                    for name, count in explain_plan_worker_metrics():
+                        internal_count_metric(name, count)
+
                 # Create our time stamp as to when this reporting period
                 # ends and start reporting the data.
 
                 period_end = time.time()
 
-                # If this harvest is being forcibly triggered on process
-                # shutdown, there are transactions recorded, and the
-                # duration of the harvest period is less than 1 second,
-                # then artificially push out the end time of the harvest
-                # period. This is done so that the harvest period is not
-                # less than 1 second, otherwise the data collector will
-                # throw the data away. This is desirable for case where
-                # trying to monitor scripts which perform a one off task
-                # and then immediately exit. Also useful when running
-                # test scripts.
-
-                if shutdown and (transaction_count or global_events_account):
-                    if period_end - self._period_start < 1.0:
-                        _logger.debug('Stretching harvest duration for '
-                                'forced harvest on shutdown.')
-                        period_end = self._period_start + 1.001
+                job = HarvestJob(session=session,
+                        configuration=configuration, stats=stats,
+                        flexible=flexible, shutdown=shutdown,
+                        period_end=period_end,
+                        transaction_count=transaction_count,
+                        global_events_account=global_events_account)
+
+                # Where the harvest pipeline is enabled the snapshot is
+                # handed off to the sender thread for this application,
+                # so that a slow data collector does not delay the
+                # subsequent harvests. A final forced harvest on shutdown
+                # is always sent immediately once any snapshots already
+                # queued have been sent.
+
+                pipeline = self._harvest_pipeline_for(configuration)
+
+                if self._forward_harvest(job):
+                    # Where a local aggregator is in use, it is the
+                    # aggregator which reports the data, so there is
+                    # nothing more to be done by this process.
+
+                    _logger.debug('Forwarded data for harvest[%s] of %r '
+                            'to the aggregator.', call_metric,
+                            self._app_name)
 
-                try:
-                    # Send the transaction and custom metric data.
+                elif pipeline is not None and not shutdown:
+                    depth = pipeline.submit(job)
 
-                    # Send data set for analytics, which is Synthetic analytic
-                    # events, and the sampled data set of regular requests sent
-                    # as separate requests.
+                    if depth is not None:
+                        internal_count_metric('Supportability/Python/'
+                                'Harvest/Pipeline/Queued', 1)
+                        internal_metric('Supportability/Python/Harvest/'
+                                'Pipeline/Depth', depth)
 
-                    synthetics_events = stats.synthetics_events
-                    if synthetics_events:
-                        if synthetics_events.num_samples:
-                            _logger.debug('Sending synthetics event data for '
-                                    'harvest of %r.', self._app_name)
+                    else:
+                        # The sender is not keeping up with the data
+                        # collector. Rather than block the harvest
+                        # thread, we rollback the snapshot into the
+                        # current reporting period so it is included in
+                        # the next harvest.
 
-                            self._active_session.send_transaction_events(
-                                    synthetics_events.sampling_info,
-                                    synthetics_events)
+                        _logger.debug('Harvest pipeline is full. Rolling '
+                                'back data for harvest[%s] of %r.',
+                                call_metric, self._app_name)
 
-                        stats.reset_synthetics_events()
+                        internal_count_metric('Supportability/Python/'
+                                'Harvest/Pipeline/Full', 1)
 
-                    if (configuration.collect_analytics_events and
-                            configuration.transaction_events.enabled):
+                        with self._stats_lock:
+                            self._stats_engine.rollback(stats)
 
-                        transaction_events = stats.transaction_events
+                else:
+                    if pipeline is not None and not pipeline.drain(
+                            configuration.shutdown_timeout):
+                        _logger.debug('Timed out waiting for queued data '
+                                'for harvest of %r to be sent.',
+                                self._app_name)
+
+                    self._send_harvest(job, internal_metrics)
+
+                duration = time.time() - start
+
+                _logger.debug('Completed harvest[%s] for %r in %.2f seconds.',
+                        call_metric, self._app_name, duration)
+
+        # Merge back in statistics recorded about the last harvest
+        # and communication with the data collector. This will be
+        # part of the data for the next harvest period.
+
+        with self._stats_lock:
+            self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
+
+    def _send_harvest(self, job, internal_metrics, deferred=False):
+        """Sends the data from a harvest snapshot to the data collector.
+        This is called directly from harvest(), or from the sender thread
+        when the harvest pipeline is enabled, in which case deferred is
+        True. The data is always sent using the session the snapshot was
+        taken from.
+
+        """
+
+        session = job.session
+        configuration = job.configuration
+        stats = job.stats
+        flexible = job.flexible
+        shutdown = job.shutdown
+        period_end = job.period_end
+        transaction_count = job.transaction_count
+        global_events_account = job.global_events_account
+
+        # If this harvest is being forcibly triggered on process
+        # shutdown, there are transactions recorded, and the
+        # duration of the harvest period is less than 1 second,
+        # then artificially push out the end time of the harvest
+        # period. This is done so that the harvest period is not
+        # less than 1 second, otherwise the data collector will
+        # throw the data away. This is desirable for case where
+        # trying to monitor scripts which perform a one off task
+        # and then immediately exit. Also useful when running
+        # test scripts.
+
+        if shutdown and (transaction_count or global_events_account):
+            if period_end - self._period_start < 1.0:
+                _logger.debug('Stretching harvest duration for '
+                        'forced harvest on shutdown.')
+                period_end = self._period_start + 1.001
+
+        # The sends for the event data, errors and traces are to
+        # independent endpoints, so where enabled these are made
+        # concurrently. Each send only resets the data it reports once
+        # it has succeeded, so that if any fail, only the data for those
+        # endpoints is restored by a rollback. Concurrent sends are not
+        # used when the audit log is enabled as it is not thread safe.
+
+        concurrency = configuration.agent_limits.max_concurrent_sends
+
+        if configuration.audit_log_file:
+            concurrency = 1
+
+        sends = HarvestSends(concurrency, internal_metrics)
+
+        try:
+            # Send the transaction and custom metric data.
+
+            # Send data set for analytics, which is Synthetic analytic
+            # events, and the sampled data set of regular requests sent
+            # as separate requests.
+
+            synthetics_events = stats.synthetics_events
+            if synthetics_events:
+                def _send_synthetics_events():
+                    if synthetics_events.num_samples:
+                        _logger.debug('Sending synthetics event data for '
+                                'harvest of %r.', self._app_name)
+
+                        session.send_transaction_events(
+                                synthetics_events.sampling_info,
+                                synthetics_events)
+
+                    stats.reset_synthetics_events()
+
+                sends.add(_send_synthetics_events)
+
+            if (configuration.collect_analytics_events and
+                    configuration.transaction_events.enabled):
+
+                transaction_events = stats.transaction_events
+
+                if transaction_events:
+                    # As per spec
+                    internal_metric('Supportability/Python/'
+                            'RequestSampler/requests',
+                            transaction_events.num_seen)
+                    internal_metric('Supportability/Python/'
+                            'RequestSampler/samples',
+                            transaction_events.num_samples)
+
+                    def _send_transaction_events():
+                        if transaction_events.num_samples:
+                            _logger.debug('Sending analytics event data '
+                                    'for harvest of %r.', self._app_name)
+
+                            session.send_transaction_events(
+                                    transaction_events.sampling_info,
+                                    transaction_events)
+
+                        stats.reset_transaction_events()
+
+                    sends.add(_send_transaction_events)
+
+            # Send span events
+
+            if (configuration.span_events.enabled and
+                    configuration.collect_span_events and
+                    configuration.distributed_tracing.enabled):
+                if configuration.infinite_tracing.enabled:
+                    span_stream = stats.span_stream
+                    # Only merge stats as part of default harvest
+                    if span_stream and not flexible:
+                        spans_seen, spans_dropped = span_stream.stats()
+                        spans_sent = spans_seen - spans_dropped
+
+                        internal_count_metric(
+                                'Supportability/InfiniteTracing/Span/Seen',
+                                spans_seen)
+                        internal_count_metric(
+                                'Supportability/InfiniteTracing/Span/Sent',
+                                spans_sent)
+                else:
+                    spans = stats.span_events
+                    if spans:
+                        def _send_span_events():
+                            if spans.num_samples > 0:
+                                span_samples = list(spans)
+
+                                _logger.debug(
+                                        'Sending span event data '
+                                        'for harvest of %r.',
+                                        self._app_name)
+
+                                session.send_span_events(
+                                    spans.sampling_info, span_samples)
+                                span_samples = None
 
-                        if transaction_events:
                             # As per spec
-                            internal_metric('Supportability/Python/'
-                                    'RequestSampler/requests',
-                                    transaction_events.num_seen)
-                            internal_metric('Supportability/Python/'
-                                    'RequestSampler/samples',
-                                    transaction_events.num_samples)
-
-                            if transaction_events.num_samples:
-                                _logger.debug('Sending analytics event data '
-                                        'for harvest of %r.', self._app_name)
-
-                                self._active_session.send_transaction_events(
-                                        transaction_events.sampling_info,
-                                        transaction_events)
-
-                            stats.reset_transaction_events()
-
-                    # Send span events
-
-                    if (configuration.span_events.enabled and
-                            configuration.collect_span_events and
-                            configuration.distributed_tracing.enabled):
-                        if configuration.infinite_tracing.enabled:
-                            span_stream = stats.span_stream
-                            # Only merge stats as part of default harvest
-                            if span_stream and not flexible:
-                                spans_seen, spans_dropped = span_stream.stats()
-                                spans_sent = spans_seen - spans_dropped
-
-                                internal_count_metric(
-                                        'Supportability/InfiniteTracing/Span/Seen',
-                                        spans_seen)
-                                internal_count_metric(
-                                        'Supportability/InfiniteTracing/Span/Sent',
-                                        spans_sent)
-                        else:
-                            spans = stats.span_events
-                            if spans:
-                                if spans.num_samples > 0:
-                                    span_samples = list(spans)
+                            spans_seen = spans.num_seen
+                            spans_sampled = spans.num_samples
+                            internal_count_metric(
+                                    'Supportability/SpanEvent/'
+                                    'TotalEventsSeen', spans_seen)
+                            internal_count_metric(
+                                    'Supportability/SpanEvent/'
+                                    'TotalEventsSent', spans_sampled)
+
+                            stats.reset_span_events()
+
+                        sends.add(_send_span_events)
+
+            # Send error events
+
+            if (configuration.collect_error_events and
+                    configuration.error_collector.capture_events and
+                    configuration.error_collector.enabled):
+
+                error_events = stats.error_events
+                if error_events:
+                    def _send_error_events():
+                        num_error_samples = error_events.num_samples
+                        if num_error_samples > 0:
+                            error_event_samples = list(error_events)
 
+                            _logger.debug('Sending error event data '
+                                    'for harvest of %r.', self._app_name)
+
+                            samp_info = error_events.sampling_info
+                            session.send_error_events(
+                                    samp_info,
+                                    error_event_samples)
+                            error_event_samples = None
+
+                        # As per spec
+                        internal_count_metric('Supportability/Events/'
+                                'TransactionError/Seen',
+                                error_events.num_seen)
+                        internal_count_metric('Supportability/Events/'
+                                'TransactionError/Sent', num_error_samples)
+
+                        stats.reset_error_events()
+
+                    sends.add(_send_error_events)
+
+            # Send custom events
+
+            if (configuration.collect_custom_events and
+                    configuration.custom_insights_events.enabled):
+
+                customs = stats.custom_events
+
+                if customs:
+                    def _send_custom_events():
+                        if customs.num_samples > 0:
+                            custom_samples = list(customs)
+
+                            _logger.debug('Sending custom event data '
+                                    'for harvest of %r.', self._app_name)
+
+                            session.send_custom_events(
+                                    customs.sampling_info, custom_samples)
+                            custom_samples = None
+
+                        # As per spec
+                        internal_count_metric('Supportability/Events/'
+                                'Customer/Seen', customs.num_seen)
+                        internal_count_metric('Supportability/Events/'
+                                'Customer/Sent', customs.num_samples)
+
+                        stats.reset_custom_events()
+
+                    sends.add(_send_custom_events)
+
+            # Send the accumulated error data.
+
+            if configuration.collect_errors:
+                error_data = stats.error_data()
+
+                if error_data:
+                    def _send_errors():
+                        _logger.debug('Sending error data for harvest '
+                                'of %r.', self._app_name)
+
+                        session.send_errors(error_data)
+
+                    sends.add(_send_errors)
+
+            if not flexible:
+                if configuration.collect_traces:
+                    connections = explain_plan_connections(
+                            configuration)
+
+                    # The explain plans are generated here using the
+                    # database connections, or collected from the
+                    # explain plan worker, with only the sending of the
+                    # resulting data possibly being deferred.
+
+                    with connections:
+                        if configuration.slow_sql.enabled:
+                            _logger.debug('Processing slow SQL data '
+                                    'for harvest of %r.',
+                                    self._app_name)
+
+                            slow_sql_data = stats.slow_sql_data(
+                                    connections)
+
+                            if slow_sql_data:
+                                def _send_sql_traces():
                                     _logger.debug(
-                                            'Sending span event data '
-                                            'for harvest of %r.',
+                                            'Sending slow SQL data for '
+                                            'harvest of %r.',
                                             self._app_name)
 
-                                    self._active_session.send_span_events(
-                                        spans.sampling_info, span_samples)
-                                    span_samples = None
+                                    session.send_sql_traces(
+                                            slow_sql_data)
 
-                                # As per spec
-                                spans_seen = spans.num_seen
-                                spans_sampled = spans.num_samples
-                                internal_count_metric(
-                                        'Supportability/SpanEvent/'
-                                        'TotalEventsSeen', spans_seen)
-                                internal_count_metric(
-                                        'Supportability/SpanEvent/'
-                                        'TotalEventsSent', spans_sampled)
+                                sends.add(_send_sql_traces)
 
-                                stats.reset_span_events()
+                        slow_transaction_data = (
+                                stats.transaction_trace_data(
+                                connections))
 
-                    # Send error events
+                        if slow_transaction_data:
+                            def _send_transaction_traces():
+                                _logger.debug('Sending slow transaction '
+                                        'data for harvest of %r.',
+                                        self._app_name)
 
-                    if (configuration.collect_error_events and
-                            configuration.error_collector.capture_events and
-                            configuration.error_collector.enabled):
+                                session.send_transaction_traces(
+                                        slow_transaction_data)
 
-                        error_events = stats.error_events
-                        if error_events:
-                            num_error_samples = error_events.num_samples
-                            if num_error_samples > 0:
-                                error_event_samples = list(error_events)
+                            sends.add(_send_transaction_traces)
 
-                                _logger.debug('Sending error event data '
-                                        'for harvest of %r.', self._app_name)
+            # Wait for any sends being made concurrently. If any failed,
+            # the exception for the failure is raised here, before the
+            # metric data for the harvest is sent.
 
-                                samp_info = error_events.sampling_info
-                                self._active_session.send_error_events(
-                                        samp_info,
-                                        error_event_samples)
-                                error_event_samples = None
+            sends.wait()
 
-                            # As per spec
-                            internal_count_metric('Supportability/Events/'
-                                    'TransactionError/Seen',
-                                    error_events.num_seen)
-                            internal_count_metric('Supportability/Events/'
-                                    'TransactionError/Sent', num_error_samples)
+            if not flexible:
+                # Create a metric_normalizer based on normalize_name
+                # If metric rename rules are empty, set normalizer
+                # to None and the stats engine will skip steps as
+                # appropriate.
 
-                            stats.reset_error_events()
+                if self._rules_engine['metric'].rules:
+                    metric_normalizer = partial(self.normalize_name,
+                            rule_type='metric')
+                else:
+                    metric_normalizer = None
 
-                    # Send custom events
+                # Merge all ready internal metrics
+                stats.merge_custom_metrics(internal_metrics.metrics())
 
-                    if (configuration.collect_custom_events and
-                            configuration.custom_insights_events.enabled):
+                # Clear sent internal metrics
+                internal_metrics.reset_metric_stats()
 
-                        customs = stats.custom_events
+                # Pass the metric_normalizer to stats.metric_data to
+                # do metric renaming.
 
-                        if customs:
-                            if customs.num_samples > 0:
-                                custom_samples = list(customs)
+                _logger.debug('Normalizing metrics for harvest of %r.',
+                        self._app_name)
 
-                                _logger.debug('Sending custom event data '
-                                        'for harvest of %r.', self._app_name)
+                metric_data = stats.metric_data(metric_normalizer)
 
-                                self._active_session.send_custom_events(
-                                        customs.sampling_info, custom_samples)
-                                custom_samples = None
+                _logger.debug('Sending metric data for harvest of %r.',
+                        self._app_name)
 
-                            # As per spec
-                            internal_count_metric('Supportability/Events/'
-                                    'Customer/Seen', customs.num_seen)
-                            internal_count_metric('Supportability/Events/'
-                                    'Customer/Sent', customs.num_samples)
+                # Send metrics
+                session.send_metric_data(
+                        self._period_start, period_end, metric_data)
 
-                            stats.reset_custom_events()
+                _logger.debug('Done sending data for harvest of '
+                        '%r.', self._app_name)
 
-                    # Send the accumulated error data.
+                stats.reset_metric_stats()
 
-                    if configuration.collect_errors:
-                        error_data = stats.error_data()
+                # Successful, we reset the reporting period start time.
+                # If an error occurs after this point,
+                # any remaining data for the period being reported
+                # on will be thrown away. We reset the count of
+                # number of merges we have done due to failures as
+                # only really want to count errors in being able to
+                # report the main transaction metrics.
 
-                        if error_data:
-                            _logger.debug('Sending error data for harvest '
-                                    'of %r.', self._app_name)
+                self._period_start = period_end
 
-                            self._active_session.send_errors(error_data)
+                # Now the data collector has accepted the data for this
+                # harvest, send any harvest data which was written to
+                # the data spool while it could not be reached. This
+                # includes data spooled by prior processes for the same
+                # application.
 
-                    if not flexible:
-                        if configuration.collect_traces:
-                            connections = SQLConnections(
-                                    configuration.agent_limits
-                                    .max_sql_connections)
+                _logger.debug('Replaying data spool for harvest of %r.',
+                        self._app_name)
 
-                            with connections:
-                                if configuration.slow_sql.enabled:
-                                    _logger.debug('Processing slow SQL data '
-                                            'for harvest of %r.',
-                                            self._app_name)
+                session.replay_data_spool()
 
-                                    slow_sql_data = stats.slow_sql_data(
-                                            connections)
+                # Fetch agent commands sent from the data collector
+                # and process them.
 
-                                    if slow_sql_data:
-                                        _logger.debug(
-                                                'Sending slow SQL data for '
-                                                'harvest of %r.',
-                                                self._app_name)
+                _logger.debug('Process agent commands during '
+                        'harvest of %r.', self._app_name)
+                self.process_agent_commands(session)
 
-                                        self._active_session.send_sql_traces(
-                                                slow_sql_data)
+                # Send the accumulated profile data back to the data
+                # collector. Note that this come after we process
+                # the agent commands as we might receive an agent
+                # command to stop the profiling session, but still
+                # send the data back.  Having the sending of the
+                # results last ensures we send back that data from
+                # the stopped profiling session immediately.
 
-                                slow_transaction_data = (
-                                        stats.transaction_trace_data(
-                                        connections))
+                _logger.debug('Send profiling data for harvest of '
+                        '%r.', self._app_name)
 
-                                if slow_transaction_data:
-                                    _logger.debug('Sending slow transaction '
-                                            'data for harvest of %r.',
-                                            self._app_name)
+                self.report_profile_data(session)
 
-                                    self._active_session \
-                                    .send_transaction_traces(
-                                            slow_transaction_data)
+                # in serverless mode finalize after flexible and
+                # default harvests have executed.
+                _logger.debug('Finalizing data.')
+                session.finalize()
 
-                        # Create a metric_normalizer based on normalize_name
-                        # If metric rename rules are empty, set normalizer
-                        # to None and the stats engine will skip steps as
-                        # appropriate.
+            # If this is a final forced harvest for the process
+            # then attempt to shutdown the session.
 
-                        if self._rules_engine['metric'].rules:
-                            metric_normalizer = partial(self.normalize_name,
-                                    rule_type='metric')
-                        else:
-                            metric_normalizer = None
+            if shutdown:
+                self._shutdown_session(session, False, deferred)
 
-                        # Merge all ready internal metrics
-                        stats.merge_custom_metrics(internal_metrics.metrics())
+        except ForceAgentRestart:
+            # The data collector has indicated that we need to
+            # perform an internal agent restart. We attempt to
+            # properly shutdown the session and then initiate a
+            # new session.
 
-                        # Clear sent internal metrics
-                        internal_metrics.reset_metric_stats()
+            self._shutdown_session(session, True, deferred)
 
-                        # Pass the metric_normalizer to stats.metric_data to
-                        # do metric renaming.
+        except ForceAgentDisconnect:
+            # The data collector has indicated that we need to
+            # force disconnect and stop reporting. We attempt to
+            # properly shutdown the session, but don't start a
+            # new one and flag ourselves as shutdown. This
+            # notification is presumably sent when a specific
+            # application is behaving so badly that it needs to
+            # be stopped entirely. It would require a complete
+            # process start to be able to attempt to connect
+            # again and if the server side kill switch is still
+            # enabled it would be told to disconnect once more.
 
-                        _logger.debug('Normalizing metrics for harvest of %r.',
-                                self._app_name)
+            self._shutdown_session(session, False, deferred)
 
-                        metric_data = stats.metric_data(metric_normalizer)
+        except RetryDataForRequest:
+            # A potentially recoverable error occurred. We merge
+            # the stats back into that for the current period
+            # and abort the current harvest if the problem
+            # occurred when initially reporting the main
+            # transaction metrics. If the problem occurred when
+            # reporting other information then that and any
+            # other non reported information is thrown away.
+            #
+            # In order to prevent memory growth will we only
+            # merge data up to a set maximum number of
+            # successive times. When this occurs we throw away
+            # all the metric data and start over. We also only
+            # merge main metric data and discard errors, slow
+            # SQL and transaction traces from older harvest
+            # period.
 
-                        _logger.debug('Sending metric data for harvest of %r.',
-                                self._app_name)
+            exc_type = sys.exc_info()[0]
 
-                        # Send metrics
-                        self._active_session.send_metric_data(
-                                self._period_start, period_end, metric_data)
+            internal_metric('Supportability/Python/Harvest/'
+                    'Exception/%s' % callable_name(exc_type), 1)
 
-                        _logger.debug('Done sending data for harvest of '
-                                '%r.', self._app_name)
+            if self._period_start != period_end:
+                with self._stats_lock:
+                    self._stats_engine.rollback(stats)
 
-                        stats.reset_metric_stats()
+        except DiscardDataForRequest:
+            # An issue must have occurred in reporting the data
+            # but if we retry with same data the same error is
+            # likely to occur again so we just throw any data
+            # not sent away for this reporting period.
 
-                        # Successful, we reset the reporting period start time.
-                        # If an error occurs after this point,
-                        # any remaining data for the period being reported
-                        # on will be thrown away. We reset the count of
-                        # number of merges we have done due to failures as
-                        # only really want to count errors in being able to
-                        # report the main transaction metrics.
+            exc_type = sys.exc_info()[0]
 
-                        self._period_start = period_end
+            internal_metric('Supportability/Python/Harvest/'
+                    'Exception/%s' % callable_name(exc_type), 1)
 
-                        # Fetch agent commands sent from the data collector
-                        # and process them.
+            self._discard_count += 1
 
-                        _logger.debug('Process agent commands during '
-                                'harvest of %r.', self._app_name)
-                        self.process_agent_commands()
+        except Exception:
+            # An unexpected error, likely some sort of internal
+            # agent implementation issue.
 
-                        # Send the accumulated profile data back to the data
-                        # collector. Note that this come after we process
-                        # the agent commands as we might receive an agent
-                        # command to stop the profiling session, but still
-                        # send the data back.  Having the sending of the
-                        # results last ensures we send back that data from
-                        # the stopped profiling session immediately.
+            exc_type = sys.exc_info()[0]
 
-                        _logger.debug('Send profiling data for harvest of '
-                                '%r.', self._app_name)
+            internal_metric('Supportability/Python/Harvest/'
+                    'Exception/%s' % callable_name(exc_type), 1)
 
-                        self.report_profile_data()
+            _logger.exception('Unexpected exception when attempting '
+                    'to harvest the metric data and send it to the '
+                    'data collector. Please report this problem to '
+                    'New Relic support for further investigation.')
 
-                        # in serverless mode finalize after flexible and
-                        # default harvests have executed.
-                        _logger.debug('Finalizing data.')
-                        self._active_session.finalize()
+        # Force close the socket connection which has been
+        # created for this harvest. New connection will be create
+        # automatically on the next harvest.
 
-                    # If this is a final forced harvest for the process
-                    # then attempt to shutdown the session.
+        session.close_connection()
 
-                    if shutdown:
-                        self.internal_agent_shutdown(restart=False)
+    def _shutdown_session(self, session, restart, deferred):
+        """Shuts down the session when the data collector has asked for
+        a restart or disconnect, or on the final harvest. Where deferred,
+        being on the sender thread of the harvest pipeline, the shutdown
+        is handed back to the harvest thread and made at the start of the
+        next harvest, so the session is never shut down while the harvest
+        thread is using it. A disconnect takes precedence over a restart.
 
-                except ForceAgentRestart:
-                    # The data collector has indicated that we need to
-                    # perform an internal agent restart. We attempt to
-                    # properly shutdown the session and then initiate a
-                    # new session.
+        """
 
-                    self.internal_agent_shutdown(restart=True)
+        if not deferred:
+            self.internal_agent_shutdown(restart=restart)
 
-                except ForceAgentDisconnect:
-                    # The data collector has indicated that we need to
-                    # force disconnect and stop reporting. We attempt to
-                    # properly shutdown the session, but don't start a
-                    # new one and flag ourselves as shutdown. This
-                    # notification is presumably sent when a specific
-                    # application is behaving so badly that it needs to
-                    # be stopped entirely. It would require a complete
-                    # process start to be able to attempt to connect
-                    # again and if the server side kill switch is still
-                    # enabled it would be told to disconnect once more.
-
-                    self.internal_agent_shutdown(restart=False)
-
-                except RetryDataForRequest:
-                    # A potentially recoverable error occurred. We merge
-                    # the stats back into that for the current period
-                    # and abort the current harvest if the problem
-                    # occurred when initially reporting the main
-                    # transaction metrics. If the problem occurred when
-                    # reporting other information then that and any
-                    # other non reported information is thrown away.
-                    #
-                    # In order to prevent memory growth will we only
-                    # merge data up to a set maximum number of
-                    # successive times. When this occurs we throw away
-                    # all the metric data and start over. We also only
-                    # merge main metric data and discard errors, slow
-                    # SQL and transaction traces from older harvest
-                    # period.
+        elif self._deferred_shutdown is None or not restart:
+            self._deferred_shutdown = (session, restart)
 
-                    exc_type = sys.exc_info()[0]
+    def _harvest_pipeline_for(self, configuration):
+        """Returns the harvest pipeline for the application, creating it
+        if necessary, or None if the harvest pipeline is not enabled.
 
-                    internal_metric('Supportability/Python/Harvest/'
-                            'Exception/%s' % callable_name(exc_type), 1)
+        """
 
-                    if self._period_start != period_end:
-                        self._stats_engine.rollback(stats)
+        if (not configuration.harvest_pipeline.enabled or
+                configuration.serverless_mode.enabled):
+            return None
 
-                except DiscardDataForRequest:
-                    # An issue must have occurred in reporting the data
-                    # but if we retry with same data the same error is
-                    # likely to occur again so we just throw any data
-                    # not sent away for this reporting period.
+        pipeline = self._harvest_pipeline
 
-                    exc_type = sys.exc_info()[0]
+        if pipeline is None or not pipeline.active:
+            pipeline = self._harvest_pipeline = HarvestPipeline(
+                    self._app_name, configuration.harvest_pipeline.queue_size,
+                    self._send_harvest_job)
 
-                    internal_metric('Supportability/Python/Harvest/'
-                            'Exception/%s' % callable_name(exc_type), 1)
+        return pipeline
 
-                    self._discard_count += 1
+    def _forward_harvest(self, job):
+        """Forwards the harvest snapshot to the local aggregator where
+        one is in use. Returns False if the aggregator is not in use or
+        could not be reached, in which case the snapshot should be
+        reported by this process.
 
-                except Exception:
-                    # An unexpected error, likely some sort of internal
-                    # agent implementation issue.
+        """
 
-                    exc_type = sys.exc_info()[0]
+        aggregator_settings = job.configuration.aggregator
 
-                    internal_metric('Supportability/Python/Harvest/'
-                            'Exception/%s' % callable_name(exc_type), 1)
+        if (not aggregator_settings.enabled or
+                job.configuration.serverless_mode.enabled):
+            return False
 
-                    _logger.exception('Unexpected exception when attempting '
-                            'to harvest the metric data and send it to the '
-                            'data collector. Please report this problem to '
-                            'New Relic support for further investigation.')
+        if self._aggregator_client is None:
+            try:
+                path = socket_path_for(aggregator_settings)
 
-                duration = time.time() - start
+            except (IOError, OSError):
+                _logger.debug('Unable to determine the socket for the '
+                        'aggregator for %r.', self._app_name, exc_info=True)
 
-                _logger.debug('Completed harvest[%s] for %r in %.2f seconds.',
-                        call_metric, self._app_name, duration)
+                internal_count_metric('Supportability/Python/Aggregator/'
+                        'Unavailable', 1)
 
-                # Force close the socket connection which has been
-                # created for this harvest if session still exists.
-                # New connection will be create automatically on the
-                # next harvest.
+                return False
 
-                if self._active_session:
-                    self._active_session.close_connection()
+            self._aggregator_client = AggregatorClient(path,
+                    aggregator_settings.timeout)
 
-        # Merge back in statistics recorded about the last harvest
-        # and communication with the data collector. This will be
-        # part of the data for the next harvest period.
+        # The slow SQL and transaction trace data is rendered here, as
+        # the database connections needed for explain plans are only
+        # available in this process.
+
+        if not job.flexible and job.configuration.collect_traces:
+            connections = explain_plan_connections(job.configuration)
+
+            with connections:
+                data = job.stats.forwarded_data(connections)
+
+        else:
+            data = job.stats.forwarded_data()
+
+        return self._aggregator_client.forward(self._app_name, data,
+                self._linked_applications, job.transaction_count)
+
+    def merge_forwarded_harvest(self, message):
+        """Merges a harvest snapshot forwarded by a worker process into
+        the data for the current reporting period of this application.
+        This is used by the local aggregator process. Returns False if
+        there is no active session, in which case the data is not merged.
+
+        """
+
+        if not self._active_session:
+            return False
+
+        transaction_count = int(message.get('transaction_count', 0))
+
+        with self._stats_lock:
+            self._stats_engine.merge_forwarded_data(message['stats'])
+            self._transaction_count += transaction_count
+
+        return True
+
+    def _send_harvest_job(self, job, queue_time):
+        """Called from the sender thread of the harvest pipeline to send
+        a queued harvest snapshot.
+
+        """
+
+        internal_metrics = CustomMetrics()
+
+        call_metric = 'flexible' if job.flexible else 'default'
+
+        with InternalTraceContext(internal_metrics):
+            internal_metric('Supportability/Python/Harvest/Pipeline/'
+                    'QueueTime/' + call_metric, queue_time)
+
+            # If the session the snapshot was taken from has since been
+            # shutdown or restarted, or is waiting on the harvest thread
+            # to do so, the data can no longer be reported.
+
+            if (self._agent_shutdown or self._deferred_shutdown is not None
+                    or job.session is not self._active_session):
+                _logger.debug('Discarding data for harvest[%s] of %r as '
+                        'the session is no longer active.', call_metric,
+                        self._app_name)
+
+            else:
+                with InternalTrace('Supportability/Python/Harvest/'
+                        'Send/' + call_metric):
+                    self._send_harvest(job, internal_metrics,
+                            deferred=True)
 
         with self._stats_lock:
             self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
 
-    def report_profile_data(self):
-        """Report back any profile data.
+    def report_profile_data(self, session=None):
+        """Report back any profile data, using the given session or where
+        not supplied, the active session.
 
         """
 
+        session = session or self._active_session
+
         for profile_data in self.profile_manager.profile_data(self._app_name):
             if profile_data:
                 _logger.debug('Reporting thread profiling session data '
                         'for %r.', self._app_name)
-                self._active_session.send_profile_data(profile_data)
+                session.send_profile_data(profile_data)
 
     def internal_agent_shutdown(self, restart=False):
         """Terminates the active agent session for this application and
@@ -1508,6 +2014,13 @@ class Application(object):
 
         self.stop_data_samplers()
 
+        # Stop the sender thread of the harvest pipeline once any queued
+        # harvest data has been sent. Where the session is being
+        # restarted the pipeline is retained for the new session.
+
+        if self._harvest_pipeline is not None and not restart:
+            self._harvest_pipeline.shutdown()
+
         # Now shutdown the actual agent session.
 
         try:
@@ -1535,11 +2048,14 @@ class Application(object):
         else:
             self._agent_shutdown = True
 
-    def process_agent_commands(self):
-        """Fetches agents commands from data collector and process them.
+    def process_agent_commands(self, session=None):
+        """Fetches agents commands from data collector and process them,
+        using the given session or where not supplied, the active session.
 
         """
 
+        session = session or self._active_session
+
         # We use a lock around this as this will be called just after
         # having registered the agent, as well as during the normal
         # harvest period. We want to avoid a problem if the process is
@@ -1551,7 +2067,7 @@ class Application(object):
 
             _logger.debug('Process agent commands for %r.', self._app_name)
 
-            agent_commands = self._active_session.get_agent_commands()
+            agent_commands = session.get_agent_commands()
 
             if agent_commands is None:
                 return
@@ -1587,4 +2103,4 @@ class Application(object):
                 # Send back any result for the agent command.
 
                 if cmd_res:
-                    self._active_session.send_agent_command_results(cmd_res)
+                    session.send_agent_command_results(cmd_res)
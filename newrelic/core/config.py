@@ -249,6 +249,34 @@ class EventLoopVisibilitySettings(Settings):
     pass
 
 
+class StatsEngineSettings(Settings):
+    pass
+
+
+class HarvestPipelineSettings(Settings):
+    pass
+
+
+class ExplainPlanWorkerSettings(Settings):
+    pass
+
+
+class DataSpoolSettings(Settings):
+    pass
+
+
+class AggregatorSettings(Settings):
+    pass
+
+
+class AdaptiveSamplerSettings(Settings):
+    pass
+
+
+class TraceCacheSettings(Settings):
+    pass
+
+
 class InfiniteTracingSettings(Settings):
     _trace_observer_host = None
 
@@ -335,6 +363,13 @@ _settings.browser_monitoring.attributes = BrowserMonitorAttributesSettings()
 _settings.transaction_name = TransactionNameSettings()
 _settings.transaction_metrics = TransactionMetricsSettings()
 _settings.event_loop_visibility = EventLoopVisibilitySettings()
+_settings.stats_engine = StatsEngineSettings()
+_settings.harvest_pipeline = HarvestPipelineSettings()
+_settings.explain_plan_worker = ExplainPlanWorkerSettings()
+_settings.data_spool = DataSpoolSettings()
+_settings.aggregator = AggregatorSettings()
+_settings.trace_cache = TraceCacheSettings()
+_settings.adaptive_sampler = AdaptiveSamplerSettings()
 _settings.rum = RumSettings()
 _settings.slow_sql = SlowSqlSettings()
 _settings.agent_limits = AgentLimitsSettings()
@@ -680,12 +715,17 @@ _settings.synthetics.enabled = True
 
 _settings.agent_limits.data_collector_timeout = 30.0
 _settings.agent_limits.transaction_traces_nodes = 2000
+_settings.agent_limits.nodes_per_transaction = 10000
 _settings.agent_limits.sql_query_length_maximum = 16384
 _settings.agent_limits.slow_sql_stack_trace = 30
 _settings.agent_limits.max_sql_connections = 4
 _settings.agent_limits.sql_explain_plans = 30
 _settings.agent_limits.sql_explain_plans_per_harvest = 60
 _settings.agent_limits.slow_sql_data = 10
+_settings.agent_limits.sql_statement_cache_entries = 1000
+_settings.agent_limits.sql_statement_cache_size = 1024 * 1024
+_settings.agent_limits.explain_plan_cache_entries = 100
+_settings.agent_limits.explain_plan_cache_max_age = 5 * 60.0
 _settings.agent_limits.merge_stats_maximum = None
 _settings.agent_limits.errors_per_transaction = 5
 _settings.agent_limits.errors_per_harvest = 20
@@ -695,6 +735,8 @@ _settings.agent_limits.synthetics_events = 200
 _settings.agent_limits.synthetics_transactions = 20
 _settings.agent_limits.data_compression_threshold = 64 * 1024
 _settings.agent_limits.data_compression_level = None
+_settings.agent_limits.payload_chunk_size = 0
+_settings.agent_limits.max_concurrent_sends = 1
 
 _settings.infinite_tracing.trace_observer_host = os.environ.get(
         'NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_HOST', None)
@@ -774,6 +816,44 @@ _settings.aws_lambda_metadata = {}
 _settings.event_loop_visibility.enabled = True
 _settings.event_loop_visibility.blocking_threshold = 0.1
 
+_settings.stats_engine.sharded = _environ_as_bool(
+        'NEW_RELIC_STATS_ENGINE_SHARDED', default=False)
+_settings.stats_engine.compact_metrics = _environ_as_bool(
+        'NEW_RELIC_STATS_ENGINE_COMPACT_METRICS', default=False)
+_settings.stats_engine.incremental_metrics = _environ_as_bool(
+        'NEW_RELIC_STATS_ENGINE_INCREMENTAL_METRICS', default=False)
+_settings.stats_engine.unsampled_metrics_only = _environ_as_bool(
+        'NEW_RELIC_STATS_ENGINE_UNSAMPLED_METRICS_ONLY', default=False)
+
+_settings.harvest_pipeline.enabled = _environ_as_bool(
+        'NEW_RELIC_HARVEST_PIPELINE_ENABLED', default=False)
+_settings.harvest_pipeline.queue_size = 2
+
+_settings.explain_plan_worker.enabled = _environ_as_bool(
+        'NEW_RELIC_EXPLAIN_PLAN_WORKER_ENABLED', default=False)
+_settings.explain_plan_worker.queue_size = 100
+_settings.explain_plan_worker.timeout = 30.0
+
+_settings.data_spool.enabled = _environ_as_bool(
+        'NEW_RELIC_DATA_SPOOL_ENABLED', default=False)
+_settings.data_spool.directory = os.environ.get(
+        'NEW_RELIC_DATA_SPOOL_DIRECTORY', None)
+_settings.data_spool.max_size = 16 * 1024 * 1024
+_settings.data_spool.max_age = 24 * 60 * 60.0
+_settings.data_spool.max_attempts = 5
+
+_settings.aggregator.enabled = _environ_as_bool(
+        'NEW_RELIC_AGGREGATOR_ENABLED', default=False)
+_settings.aggregator.socket_path = os.environ.get(
+        'NEW_RELIC_AGGREGATOR_SOCKET_PATH', None)
+_settings.aggregator.timeout = 1.0
+
+_settings.trace_cache.context_variables = _environ_as_bool(
+        'NEW_RELIC_TRACE_CACHE_CONTEXT_VARIABLES', default=False)
+
+_settings.adaptive_sampler.sharded = _environ_as_bool(
+        'NEW_RELIC_ADAPTIVE_SAMPLER_SHARDED', default=False)
+
 
 def global_settings():
     """This returns the default global settings. Generally only used
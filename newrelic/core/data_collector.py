@@ -53,6 +53,15 @@ class Session(object):
     def close_connection(self):
         self._protocol.close_connection()
 
+    def replay_data_spool(self):
+        """Called once the session has been established to send any
+        harvest data which was written to the data spool while the data
+        collector could not be reached.
+
+        """
+
+        return self._protocol.replay_data_spool()
+
     def connect_span_stream(self, span_iterator, record_metric):
         if not self._rpc:
             host = self.configuration.infinite_tracing.trace_observer_host
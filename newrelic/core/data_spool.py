@@ -0,0 +1,345 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements an on disk spool for harvest payloads which
+could not be sent to the data collector. Payloads are appended to a size
+capped segment file and replayed once a connection to the data collector
+has been re-established.
+
+The payloads hold harvest data, so the spool directory and segment files
+are only accessible by the user the agent is running as, and a spool
+directory owned by any other user is never written to or replayed from.
+
+Each process writes to its own segment file for the application, so that
+worker processes of the same application do not contend on a single
+file. When replaying, the segment files written by any process for the
+application are claimed and replayed, so that data spooled by a process
+which has since exited is not lost.
+
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+
+from newrelic.common.file_utils import (open_private_file,
+        private_directory, private_temporary_directory)
+from newrelic.core.internal_metrics import internal_count_metric
+from newrelic.network.exceptions import (DiscardDataForRequest,
+        ForceAgentDisconnect, ForceAgentRestart, NetworkInterfaceException,
+        RetryDataForRequest)
+
+_logger = logging.getLogger(__name__)
+
+# Each record consists of a fixed size header, followed by the name of
+# the data collector method and the encoded payload. The header holds a
+# magic number and format version, the time the record was first
+# spooled, the number of failed attempts at replaying it, and the
+# lengths of the method name and payload.
+
+_RECORD_MAGIC = b'NRSP'
+_RECORD_VERSION = 1
+_RECORD_HEADER = struct.Struct('!4sBdHHI')
+
+
+class SpooledPayload(object):
+
+    def __init__(self, method, payload, created=None, attempts=0):
+        self.method = method
+        self.payload = payload
+        self.created = created if created is not None else time.time()
+        self.attempts = attempts
+
+    def encode(self):
+        method = self.method.encode('ascii')
+
+        return b''.join((_RECORD_HEADER.pack(_RECORD_MAGIC,
+                _RECORD_VERSION, self.created, self.attempts, len(method),
+                len(self.payload)), method, self.payload))
+
+    def __len__(self):
+        return _RECORD_HEADER.size + len(self.method) + len(self.payload)
+
+
+def read_segment(fp):
+    """Returns the list of records read from the segment file. Reading
+    stops at the first incomplete or invalid record, such as when the
+    process writing the segment file was killed part way through
+    appending a record.
+
+    """
+
+    records = []
+
+    while True:
+        header = fp.read(_RECORD_HEADER.size)
+
+        if len(header) < _RECORD_HEADER.size:
+            break
+
+        (magic, version, created, attempts, method_length,
+                payload_length) = _RECORD_HEADER.unpack(header)
+
+        if magic != _RECORD_MAGIC or version != _RECORD_VERSION:
+            _logger.debug('Invalid record found in data spool segment '
+                    'file %r. Discarding any remaining records.', fp.name)
+            break
+
+        method = fp.read(method_length)
+        payload = fp.read(payload_length)
+
+        if len(method) < method_length or len(payload) < payload_length:
+            break
+
+        records.append(SpooledPayload(method.decode('ascii'), payload,
+                created, attempts))
+
+    return records
+
+
+class DataSpool(object):
+
+    def __init__(self, directory, name, max_size, max_age, max_attempts):
+        self.directory = directory
+        self.name = name
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_application(cls, app_name, settings):
+        """Creates the data spool for the application using the
+        data_spool settings.
+
+        """
+
+        directory = settings.directory or private_temporary_directory(
+                'newrelic-spool')
+
+        name = hashlib.sha1(app_name.encode('utf-8')).hexdigest()[:16]
+
+        return cls(directory, name, settings.max_size, settings.max_age,
+                settings.max_attempts)
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '%s.%d.spool' % (self.name,
+                os.getpid()))
+
+    def _segments(self):
+        return glob.glob(os.path.join(self.directory, '%s.*.spool' %
+                self.name))
+
+    def _write(self, records):
+        private_directory(self.directory)
+
+        with open_private_file(self.path, 'ab') as fp:
+            for record in records:
+                fp.write(record.encode())
+
+    def append(self, method, payload):
+        """Appends the payload for the data collector method to the
+        spool. Returns False where the payload could not be spooled, in
+        which case the caller remains responsible for the data.
+
+        """
+
+        record = SpooledPayload(method, payload)
+
+        with self._lock:
+            try:
+                size = sum(os.path.getsize(path) for path in
+                        self._segments())
+
+                if size + len(record) > self.max_size:
+                    _logger.debug('Data spool for %r is full. Payload for '
+                            '%r will not be spooled.', self.name, method)
+
+                    internal_count_metric('Supportability/Python/'
+                            'DataSpool/Full', 1)
+
+                    return False
+
+                self._write((record,))
+
+            except (IOError, OSError):
+                _logger.debug('Unable to write to data spool %r.',
+                        self.path, exc_info=True)
+
+                return False
+
+        internal_count_metric('Supportability/Python/DataSpool/'
+                'Spooled/%s' % method, 1)
+
+        return True
+
+    def _claim(self):
+        # Segment files are claimed by renaming them, so that where
+        # several processes replay at the same time, each segment file
+        # is only ever replayed by one of them.
+
+        claimed = []
+
+        for path in self._segments():
+            claim = '%s.%d.%d.replay' % (path, os.getpid(),
+                    int(time.time() * 1000))
+
+            try:
+                os.rename(path, claim)
+            except OSError:
+                continue
+
+            claimed.append(claim)
+
+        return claimed
+
+    def replay(self, send):
+        """Replays all spooled payloads by calling send with the method
+        and payload of each in turn, in the order they were spooled.
+        Records which are older than the maximum age are discarded. If a
+        send needs to be retried, or otherwise fails in talking to the
+        data collector, no more sends are attempted and the remaining
+        records are retained, other than those which have been retried
+        the maximum number of times. Where
+        the data collector asks for the agent to restart or disconnect,
+        the remaining records are retained and the exception raised once
+        the spool has been updated. Returns the number of payloads
+        successfully replayed.
+
+        """
+
+        with self._lock:
+            try:
+                private_directory(self.directory)
+
+                claimed = self._claim()
+
+                records = []
+
+                for path in claimed:
+                    with open(path, 'rb') as fp:
+                        records.extend(read_segment(fp))
+
+            except (IOError, OSError):
+                _logger.debug('Unable to read data spool for %r.',
+                        self.name, exc_info=True)
+
+                return 0
+
+            records.sort(key=lambda record: record.created)
+
+            remaining = []
+            replayed = 0
+            retry = False
+            force = None
+            now = time.time()
+
+            for record in records:
+                if retry:
+                    remaining.append(record)
+                    continue
+
+                if now - record.created > self.max_age:
+                    internal_count_metric('Supportability/Python/'
+                            'DataSpool/Expired', 1)
+                    continue
+
+                try:
+                    send(record.method, record.payload)
+
+                except RetryDataForRequest:
+                    # The data collector still cannot accept the data,
+                    # so the remaining records are retained for the
+                    # next replay without attempting to send them.
+
+                    retry = True
+
+                    record.attempts += 1
+
+                    if record.attempts >= self.max_attempts:
+                        internal_count_metric('Supportability/Python/'
+                                'DataSpool/Abandoned', 1)
+                    else:
+                        remaining.append(record)
+
+                except DiscardDataForRequest:
+                    # The data collector has rejected the payload, so it
+                    # is discarded.
+
+                    _logger.debug('Discarding spooled payload for %r.',
+                            record.method, exc_info=True)
+
+                    internal_count_metric('Supportability/Python/'
+                            'DataSpool/Discarded', 1)
+
+                except (ForceAgentRestart, ForceAgentDisconnect) as exc:
+                    # The session is no longer usable, so the records
+                    # are retained for the next session and the request
+                    # to restart or disconnect passed on to the caller.
+
+                    retry = True
+                    force = exc
+
+                    remaining.append(record)
+
+                except NetworkInterfaceException:
+                    # Some other failure in talking to the data
+                    # collector, so the remaining records are retained
+                    # without counting this as a failed attempt.
+
+                    _logger.debug('Unable to replay spooled payload for '
+                            '%r.', record.method, exc_info=True)
+
+                    retry = True
+
+                    remaining.append(record)
+
+                except Exception:
+                    # The payload could not be sent at all, such as where
+                    # it could not be decoded, so it is discarded.
+
+                    _logger.debug('Discarding spooled payload for %r.',
+                            record.method, exc_info=True)
+
+                    internal_count_metric('Supportability/Python/'
+                            'DataSpool/Discarded', 1)
+
+                else:
+                    replayed += 1
+
+            try:
+                if remaining:
+                    self._write(remaining)
+
+                for path in claimed:
+                    os.remove(path)
+
+            except (IOError, OSError):
+                _logger.debug('Unable to update data spool for %r.',
+                        self.name, exc_info=True)
+
+        if replayed:
+            internal_count_metric('Supportability/Python/DataSpool/'
+                    'Replayed', replayed)
+
+        if force is not None:
+            raise force
+
+        return replayed
@@ -61,6 +61,11 @@ class DatabaseNode(_DatabaseNode, DatastoreNodeMixin):
         node.statement = sql_statement(node.sql, node.dbapi2_module)
         return node
 
+    @property
+    def aggregation_key(self):
+        return (DatabaseNode, self.dbapi2_module, self.sql, self.host,
+                self.port_path_or_id, self.database_name)
+
     @property
     def product(self):
         return self.dbapi2_module and self.dbapi2_module._nr_database_product
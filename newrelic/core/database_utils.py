@@ -19,7 +19,10 @@ explain plans for SQL etc.
 
 import logging
 import re
-import weakref
+import threading
+import time
+
+from collections import OrderedDict, deque
 
 import newrelic.packages.six as six
 
@@ -33,6 +36,13 @@ _logger = logging.getLogger(__name__)
 # Obfuscation consists of replacing any quoted strings, integer or float
 # literals with a '?'. For quoted strings which types of quoted strings
 # should be collapsed depend on the database in use.
+#
+# Rather than substituting quoted strings and then scanning the result
+# again for literals, the patterns for both are joined into a single
+# regular expression for each style of quoting, so that the SQL is only
+# scanned once. Because neither a quoted string nor a literal can start
+# within, or extend into, the other, this gives the same result as
+# substituting each in turn.
 
 # See http://stackoverflow.com/questions/6718874.
 #
@@ -42,17 +52,9 @@ _logger = logging.getLogger(__name__)
 
 _single_quotes_p = r"'(?:[^']|'')*?(?:\\'.*|'(?!'))"
 _double_quotes_p = r'"(?:[^"]|"")*?(?:\\".*|"(?!"))'
-_dollar_quotes_p = r'(\$(?!\d)[^$]*?\$).*?(?:\1|$)'
+_dollar_quotes_p = r'(?P<dollar>\$(?!\d)[^$]*?\$).*?(?:(?P=dollar)|$)'
 _oracle_quotes_p = (r"q'\[.*?(?:\]'|$)|q'\{.*?(?:\}'|$)|"
         r"q'\<.*?(?:\>'|$)|q'\(.*?(?:\)'|$)")
-_any_quotes_p = _single_quotes_p + '|' + _double_quotes_p
-_single_dollar_p = _single_quotes_p + '|' + _dollar_quotes_p
-_single_oracle_p = _single_quotes_p + '|' + _oracle_quotes_p
-
-_single_quotes_re = re.compile(_single_quotes_p)
-_any_quotes_re = re.compile(_any_quotes_p)
-_single_dollar_re = re.compile(_single_dollar_p)
-_single_oracle_re = re.compile(_single_oracle_p)
 
 # Cleanup regexes. Presence of a quote will indicate that the now obfuscated
 # sql was actually malformed.
@@ -76,38 +78,62 @@ _single_dollar_cleanup_re = re.compile(_single_dollar_cleanup_p)
 # We add one variation here in that don't want to replace a number that
 # follows on from a ':'. This is because ':1' can be used as positional
 # parameter with database adapters where 'paramstyle' is 'numeric'.
+#
+# Each alternative starts by matching a single character, with any check
+# of the preceding character, such as for a word boundary, done as a look
+# behind after it. This allows the regular expression engine to rule out
+# an alternative from the first character alone, rather than evaluating
+# every alternative at every position in the SQL. As the quoting patterns
+# are case sensitive, case insensitivity is spelt out in each pattern.
+
+_uuid_p = (r'\{(?:[0-9a-fA-F]\-?){32}\}?|'
+        r'[0-9a-fA-F]\-?(?:[0-9a-fA-F]\-?){31}\}?')
+_hex_p = r'0[xX][0-9a-fA-F]+'
+_int_p = (r'-(?<!:-)[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|'
+        r'[0-9](?<![:\w][0-9])[0-9]*(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?')
+_bool_p = (r'[tT](?<!\w[tT])[rR][uU][eE]%(end)s|'
+        r'[fF](?<!\w[fF])[aA][lL][sS][eE]%(end)s|'
+        r'[nN](?<!\w[nN])[uU][lL][lL]%(end)s')
+
+# Join all literals into one regular expression. Longest expressions
+# first to avoid the situation of partial matches on shorter expressions.
+# UUIDs might be an example.
 
-_uuid_p = r'\{?(?:[0-9a-f]\-?){32}\}?'
-_int_p = r'(?<!:)-?\b(?:[0-9]+\.)?[0-9]+(e[+-]?[0-9]+)?'
-_hex_p = r'0x[0-9a-f]+'
-_bool_p = r'\b(?:true|false|null)\b'
+_all_literals_p = '|'.join([_uuid_p, _hex_p, _int_p, _bool_p])
 
-# Join all literals into one compiled regular expression. Longest expressions
-# first to avoid the situation of partial matches on shorter expressions. UUIDs
-# might be an example.
+# As an oracle quoted string starts with a word character, a boolean
+# literal which it immediately follows still needs to be replaced, as
+# it would have been if the quoted string had been replaced first.
+
+
+def _obfuscation_re(quotes_p, literals_end_p=r'\b'):
+    return re.compile(quotes_p + '|' + _all_literals_p % {
+            'end': literals_end_p})
 
-_all_literals_p = '(' + ')|('.join([_uuid_p, _hex_p, _int_p, _bool_p]) + ')'
-_all_literals_re = re.compile(_all_literals_p, re.IGNORECASE)
 
 _quotes_table = {
-    'single': (_single_quotes_re, _single_quotes_cleanup_re),
-    'single+double': (_any_quotes_re, _any_quotes_cleanup_re),
-    'single+dollar': (_single_dollar_re, _single_dollar_cleanup_re),
-    'single+oracle': (_single_oracle_re, _single_quotes_cleanup_re),
+    'single': (_obfuscation_re(_single_quotes_p),
+            _single_quotes_cleanup_re),
+    'single+double': (_obfuscation_re(
+            _single_quotes_p + '|' + _double_quotes_p),
+            _any_quotes_cleanup_re),
+    'single+dollar': (_obfuscation_re(
+            _single_quotes_p + '|' + _dollar_quotes_p),
+            _single_dollar_cleanup_re),
+    'single+oracle': (_obfuscation_re(
+            _single_quotes_p + '|' + _oracle_quotes_p,
+            r'(?:\b|(?=%s))' % _oracle_quotes_p),
+            _single_quotes_cleanup_re),
 }
 
 
 def _obfuscate_sql(sql, database):
-    quotes_re, quotes_cleanup_re = _quotes_table.get(database.quoting_style,
-            (_single_quotes_re, _single_quotes_cleanup_re))
-
-    # Substitute quoted strings first.
+    obfuscation_re, quotes_cleanup_re = _quotes_table.get(
+            database.quoting_style, _quotes_table['single'])
 
-    sql = quotes_re.sub('?', sql)
+    # Substitute quoted strings and all other sensitive fields.
 
-    # Replace all other sensitive fields
-
-    sql = _all_literals_re.sub('?', sql)
+    sql = obfuscation_re.sub('?', sql)
 
     # Determine if the obfuscated query was malformed by searching for
     # remaining quote characters
@@ -117,6 +143,31 @@ def _obfuscate_sql(sql, database):
 
     return sql
 
+# Statements executed with parameters usually contain no literals, with
+# the values being passed separately using placeholders instead. Where
+# the SQL contains no quotes, digits or anything which could be a UUID,
+# the only literals which can be present are booleans and null, so the
+# SQL can be obfuscated without scanning it for everything else.
+# Checking for those characters is much quicker than a full scan, as a
+# match can only start at one of the characters being checked for.
+
+_literal_chars_re = re.compile(r'[0-9\'"$]')
+_literal_uuid_chars_re = re.compile(r'[a-fA-F-][a-fA-F-]{31}')
+_bool_literals_re = re.compile(r'[tTfFnN]'
+        r'(?:(?<=[tT])(?<!\w[tT])[rR][uU][eE]|'
+        r'(?<=[fF])(?<!\w[fF])[aA][lL][sS][eE]|'
+        r'(?<=[nN])(?<!\w[nN])[uU][lL][lL])\b')
+
+
+def _obfuscate_parameterized_sql(sql):
+    # Returns None if the SQL may contain literals other than booleans
+    # and null, in which case it needs to be obfuscated in full.
+
+    if _literal_chars_re.search(sql) or _literal_uuid_chars_re.search(sql):
+        return None
+
+    return _bool_literals_re.sub('?', sql)
+
 # Normalization of the SQL is done so that when we can produce a hash
 # value for a slow SQL such that it generates the same value for two SQL
 # statements where only difference is values that may have been used.
@@ -136,56 +187,41 @@ def _obfuscate_sql(sql, database):
 # then it likely isn't valid in SQL anyway for that param style.
 
 
-_normalize_params_1_p = r'%\([^)]*\)s'
-_normalize_params_1_re = re.compile(_normalize_params_1_p)
-_normalize_params_2_p = r'%s'
-_normalize_params_2_re = re.compile(_normalize_params_2_p)
-_normalize_params_3_p = r':\w+'
-_normalize_params_3_re = re.compile(_normalize_params_3_p)
+_normalize_params_p = r'%\([^)]*\)s|%s|:\w+'
+_normalize_params_re = re.compile(_normalize_params_p)
 
 _normalize_values_p = r'\([^)]+\)'
 _normalize_values_re = re.compile(_normalize_values_p)
 
 _normalize_whitespace_1_p = r'\s+'
 _normalize_whitespace_1_re = re.compile(_normalize_whitespace_1_p)
-_normalize_whitespace_2_p = r'\s+(?!\w)'
+_normalize_whitespace_2_p = r' (?!\w)|(?<!\w) '
 _normalize_whitespace_2_re = re.compile(_normalize_whitespace_2_p)
-_normalize_whitespace_3_p = r'(?<!\w)\s+'
-_normalize_whitespace_3_re = re.compile(_normalize_whitespace_3_p)
 
 
 def _normalize_sql(sql):
-    # Note we that do this as a series of regular expressions as
-    # using '|' in regular expressions is more expensive.
-
-    # Convert param style of '%(name)s' to '?'. We need to do
-    # this before collapsing sets of values to a single value
-    # due to the use of the parenthesis in the param style.
+    # Convert param styles of '%(name)s', '%s', ':1' and ':name' to
+    # '?'. The '%(name)s' param style needs to be converted before
+    # collapsing sets of values to a single value due to the use of
+    # the parenthesis in the param style. None of the param styles
+    # can span a parenthesis so the others can be converted at the
+    # same time.
 
-    sql = _normalize_params_1_re.sub('?', sql)
+    sql = _normalize_params_re.sub('?', sql)
 
     # Collapse any parenthesised set of values to a single value.
 
     sql = _normalize_values_re.sub('(?)', sql)
 
-    # Convert '%s', ':1' and ':name' param styles to '?'.
-
-    sql = _normalize_params_2_re.sub('?', sql)
-    sql = _normalize_params_3_re.sub('?', sql)
-
-    # Strip leading and trailing white space.
-
-    sql = sql.strip()
-
     # Collapse multiple white space to single white space.
 
     sql = _normalize_whitespace_1_re.sub(' ', sql)
 
     # Drop spaces adjacent to identifier except for case where
-    # identifiers follow each other.
+    # identifiers follow each other. This also strips leading and
+    # trailing white space.
 
     sql = _normalize_whitespace_2_re.sub('', sql)
-    sql = _normalize_whitespace_3_re.sub('', sql)
 
     return sql
 
@@ -213,7 +249,13 @@ _uncomment_sql_re = re.compile(_uncomment_sql_x, re.DOTALL)
 
 
 def _uncomment_sql(sql):
-    return _uncomment_sql_re.sub('', sql)
+    # Most SQL contains no comments, in which case there is no need to
+    # scan it with the regular expression.
+
+    if '#' in sql or '--' in sql or '/*' in sql:
+        return _uncomment_sql_re.sub('', sql)
+
+    return sql
 
 # Parser routines for the different SQL statement operation types.
 #
@@ -632,6 +674,11 @@ class SQLConnections(object):
 
         self.connections = []
 
+    def explain_plan(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params):
+        return _explain_plan(self, sql_statement.sql, sql_statement.database,
+                connect_params, cursor_params, sql_parameters, execute_params)
+
     def __enter__(self):
         return self
 
@@ -739,6 +786,106 @@ def _explain_plan(connections, sql, database, connect_params, cursor_params,
     return None
 
 
+def _explain_plan_key(sql_statement, connect_params):
+    # Explain plans are requested with the parameters for connecting to
+    # the database, which may not be hashable, so are keyed by their
+    # representation instead.
+
+    return (sql_statement.identifier, sql_statement.database.client,
+            repr(connect_params))
+
+
+class ExplainPlanCache(object):
+
+    """Cache of the explain plans generated recently, so that the explain
+    plan for a slow SQL statement reported harvest after harvest is only
+    generated again against the database once older than the maximum
+    age. The cache is bounded by the number of explain plans held, with
+    the least recently used evicted first. The explain plans are held
+    before obfuscation, so are keyed by the SQL statement identifier
+    along with the database client and connection parameters.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._plans)
+
+    def _fresh(self, key, maximum_age):
+        # Returns the entry if it is not older than the maximum age,
+        # removing it from the cache either way. Must be called with
+        # the lock held.
+
+        entry = self._plans.pop(key, None)
+
+        if entry is not None:
+            if time.time() - entry[0] <= maximum_age:
+                return entry
+
+            self.evictions += 1
+
+    def contains(self, key, maximum_age):
+        with self._lock:
+            entry = self._fresh(key, maximum_age)
+
+            if entry is not None:
+                self._plans[key] = entry
+                return True
+
+            return False
+
+    def get(self, key, maximum_age):
+        with self._lock:
+            entry = self._fresh(key, maximum_age)
+
+            if entry is not None:
+                self._plans[key] = entry
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+    def put(self, key, details, maximum_entries):
+        with self._lock:
+            self._plans.pop(key, None)
+            self._plans[key] = (time.time(), details)
+
+            while len(self._plans) > maximum_entries:
+                self._plans.popitem(last=False)
+                self.evictions += 1
+
+    def metrics(self):
+        """Returns the supportability metrics for the number of hits,
+        misses and evictions since metrics were last returned.
+
+        """
+
+        with self._lock:
+            counts = (('Hits', self.hits), ('Misses', self.misses),
+                    ('Evictions', self.evictions))
+
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+        return [('Supportability/Python/DatabaseUtils/ExplainPlanCache/%s' %
+                name, count) for name, count in counts if count]
+
+
+_explain_plans = ExplainPlanCache()
+
+
+def explain_plan_cache_metrics():
+    return _explain_plans.metrics()
+
+
 def explain_plan(connections, sql_statement, connect_params, cursor_params,
         sql_parameters, execute_params, sql_format):
 
@@ -757,14 +904,270 @@ def explain_plan(connections, sql_statement, connect_params, cursor_params,
     if sql_statement.operation not in database.explain_stmts:
         return
 
-    details = _explain_plan(connections, sql_statement.sql, database,
-            connect_params, cursor_params, sql_parameters, execute_params)
+    # Where the explain plan for the same statement was generated
+    # recently, it is reused rather than generated again.
+
+    limits = global_settings().agent_limits
+
+    cached = limits.explain_plan_cache_entries > 0
+
+    details = None
+
+    if cached:
+        key = _explain_plan_key(sql_statement, connect_params)
+        details = _explain_plans.get(key,
+                limits.explain_plan_cache_max_age)
+
+    if details is None:
+        details = connections.explain_plan(sql_statement, connect_params,
+                cursor_params, sql_parameters, execute_params)
+
+        if cached and details is not None:
+            _explain_plans.put(key, details,
+                    limits.explain_plan_cache_entries)
 
     if details is not None and sql_format != 'raw':
         return _obfuscate_explain_plan(database, *details)
 
     return details
 
+
+class ExplainPlanWorker(object):
+
+    """Bounded queue of requests for explain plans, serviced by a single
+    dedicated thread, so that the harvest never waits on a round trip to
+    the database. Requests are made as slow SQL is recorded, with the
+    explain plans completed by the worker collected at the next harvest.
+    Requests which have been waiting longer than the timeout by the time
+    the worker reaches them are dropped, and the connections held by the
+    worker are closed once it has been idle for the timeout.
+
+    """
+
+    def __init__(self, maxlen, timeout, maximum_connections):
+        self._maxlen = maxlen
+        self._timeout = timeout
+
+        self._queue = deque()
+        self._notify = threading.Condition()
+        self._pending = set()
+        self._results = {}
+
+        self._dropped = 0
+        self._expired = 0
+
+        self._connections = SQLConnections(maximum_connections)
+
+        self._thread = threading.Thread(target=self._run,
+                name='NR-Explain-Plan-Worker')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._notify:
+            return len(self._queue)
+
+    @property
+    def active(self):
+        return self._thread.is_alive()
+
+    def request(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params):
+        """Queues a request for the explain plan of the SQL statement,
+        unless one is already queued or has completed and is waiting to
+        be collected. Returns False if the queue is already full, in which
+        case the request is dropped.
+
+        """
+
+        key = _explain_plan_key(sql_statement, connect_params)
+
+        with self._notify:
+            if key in self._pending or key in self._results:
+                return True
+
+            if len(self._queue) >= self._maxlen:
+                self._dropped += 1
+                return False
+
+            self._queue.append((time.time(), key, (sql_statement,
+                    connect_params, cursor_params, sql_parameters,
+                    execute_params)))
+            self._pending.add(key)
+            self._notify.notify_all()
+
+            return True
+
+    def collect(self):
+        """Returns a dictionary of the explain plans completed since last
+        collected, keyed the same as the requests. Where the explain plan
+        could not be generated the value is None.
+
+        """
+
+        with self._notify:
+            results, self._results = self._results, {}
+
+        return results
+
+    def metrics(self):
+        """Returns the supportability metrics for the requests dropped
+        since last called, as name and count pairs.
+
+        """
+
+        with self._notify:
+            counts = (('Dropped', self._dropped), ('Expired', self._expired))
+            self._dropped = self._expired = 0
+
+        return [('Supportability/Python/DatabaseUtils/ExplainPlanWorker/%s' %
+                name, count) for name, count in counts if count]
+
+    def _run(self):
+        while True:
+            with self._notify:
+                if not self._queue:
+                    self._notify.wait(self._timeout)
+
+                if not self._queue:
+                    idle = True
+                else:
+                    idle = False
+                    queued_at, key, args = self._queue.popleft()
+
+                    if time.time() - queued_at > self._timeout:
+                        self._pending.discard(key)
+                        self._expired += 1
+                        continue
+
+            details = None
+
+            try:
+                if idle:
+                    if self._connections.connections:
+                        self._connections.cleanup()
+                else:
+                    details = self._connections.explain_plan(*args)
+
+            except Exception:
+                _logger.exception('Unexpected exception when generating '
+                        'explain plans. Please report this problem to New '
+                        'Relic support for further investigation.')
+
+                self._connections.connections = []
+
+            finally:
+                if not idle:
+                    with self._notify:
+                        self._pending.discard(key)
+                        self._results[key] = details
+
+
+class ExplainPlanResults(object):
+
+    """Stands in for the database connections when generating explain
+    plans at harvest time, where the explain plans are being run by the
+    worker. The explain plans completed by the worker are returned, with
+    a request made for any others, so they are available at a later
+    harvest, rather than waiting on the database.
+
+    """
+
+    def __init__(self, worker):
+        self._worker = worker
+        self._results = worker.collect()
+
+    def explain_plan(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params):
+        key = _explain_plan_key(sql_statement, connect_params)
+
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+
+        self._worker.request(sql_statement, connect_params, cursor_params,
+                sql_parameters, execute_params)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, tb):
+        pass
+
+
+_explain_plan_worker = None
+_explain_plan_worker_lock = threading.Lock()
+
+
+def explain_plan_worker(settings):
+    """Returns the explain plan worker for the process, starting it if
+    not already running, such as after the process has been forked.
+
+    """
+
+    global _explain_plan_worker
+
+    worker = _explain_plan_worker
+
+    if worker is not None and worker.active:
+        return worker
+
+    with _explain_plan_worker_lock:
+        if _explain_plan_worker is None or not _explain_plan_worker.active:
+            _explain_plan_worker = ExplainPlanWorker(
+                    settings.explain_plan_worker.queue_size,
+                    settings.explain_plan_worker.timeout,
+                    settings.agent_limits.max_sql_connections)
+
+        return _explain_plan_worker
+
+
+def explain_plan_connections(settings):
+    """Returns what should be used to generate explain plans at harvest
+    time, being the connections to the databases, or where explain plans
+    are being run by the worker, the results collected from it.
+
+    """
+
+    if settings.explain_plan_worker.enabled:
+        return ExplainPlanResults(explain_plan_worker(settings))
+
+    return SQLConnections(settings.agent_limits.max_sql_connections)
+
+
+def explain_plan_worker_metrics():
+    worker = _explain_plan_worker
+
+    if worker is None:
+        return []
+
+    return worker.metrics()
+
+
+def request_explain_plan(settings, sql_statement, connect_params,
+        cursor_params, sql_parameters, execute_params):
+    """Requests the explain plan for the SQL statement from the worker,
+    ahead of the harvest at which it is needed.
+
+    """
+
+    if connect_params is None:
+        return
+
+    if sql_statement.operation not in sql_statement.database.explain_stmts:
+        return
+
+    limits = settings.agent_limits
+
+    if limits.explain_plan_cache_entries > 0 and _explain_plans.contains(
+            _explain_plan_key(sql_statement, connect_params),
+            limits.explain_plan_cache_max_age):
+        return
+
+    explain_plan_worker(settings).request(sql_statement, connect_params,
+            cursor_params, sql_parameters, execute_params)
+
 # Wrapper for information about a specific database.
 
 
@@ -840,6 +1243,11 @@ class SQLStatement(object):
         self.sql = sql
         self.database = database
 
+        # Set when the statement has been executed with parameters, as
+        # a hint that the SQL is likely to contain no literals.
+
+        self.parameterized = False
+
     @property
     def operation(self):
         if self._operation is None:
@@ -861,8 +1269,15 @@ class SQLStatement(object):
     @property
     def obfuscated(self):
         if self._obfuscated is None:
-            self._obfuscated = _uncomment_sql(_obfuscate_sql(self.sql,
-                self.database))
+            obfuscated = None
+
+            if self.parameterized:
+                obfuscated = _obfuscate_parameterized_sql(self.sql)
+
+            if obfuscated is None:
+                obfuscated = _obfuscate_sql(self.sql, self.database)
+
+            self._obfuscated = _uncomment_sql(obfuscated)
         return self._obfuscated
 
     @property
@@ -888,20 +1303,126 @@ class SQLStatement(object):
             return self.obfuscated
 
 
-_sql_statements = weakref.WeakValueDictionary()
+class SQLStatementCache(object):
 
+    """Cache of the SQL statements seen recently, so that a statement
+    which is executed repeatedly is only parsed and obfuscated once.
+    The cache is bounded by both the number of statements and the total
+    length of the SQL held, with the least recently used statements
+    evicted first.
 
-def sql_statement(sql, dbapi2_module):
-    key = (sql, dbapi2_module)
+    A statement is looked up without acquiring the lock, as is done for
+    every database call. Rather than the statement being moved to the end
+    of the eviction order on each use, it is marked as referenced and is
+    given a second chance when it is next due to be evicted. The lock is
+    only acquired when adding a statement to the cache.
 
-    result = _sql_statements.get(key, None)
+    """
 
-    if result is not None:
-        return result
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = OrderedDict()
+        self._referenced = set()
+        self._size = 0
+
+        # The hits are counted without the lock being held, so may be
+        # under reported where statements are used concurrently.
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._statements)
+
+    @property
+    def size(self):
+        return self._size
+
+    def statement(self, sql, dbapi2_module, maximum_entries, maximum_size):
+        key = (sql, dbapi2_module)
+
+        result = self._statements.get(key)
+
+        if result is not None:
+            self._referenced.add(key)
+            self.hits += 1
+            return result
+
+        database = SQLDatabase(dbapi2_module)
+        result = SQLStatement(sql, database)
+
+        with self._lock:
+            self.misses += 1
+
+            # A statement which on its own is larger than the cache
+            # allows is still returned but not retained.
+
+            if maximum_entries < 1 or len(sql) > maximum_size:
+                return result
+
+            # Another thread may have added the same statement since it
+            # was looked up.
+
+            existing = self._statements.get(key)
+
+            if existing is not None:
+                return existing
+
+            self._statements[key] = result
+            self._size += len(sql)
+
+            # Statements used since they were added, or since they were
+            # last given a second chance, are moved to the end of the
+            # eviction order. Each statement is only given one second
+            # chance on each eviction, so the loop always ends.
+
+            chances = len(self._statements)
+
+            while (len(self._statements) > maximum_entries or
+                    self._size > maximum_size):
+                key, statement = self._statements.popitem(last=False)
+
+                if chances and key in self._referenced:
+                    chances -= 1
+                    self._referenced.discard(key)
+                    self._statements[key] = statement
+                    continue
+
+                self._referenced.discard(key)
+                self._size -= len(key[0])
+                self.evictions += 1
+
+            return result
+
+    def metrics(self):
+        """Returns the supportability metrics for the number of hits,
+        misses and evictions since metrics were last returned.
+
+        """
+
+        with self._lock:
+            counts = (('Hits', self.hits), ('Misses', self.misses),
+                    ('Evictions', self.evictions))
+
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+        return [('Supportability/Python/DatabaseUtils/StatementCache/%s' %
+                name, count) for name, count in counts if count]
+
+
+_sql_statements = SQLStatementCache()
+
+
+def sql_statement(sql, dbapi2_module):
+    limits = global_settings().agent_limits
 
-    database = SQLDatabase(dbapi2_module)
-    result = SQLStatement(sql, database)
+    return _sql_statements.statement(sql, dbapi2_module,
+            limits.sql_statement_cache_entries,
+            limits.sql_statement_cache_size)
 
-    _sql_statements[key] = result
 
-    return result
+def sql_statement_cache_metrics():
+    return _sql_statements.metrics()
@@ -28,6 +28,11 @@ _DatastoreNode = namedtuple('_DatastoreNode',
 
 class DatastoreNode(_DatastoreNode, DatastoreNodeMixin):
 
+    @property
+    def aggregation_key(self):
+        return (DatastoreNode, self.product, self.target, self.operation,
+                self.host, self.port_path_or_id, self.database_name)
+
     @property
     def instance_hostname(self):
         if self.host in constants.LOCALHOST_EQUIVALENTS:
@@ -29,6 +29,15 @@ _FunctionNode = namedtuple('_FunctionNode',
 
 class FunctionNode(_FunctionNode, GenericNodeMixin):
 
+    __slots__ = ()
+
+    @property
+    def aggregation_key(self):
+        rollup = self.rollup
+        if rollup is not None and not isinstance(rollup, six.string_types):
+            rollup = tuple(rollup)
+        return (FunctionNode, self.group, self.name, self.label, rollup)
+
     def time_metrics(self, stats, root, parent):
         """Return a generator yielding the timed metrics for this
         function node as well as all the child nodes.
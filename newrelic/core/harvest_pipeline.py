@@ -0,0 +1,248 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the pipeline used to decouple the snapshotting
+of application data at harvest time from the encoding and sending of
+that data to the data collector.
+
+"""
+
+import collections
+import logging
+import sys
+import threading
+import time
+
+import newrelic.packages.six as six
+
+from newrelic.core.internal_metrics import InternalTraceContext
+from newrelic.core.stats_engine import CustomMetrics
+from newrelic.network.exceptions import (ForceAgentRestart,
+        ForceAgentDisconnect, DiscardDataForRequest, RetryDataForRequest)
+
+_logger = logging.getLogger(__name__)
+
+HarvestJob = collections.namedtuple('HarvestJob', ['session',
+        'configuration', 'stats', 'flexible', 'shutdown', 'period_end',
+        'transaction_count', 'global_events_account'])
+
+
+class HarvestPipeline(object):
+
+    """Bounded queue of harvest snapshots waiting to be sent, serviced by
+    a single dedicated sender thread. As there is only the one sender,
+    the snapshots are sent in the order they were taken and the
+    connection to the data collector is never used concurrently.
+
+    """
+
+    def __init__(self, name, maxlen, send):
+        self._name = name
+        self._maxlen = maxlen
+        self._send = send
+
+        self._queue = collections.deque()
+        self._notify = threading.Condition()
+        self._pending = 0
+        self._shutdown = False
+
+        self._thread = threading.Thread(target=self._run,
+                name='NR-Harvest-Sender/%s' % name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._notify:
+            return len(self._queue)
+
+    @property
+    def active(self):
+        return not self._shutdown and self._thread.is_alive()
+
+    def submit(self, job):
+        """Queues the harvest job for sending, returning the depth of the
+        queue after it was added. If the queue is already full, or the
+        pipeline has been shutdown, the job is not queued and None is
+        returned, in which case the caller remains responsible for the
+        data in the job.
+
+        """
+
+        with self._notify:
+            if self._shutdown or len(self._queue) >= self._maxlen:
+                return None
+
+            self._queue.append((time.time(), job))
+            self._pending += 1
+            self._notify.notify_all()
+
+            return len(self._queue)
+
+    def drain(self, timeout=None):
+        """Waits until all queued harvest jobs have been sent. Returns
+        False if the timeout expired before that occurred.
+
+        """
+
+        deadline = timeout is not None and time.time() + timeout or None
+
+        with self._notify:
+            while self._pending and self._thread.is_alive():
+                if deadline is None:
+                    self._notify.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._notify.wait(remaining)
+
+            return not self._pending
+
+    def shutdown(self):
+        """Stops the sender thread once any queued jobs have been sent.
+        The sender thread is not waited upon as this may be called from
+        the sender thread itself.
+
+        """
+
+        with self._notify:
+            self._shutdown = True
+            self._notify.notify_all()
+
+    def _run(self):
+        while True:
+            with self._notify:
+                while not self._queue and not self._shutdown:
+                    self._notify.wait()
+
+                if not self._queue:
+                    return
+
+                queued_at, job = self._queue.popleft()
+
+            try:
+                self._send(job, max(time.time(), queued_at) - queued_at)
+
+            except Exception:
+                _logger.exception('Unexpected exception when sending '
+                        'harvest data for %r. Please report this problem '
+                        'to New Relic support for further investigation.',
+                        self._name)
+
+            finally:
+                with self._notify:
+                    self._pending -= 1
+                    self._notify.notify_all()
+
+
+class HarvestSends(object):
+
+    """Collects the sends for the independent data collector endpoints
+    of a single harvest. Where concurrency is no greater than one, each
+    send is made immediately when added, as for a serial harvest.
+    Otherwise sends are deferred until wait() is called, when they are
+    made concurrently by up to that number of threads.
+
+    Each send is expected to reset the data it reports only once it has
+    succeeded, so that when any of the sends fail, a rollback of the
+    harvest snapshot only restores the data for the failed endpoints.
+
+    """
+
+    # Where more than one send fails, the exception which is raised from
+    # wait() is the first of these in order, so that agent restarts and
+    # disconnects requested by the data collector are always honoured.
+
+    EXCEPTION_PRECEDENCE = (ForceAgentDisconnect, ForceAgentRestart,
+            RetryDataForRequest, DiscardDataForRequest)
+
+    def __init__(self, concurrency=1, internal_metrics=None):
+        self._concurrency = concurrency or 1
+        self._internal_metrics = internal_metrics
+        self._sends = []
+
+    def add(self, send):
+        if self._concurrency <= 1:
+            send()
+        else:
+            self._sends.append(send)
+
+    def _precedence(self, failure):
+        index, exc_info = failure
+
+        for precedence, exc_type in enumerate(self.EXCEPTION_PRECEDENCE):
+            if issubclass(exc_info[0], exc_type):
+                return precedence, index
+
+        return len(self.EXCEPTION_PRECEDENCE), index
+
+    def wait(self):
+        """Makes any deferred sends, waiting for all to complete. If any
+        of the sends failed, the exception for the failed send is raised
+        once all have completed.
+
+        """
+
+        sends, self._sends = self._sends, []
+
+        if not sends:
+            return
+
+        pending = list(reversed(list(enumerate(sends))))
+        failures = []
+        thread_metrics = []
+        lock = threading.Lock()
+
+        def _worker():
+            # Internal metrics are recorded against the current thread,
+            # so each worker records into its own set of metrics which
+            # are merged back together once all sends have completed.
+
+            metrics = CustomMetrics()
+
+            with InternalTraceContext(metrics):
+                while True:
+                    with lock:
+                        if not pending:
+                            break
+                        index, send = pending.pop()
+
+                    try:
+                        send()
+                    except Exception:
+                        with lock:
+                            failures.append((index, sys.exc_info()))
+
+            with lock:
+                thread_metrics.append(metrics)
+
+        threads = []
+
+        for _ in range(min(self._concurrency, len(sends))):
+            thread = threading.Thread(target=_worker, name='NR-Harvest-Send')
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        if self._internal_metrics is not None:
+            for metrics in thread_metrics:
+                self._internal_metrics.merge_custom_metrics(metrics.metrics())
+
+        if failures:
+            exc_info = min(failures, key=self._precedence)[1]
+            failures = None
+            six.reraise(*exc_info)
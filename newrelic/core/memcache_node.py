@@ -26,6 +26,12 @@ _MemcacheNode = namedtuple('_MemcacheNode',
 
 class MemcacheNode(_MemcacheNode, GenericNodeMixin):
 
+    __slots__ = ()
+
+    @property
+    def aggregation_key(self):
+        return (MemcacheNode, self.command)
+
     @property
     def name(self):
         return 'Memcache/%s' % self.command
@@ -28,6 +28,13 @@ _MessageNode = namedtuple('_MessageNode',
 
 class MessageNode(_MessageNode, GenericNodeMixin):
 
+    __slots__ = ()
+
+    @property
+    def aggregation_key(self):
+        return (MessageNode, self.library, self.operation,
+                self.destination_type, self.destination_name)
+
     @property
     def name(self):
         name = 'MessageBroker/%s/%s/%s/Named/%s' % (self.library,
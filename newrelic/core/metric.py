@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from array import array
 from collections import namedtuple
 
 Metric = namedtuple('Metric', ['name', 'scope'])
@@ -21,3 +22,147 @@ ApdexMetric = namedtuple('ApdexMetric',
 
 TimeMetric = namedtuple('TimeMetric',
         ['name', 'scope', 'duration', 'exclusive'])
+
+# A time metric for a number of calls which have already been aggregated,
+# where the duration and exclusive time are the totals for all the calls.
+
+AggregateTimeMetric = namedtuple('AggregateTimeMetric',
+        ['name', 'scope', 'call_count', 'duration', 'exclusive',
+        'min_duration', 'max_duration', 'sum_of_squares'])
+
+
+class TimeMetricBatch(object):
+
+    """Columnar batch of the time metrics generated by a single
+    transaction. Metrics with the same name and scope are aggregated as
+    they are added, so that each unique metric need only be merged into
+    the stats table of the stats engine once per transaction.
+
+    """
+
+    def __init__(self):
+        self._index = {}
+        self.names = []
+        self.scopes = []
+        self.call_counts = array('l')
+        self.durations = array('d')
+        self.exclusives = array('d')
+        self.min_durations = array('d')
+        self.max_durations = array('d')
+        self.sums_of_squares = array('d')
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, scope, duration, exclusive=None):
+        """Add a single time metric to the batch. As with the stats
+        engine a scope of None is recorded as an empty string.
+
+        """
+
+        if exclusive is None:
+            exclusive = duration
+
+        scope = scope or ''
+        key = (name, scope)
+
+        index = self._index.get(key)
+
+        if index is None:
+            self._index[key] = len(self.names)
+            self.names.append(name)
+            self.scopes.append(scope)
+            self.call_counts.append(1)
+            self.durations.append(duration)
+            self.exclusives.append(exclusive)
+            self.min_durations.append(duration)
+            self.max_durations.append(duration)
+            self.sums_of_squares.append(duration ** 2)
+
+        else:
+            self.call_counts[index] += 1
+            self.durations[index] += duration
+            self.exclusives[index] += exclusive
+            self.min_durations[index] = (min(self.min_durations[index],
+                    duration) or duration)
+            self.max_durations[index] = max(self.max_durations[index],
+                    duration)
+            self.sums_of_squares[index] += duration ** 2
+
+    def add_aggregate(self, name, scope, call_count, duration, exclusive,
+            min_duration, max_duration, sum_of_squares):
+        """Add the stats for a number of calls for a single metric which
+        have already been aggregated.
+
+        """
+
+        if exclusive is None:
+            exclusive = duration
+
+        scope = scope or ''
+        key = (name, scope)
+
+        index = self._index.get(key)
+
+        if index is None:
+            self._index[key] = len(self.names)
+            self.names.append(name)
+            self.scopes.append(scope)
+            self.call_counts.append(call_count)
+            self.durations.append(duration)
+            self.exclusives.append(exclusive)
+            self.min_durations.append(min_duration)
+            self.max_durations.append(max_duration)
+            self.sums_of_squares.append(sum_of_squares)
+
+        else:
+            self.call_counts[index] += call_count
+            self.durations[index] += duration
+            self.exclusives[index] += exclusive
+            self.min_durations[index] = (min(self.min_durations[index],
+                    min_duration) or min_duration)
+            self.max_durations[index] = max(self.max_durations[index],
+                    max_duration)
+            self.sums_of_squares[index] += sum_of_squares
+
+    def extend(self, metrics):
+        """Add all the time metrics from an iterable of TimeMetric and
+        AggregateTimeMetric.
+
+        """
+
+        add = self.add
+
+        for metric in metrics:
+            if type(metric) is AggregateTimeMetric:
+                self.add_aggregate(*metric)
+            else:
+                add(metric.name, metric.scope, metric.duration,
+                        metric.exclusive)
+
+    def get(self, name, scope=''):
+        """Returns a tuple of the six accumulated stats values for the
+        metric with the given name and scope, or None if the batch holds
+        no such metric.
+
+        """
+
+        index = self._index.get((name, scope))
+
+        if index is None:
+            return None
+
+        return (self.call_counts[index], self.durations[index],
+                self.exclusives[index], self.min_durations[index],
+                self.max_durations[index], self.sums_of_squares[index])
+
+    def stats(self):
+        """Returns an iterator over the aggregated metrics. The items
+        returned are a tuple of the (name, scope) key and a tuple of the
+        six accumulated stats values for the metric.
+
+        """
+
+        return zip(zip(self.names, self.scopes), zip(self.call_counts,
+                self.durations, self.exclusives, self.min_durations,
+                self.max_durations, self.sums_of_squares))
@@ -18,17 +18,49 @@ from newrelic.core.attribute_filter import (DST_SPAN_EVENTS,
         DST_TRANSACTION_SEGMENTS)
 
 
+# Empty children and attributes shared by all nodes which have none, so
+# that empty containers are not retained for each node of the trace
+# hierarchy. These must never be modified.
+
+EMPTY_CHILDREN = ()
+EMPTY_ATTRIBUTES = {}
+
+
 class GenericNodeMixin(object):
+
+    # Nodes which don't need to cache any values declare empty slots so
+    # that no instance dictionary is created for them.
+
+    __slots__ = ()
+
+    # Nodes for calls which generate the same metrics, save for the times,
+    # have the same aggregation key, so they can be folded together when a
+    # transaction has too many nodes. Nodes without a key are never folded.
+
+    aggregation_key = None
+
     @property
     def processed_user_attributes(self):
+        user_attributes = getattr(self, 'user_attributes', None)
+
+        if not user_attributes:
+            return {}
+
         if hasattr(self, '_processed_user_attributes'):
             return self._processed_user_attributes
 
-        self._processed_user_attributes = u_attrs = {}
-        user_attributes = getattr(self, 'user_attributes', u_attrs)
+        u_attrs = {}
         for k, v in user_attributes.items():
             k, v = attribute.process_user_attribute(k, v)
             u_attrs[k] = v
+
+        # Nodes declaring slots can't cache the processed attributes.
+
+        try:
+            self._processed_user_attributes = u_attrs
+        except AttributeError:
+            pass
+
         return u_attrs
 
     def get_trace_segment_params(self, settings, params=None):
@@ -80,6 +112,17 @@ class GenericNodeMixin(object):
         # intrinsics, user attrs, agent attrs
         return [i_attrs, u_attrs, a_attrs]
 
+    def span_event_count(self):
+        """Returns the number of span events which span_events() would
+        generate for this node and its children, without creating them.
+
+        """
+
+        count = 1
+        for child in self.children:
+            count += child.span_event_count()
+        return count
+
     def span_events(self,
             settings, base_attrs=None, parent_guid=None, attr_class=dict):
 
@@ -100,6 +143,8 @@ class GenericNodeMixin(object):
 
 class DatastoreNodeMixin(GenericNodeMixin):
 
+    __slots__ = ()
+
     @property
     def name(self):
         product = self.product
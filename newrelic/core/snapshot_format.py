@@ -0,0 +1,304 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the binary format used to transfer the data
+from a stats engine snapshot between processes, as returned by the
+StatsEngine.forwarded_data() method and accepted by the
+StatsEngine.merge_forwarded_data() method.
+
+The encoded snapshot consists of a header holding a magic number and the
+format version, followed by a sequence of sections. Each section has a
+one byte tag and the length of the section body, so that a decoder will
+skip sections with tags it does not know about.
+
+The metric table is encoded as a string table of the distinct metric
+names and scopes, followed by packed arrays of the string table indices,
+the kind of stats and the six stats values for each metric. This avoids
+encoding the stats values, and the scope shared by many metrics, as
+individual objects. The samples held by event reservoirs, error traces,
+and the slow SQL and transaction trace data rendered by the sending
+process, are JSON encoded as they are already JSON compatible, with the
+priorities of reservoir samples being packed as an array.
+
+"""
+
+import struct
+import sys
+from array import array
+
+import newrelic.packages.six as six
+
+from newrelic.common.encoding_utils import json_encode, json_decode
+from newrelic.core.stats_engine import _APDEX_STATS
+
+FORMAT_MAGIC = b'NRSS'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('!4sB')
+_SECTION = struct.Struct('!BI')
+_COUNT = struct.Struct('!I')
+_RESERVOIR = struct.Struct('!BiQ')
+
+_METRICS = 1
+_RESERVOIR_SECTION = 2
+_LIMITED = 3
+_ERRORS = 4
+_SLOW_SQL = 5
+_TRANSACTION_TRACES = 6
+
+_RESERVOIRS = ('transaction_events', 'error_events', 'custom_events',
+        'span_events')
+
+# Arrays are packed in network byte order, the same as the struct
+# formats used for everything else.
+
+_SWAP_BYTES = sys.byteorder == 'little'
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+def _pack_array(typecode, values):
+    data = array(typecode, values)
+    if _SWAP_BYTES:
+        data.byteswap()
+    if six.PY2:
+        return data.tostring()
+    return data.tobytes()
+
+
+def _unpack_array(typecode, data):
+    values = array(typecode)
+    if six.PY2:
+        values.fromstring(data)
+    else:
+        values.frombytes(data)
+    if _SWAP_BYTES:
+        values.byteswap()
+    return values
+
+
+def _pack_json(obj):
+    data = json_encode(obj).encode('utf-8')
+    return _COUNT.pack(len(data)) + data
+
+
+class _Reader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, length):
+        start = self.offset
+        end = start + length
+
+        if end > len(self.data):
+            raise SnapshotFormatError('Snapshot is truncated.')
+
+        self.offset = end
+
+        return self.data[start:end]
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.read(fmt.size))
+
+    def read_json(self):
+        length, = self.unpack(_COUNT)
+        return json_decode(self.read(length).decode('utf-8'))
+
+    def at_end(self):
+        return self.offset >= len(self.data)
+
+
+def _encode_metrics(metrics):
+    strings = {}
+    names = []
+    scopes = []
+    kinds = []
+    values = []
+
+    for key, kind, stats in metrics:
+        name, scope = key
+
+        names.append(strings.setdefault(name, len(strings)))
+        scopes.append(strings.setdefault(scope, len(strings)))
+        kinds.append(kind)
+        values.extend(stats)
+
+    pieces = [_COUNT.pack(len(strings))]
+
+    for string in sorted(strings, key=strings.get):
+        string = string.encode('utf-8')
+        pieces.append(_COUNT.pack(len(string)))
+        pieces.append(string)
+
+    pieces.append(_COUNT.pack(len(kinds)))
+    pieces.append(_pack_array('I', names))
+    pieces.append(_pack_array('I', scopes))
+    pieces.append(_pack_array('b', kinds))
+    pieces.append(_pack_array('d', values))
+
+    return b''.join(pieces)
+
+
+def _decode_metrics(reader):
+    count, = reader.unpack(_COUNT)
+
+    strings = []
+
+    for _ in range(count):
+        length, = reader.unpack(_COUNT)
+        strings.append(reader.read(length).decode('utf-8'))
+
+    count, = reader.unpack(_COUNT)
+
+    index_size = array('I').itemsize
+
+    names = _unpack_array('I', reader.read(count * index_size))
+    scopes = _unpack_array('I', reader.read(count * index_size))
+    kinds = _unpack_array('b', reader.read(count))
+    values = _unpack_array('d', reader.read(count * 6 *
+            array('d').itemsize))
+
+    metrics = []
+
+    try:
+        for index in range(count):
+            key = (strings[names[index]], strings[scopes[index]])
+            kind = kinds[index]
+            stats = values[index * 6:index * 6 + 6].tolist()
+
+            # Counts are transferred as doubles along with the other
+            # values, but are restored as integers where they were.
+
+            for position in range(kind == _APDEX_STATS and 3 or 1):
+                if stats[position].is_integer():
+                    stats[position] = int(stats[position])
+
+            metrics.append((key, kind, stats))
+
+    except IndexError:
+        raise SnapshotFormatError('Invalid metric string table index.')
+
+    return metrics
+
+
+def _section(tag, body):
+    return _SECTION.pack(tag, len(body)) + body
+
+
+def encode_snapshot(data):
+    """Encodes the data returned by StatsEngine.forwarded_data() in the
+    binary snapshot format, returning a byte string.
+
+    """
+
+    pieces = [_HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION)]
+
+    pieces.append(_section(_METRICS, _encode_metrics(data['metrics'])))
+
+    for index, name in enumerate(_RESERVOIRS):
+        reservoir = data.get(name)
+
+        if reservoir is None:
+            continue
+
+        capacity, num_seen, pq = reservoir
+
+        body = b''.join((_RESERVOIR.pack(index, capacity, num_seen),
+                _COUNT.pack(len(pq)),
+                _pack_array('d', [entry[0] for entry in pq]),
+                _pack_json([entry[-1] for entry in pq])))
+
+        pieces.append(_section(_RESERVOIR_SECTION, body))
+
+    if data.get('synthetics_events') is not None:
+        capacity, num_seen, samples = data['synthetics_events']
+
+        body = _RESERVOIR.pack(0, capacity, num_seen) + _pack_json(samples)
+
+        pieces.append(_section(_LIMITED, body))
+
+    if data.get('errors'):
+        pieces.append(_section(_ERRORS, _pack_json(data['errors'])))
+
+    if data.get('slow_sql'):
+        pieces.append(_section(_SLOW_SQL, _pack_json(data['slow_sql'])))
+
+    if data.get('transaction_traces'):
+        pieces.append(_section(_TRANSACTION_TRACES,
+                _pack_json(data['transaction_traces'])))
+
+    return b''.join(pieces)
+
+
+def decode_snapshot(data):
+    """Decodes a snapshot encoded by encode_snapshot(), returning the
+    data in the form accepted by StatsEngine.merge_forwarded_data().
+    Raises SnapshotFormatError where the data is not a valid snapshot in
+    a version of the format which is understood.
+
+    """
+
+    reader = _Reader(data)
+
+    magic, version = reader.unpack(_HEADER)
+
+    if magic != FORMAT_MAGIC:
+        raise SnapshotFormatError('Data is not an encoded snapshot.')
+
+    if version != FORMAT_VERSION:
+        raise SnapshotFormatError('Unsupported snapshot format version '
+                '%d.' % version)
+
+    result = {'metrics': []}
+
+    while not reader.at_end():
+        tag, length = reader.unpack(_SECTION)
+        section = _Reader(reader.read(length))
+
+        if tag == _METRICS:
+            result['metrics'] = _decode_metrics(section)
+
+        elif tag == _RESERVOIR_SECTION:
+            index, capacity, num_seen = section.unpack(_RESERVOIR)
+            count, = section.unpack(_COUNT)
+            priorities = _unpack_array('d', section.read(count *
+                    array('d').itemsize))
+            samples = section.read_json()
+
+            if index >= len(_RESERVOIRS) or len(samples) != count:
+                raise SnapshotFormatError('Invalid event reservoir.')
+
+            result[_RESERVOIRS[index]] = (capacity, num_seen,
+                    [(priority, seen_at, sample) for seen_at, (priority,
+                    sample) in enumerate(zip(priorities, samples), 1)])
+
+        elif tag == _LIMITED:
+            _, capacity, num_seen = section.unpack(_RESERVOIR)
+            result['synthetics_events'] = (capacity, num_seen,
+                    section.read_json())
+
+        elif tag == _ERRORS:
+            result['errors'] = section.read_json()
+
+        elif tag == _SLOW_SQL:
+            result['slow_sql'] = section.read_json()
+
+        elif tag == _TRANSACTION_TRACES:
+            result['transaction_traces'] = section.read_json()
+
+    return result
@@ -27,6 +27,12 @@ _SolrNode = namedtuple('_SolrNode',
 
 class SolrNode(_SolrNode, GenericNodeMixin):
 
+    __slots__ = ()
+
+    @property
+    def aggregation_key(self):
+        return (SolrNode, self.library, self.command)
+
     @property
     def name(self):
         return 'SolrClient/%s/%s' % (self.library, self.command)
@@ -21,13 +21,15 @@ data whereby it is sent to the core application.
 
 import base64
 import copy
+import itertools
 import logging
 import operator
 import random
 import zlib
 import time
 import sys
-from heapq import heapreplace, heapify
+from array import array
+from heapq import heapreplace, heapify, nlargest
 
 import newrelic.packages.six as six
 
@@ -35,9 +37,11 @@ from newrelic.core.attribute_filter import DST_ERROR_COLLECTOR
 from newrelic.core.attribute import create_user_attributes
 
 from newrelic.core.attribute import process_user_attribute
-from newrelic.core.database_utils import explain_plan
+from newrelic.core.database_utils import (explain_plan,
+        request_explain_plan)
 from newrelic.core.error_collector import TracedError
-from newrelic.core.metric import TimeMetric
+from newrelic.core.internal_metrics import internal_count_metric
+from newrelic.core.metric import TimeMetric, TimeMetricBatch
 from newrelic.core.stack_trace import exception_stack
 
 from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
@@ -179,6 +183,337 @@ class CountStats(TimeStats):
         pass
 
 
+class StatsTable(dict):
+
+    """Table mapping metric (name, scope) keys to the accumulated stats
+    for the metric. This is the default table used by the stats engine.
+
+    """
+
+    def merge_apdex_metric(self, key, metric):
+        """Merge data from an apdex metric object."""
+
+        stats = self.get(key)
+        if stats is None:
+            stats = ApdexStats(apdex_t=metric.apdex_t)
+            self[key] = stats
+        stats.merge_apdex_metric(metric)
+
+    def merge_time_metric(self, key, metric):
+        """Merge data from a time metric object."""
+
+        stats = self.get(key)
+        if stats is None:
+            self[key] = TimeStats(call_count=1,
+                    total_call_time=metric.duration,
+                    total_exclusive_call_time=metric.exclusive,
+                    min_call_time=metric.duration,
+                    max_call_time=metric.duration,
+                    sum_of_squares=metric.duration ** 2)
+        else:
+            stats.merge_time_metric(metric)
+
+    def merge_time_metric_batch(self, batch):
+        """Merge the aggregated metrics from a batch of time metrics."""
+
+        for key, values in batch.stats():
+            stats = self.get(key)
+            if stats is None:
+                self[key] = TimeStats(*values)
+            else:
+                stats.merge_stats(values)
+
+    def merge_stats(self, key, other):
+        """Merge data from a stats object. Where there is no existing
+        entry the stats object itself is added to the table.
+
+        """
+
+        stats = self.get(key)
+        if not stats:
+            self[key] = other
+        else:
+            stats.merge_stats(other)
+
+    def merge_table(self, other):
+        """Merge all the entries from another table."""
+
+        for key, stats in six.iteritems(other):
+            self.merge_stats(key, stats)
+
+    def normalize(self, normalizer):
+        """Returns a new table with the metric names passed through the
+        normalizer, re-aggregating any metrics which now have the same
+        name and scope.
+
+        """
+
+        result = StatsTable()
+
+        for key, value in six.iteritems(self):
+            key = (normalizer(key[0])[0], key[1])
+            stats = result.get(key)
+            if stats is None:
+                result[key] = copy.copy(value)
+            else:
+                stats.merge_stats(value)
+
+        return result
+
+
+_TIME_STATS = 0
+_APDEX_STATS = 1
+_COUNT_STATS = 2
+
+
+def _stats_kind(stats):
+    if isinstance(stats, ApdexStats):
+        return _APDEX_STATS
+    elif isinstance(stats, CountStats):
+        return _COUNT_STATS
+    return _TIME_STATS
+
+
+def _stats_of_kind(kind, values):
+    if kind == _APDEX_STATS:
+        stats = ApdexStats()
+    elif kind == _COUNT_STATS:
+        stats = CountStats()
+    else:
+        stats = TimeStats()
+    stats[:] = values
+    return stats
+
+
+def _as_count(value):
+    return int(value) if value.is_integer() else value
+
+
+class CompactStatsTable(object):
+
+    """Table of accumulated metric stats where the metric (name, scope)
+    keys are interned to integer slots and the six stats values for all
+    metrics are held in parallel arrays of doubles. This avoids the cost
+    of a list object and six boxed floats for each unique metric.
+
+    Lookups return a copy of the stats for the metric as a TimeStats,
+    ApdexStats or CountStats object. Updates must be made through the
+    merge methods of the table.
+
+    """
+
+    def __init__(self):
+        self._slots = {}
+        self._keys = []
+        self._kinds = array('b')
+        self._call_count = array('d')
+        self._total = array('d')
+        self._exclusive = array('d')
+        self._min = array('d')
+        self._max = array('d')
+        self._sum_of_squares = array('d')
+
+    @property
+    def _columns(self):
+        return (self._call_count, self._total, self._exclusive,
+                self._min, self._max, self._sum_of_squares)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __getitem__(self, key):
+        return self._stats(self._slots[key])
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        slot = self._slots.get(key)
+        if slot is None:
+            return default
+        return self._stats(slot)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self._stats(slot) for slot in range(len(self._keys))]
+
+    def items(self):
+        return [(key, self._stats(slot))
+                for slot, key in enumerate(self._keys)]
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return (self._stats(slot) for slot in range(len(self._keys)))
+
+    def iteritems(self):
+        return ((key, self._stats(slot))
+                for slot, key in enumerate(self._keys))
+
+    def _stats(self, slot):
+        kind = self._kinds[slot]
+        call_count = _as_count(self._call_count[slot])
+
+        if kind == _APDEX_STATS:
+            stats = ApdexStats(call_count,
+                    _as_count(self._total[slot]),
+                    _as_count(self._exclusive[slot]),
+                    self._min[slot])
+            stats[4] = self._max[slot]
+            return stats
+
+        stats_type = CountStats if kind == _COUNT_STATS else TimeStats
+
+        return stats_type(call_count, self._total[slot],
+                self._exclusive[slot], self._min[slot], self._max[slot],
+                self._sum_of_squares[slot])
+
+    def _insert(self, key, kind, values):
+        slot = len(self._keys)
+        self._slots[key] = slot
+        self._keys.append(key)
+        self._kinds.append(kind)
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        return slot
+
+    def _merge(self, key, kind, values):
+        slot = self._slots.get(key)
+        if slot is None:
+            self._insert(key, kind, values)
+            return
+
+        call_count, total, exclusive, minimum, maximum, sum_of_squares = \
+                values
+
+        kind = self._kinds[slot]
+
+        if kind == _COUNT_STATS:
+            self._call_count[slot] += call_count
+
+        elif kind == _APDEX_STATS:
+            self._call_count[slot] += call_count
+            self._total[slot] += total
+            self._exclusive[slot] += exclusive
+
+            self._min[slot] = ((self._call_count[slot] or
+                    self._total[slot] or self._exclusive[slot]) and
+                    min(self._min[slot], minimum) or minimum)
+            self._max[slot] = max(self._max[slot], minimum)
+
+        else:
+            self._total[slot] += total
+            self._exclusive[slot] += exclusive
+            self._min[slot] = (self._call_count[slot] and
+                    min(self._min[slot], minimum) or minimum)
+            self._max[slot] = max(self._max[slot], maximum)
+            self._sum_of_squares[slot] += sum_of_squares
+
+            # Must update the call count last as update of the
+            # minimum call time is dependent on initial value.
+
+            self._call_count[slot] += call_count
+
+    def merge_apdex_metric(self, key, metric):
+        """Merge data from an apdex metric object."""
+
+        apdex_t = metric.apdex_t
+
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._insert(key, _APDEX_STATS,
+                    (0, 0, 0, apdex_t, apdex_t, 0))
+
+        self._call_count[slot] += metric.satisfying
+        self._total[slot] += metric.tolerating
+        self._exclusive[slot] += metric.frustrating
+
+        self._min[slot] = ((self._call_count[slot] or self._total[slot] or
+                self._exclusive[slot]) and min(self._min[slot], apdex_t) or
+                apdex_t)
+        self._max[slot] = max(self._max[slot], apdex_t)
+
+    def merge_time_metric(self, key, metric):
+        """Merge data from a time metric object."""
+
+        duration = metric.duration
+        exclusive = metric.exclusive
+
+        if exclusive is None:
+            exclusive = duration
+
+        self._merge(key, _TIME_STATS, (1, duration, exclusive, duration,
+                duration, duration ** 2))
+
+    def merge_time_metric_batch(self, batch):
+        """Merge the aggregated metrics from a batch of time metrics."""
+
+        for key, values in batch.stats():
+            self._merge(key, _TIME_STATS, values)
+
+    def merge_stats(self, key, other):
+        """Merge data from a stats object."""
+
+        self._merge(key, _stats_kind(other), other)
+
+    def merge_table(self, other):
+        """Merge all the entries from another table. Where both tables
+        are compact tables the merge is done directly on the columns.
+
+        """
+
+        if not isinstance(other, CompactStatsTable):
+            for key, stats in six.iteritems(other):
+                self.merge_stats(key, stats)
+            return
+
+        if not self._keys:
+            self._slots = dict(other._slots)
+            self._keys = list(other._keys)
+            self._kinds = array('b', other._kinds)
+            self._call_count = array('d', other._call_count)
+            self._total = array('d', other._total)
+            self._exclusive = array('d', other._exclusive)
+            self._min = array('d', other._min)
+            self._max = array('d', other._max)
+            self._sum_of_squares = array('d', other._sum_of_squares)
+            return
+
+        columns = other._columns
+        kinds = other._kinds
+
+        for slot, key in enumerate(other._keys):
+            self._merge(key, kinds[slot],
+                    [column[slot] for column in columns])
+
+    def normalize(self, normalizer):
+        """Returns a new table with the metric names passed through the
+        normalizer, re-aggregating any metrics which now have the same
+        name and scope.
+
+        """
+
+        result = CompactStatsTable()
+
+        columns = self._columns
+        kinds = self._kinds
+
+        for slot, (name, scope) in enumerate(self._keys):
+            key = (normalizer(name)[0], scope)
+            result._merge(key, kinds[slot],
+                    [column[slot] for column in columns])
+
+        return result
+
+
 class CustomMetrics(object):
 
     """Table for collection a set of value metrics.
@@ -210,6 +545,20 @@ class CustomMetrics(object):
         else:
             stats.merge_stats(new_stats)
 
+    def merge_custom_metrics(self, metrics):
+        """Merges in a set of value metrics. The metrics should be
+        provided as an iterable where each item is a tuple of the metric
+        name and the accumulated stats for the metric.
+
+        """
+
+        for name, other in metrics:
+            stats = self.__stats_table.get(name)
+            if stats is None:
+                self.__stats_table[name] = copy.copy(other)
+            else:
+                stats.merge_stats(other)
+
     def metrics(self):
         """Returns an iterator over the set of value metrics. The items
         returned are a tuple consisting of the metric name and accumulated
@@ -271,6 +620,59 @@ class SlowSqlStats(list):
         self[0] += 1
 
 
+# Metrics generated by a transaction from which the intrinsic attributes
+# of its transaction and error events are derived.
+
+_EVENT_METRICS = ('WebFrontend/QueueTime', 'External/all', 'Datastore/all',
+        'Memcache/all', 'EventLoop/Wait/all')
+
+
+def _event_stats(batch):
+    """Returns the stats for the metrics of the batch of time metrics for a
+    single transaction which are used when creating the transaction and
+    error events for the transaction, keyed the same as in a stats table.
+
+    """
+
+    stats = {}
+
+    for name in _EVENT_METRICS:
+        values = batch.get(name)
+        if values is not None:
+            stats[(name, '')] = TimeStats(*values)
+
+    return stats
+
+
+class DeferredEvent(object):
+
+    """Sample held by an event reservoir in place of an event which is
+    only created when first required, usually when the reservoir is
+    harvested. This avoids creating events which are never reported as
+    they are later evicted from the reservoir.
+
+    """
+
+    __slots__ = ('_factory', '_args', '_event')
+
+    def __init__(self, factory, *args):
+        self._factory = factory
+        self._args = args
+        self._event = None
+
+    def materialize(self):
+        event = self._event
+        if event is None:
+            event = self._event = self._factory(*self._args)
+        return event
+
+
+def _materialize(sample):
+    if type(sample) is DeferredEvent:
+        return sample.materialize()
+    return sample
+
+
 class SampledDataSet(object):
     def __init__(self, capacity=100):
         self.pq = []
@@ -285,7 +687,7 @@ class SampledDataSet(object):
 
     @property
     def samples(self):
-        return (x[-1] for x in self.pq)
+        return (_materialize(x[-1]) for x in self.pq)
 
     @property
     def num_samples(self):
@@ -298,6 +700,18 @@ class SampledDataSet(object):
             'events_seen': self.num_seen
         }
 
+    @property
+    def minimum_priority(self):
+        """The priority which a sample must exceed to be admitted to the
+        reservoir, or None if the reservoir is not yet full.
+
+        """
+
+        pq = self.pq
+        if self.heap and pq:
+            return pq[0][0]
+        return None
+
     def __iter__(self):
         return self.samples
 
@@ -336,13 +750,71 @@ class SampledDataSet(object):
                 return
             heapreplace(self.pq, entry)
 
+    def add_many(self, samples, priorities=None):
+        """Add a batch of samples to the reservoir. Where priorities are
+        supplied there must be one for each sample. The samples with the
+        highest priorities are selected in a single pass rather than
+        updating the heap for each sample in turn.
+
+        """
+
+        samples = list(samples)
+
+        if priorities is None:
+            priorities = [random.random() for _ in samples]
+
+        self._add_entries(zip(priorities, samples))
+
+    def _add_entries(self, entries):
+        num_seen = self.num_seen
+
+        entries = [(priority, num_seen + index, sample)
+                for index, (priority, sample) in enumerate(entries, 1)]
+
+        self.num_seen += len(entries)
+
+        if self.capacity <= 0:
+            return
+
+        pq = self.pq
+
+        # Once the reservoir is full, anything not above the current
+        # minimal priority sample can be discarded straight away.
+
+        if self.heap:
+            minimum = pq[0][0]
+            entries = [entry for entry in entries if entry[0] > minimum]
+
+        if len(pq) + len(entries) <= self.capacity:
+            pq.extend(entries)
+
+            if len(pq) >= self.capacity:
+                heapify(pq)
+                self.heap = True
+
+        else:
+            # Selection is stable so where priorities are equal the
+            # samples already in the reservoir or seen first are kept.
+
+            pq = nlargest(self.capacity, itertools.chain(pq, entries),
+                    key=operator.itemgetter(0))
+
+            # The minimum priority is read by other threads without a
+            # lock, so the samples must be a heap before they replace
+            # those of the reservoir.
+
+            heapify(pq)
+
+            self.pq = pq
+            self.heap = True
+
     def merge(self, other_data_set):
-        for priority, seen_at, sample in other_data_set.pq:
-            self.add(sample, priority)
+        self._add_entries((priority, sample)
+                for priority, seen_at, sample in other_data_set.pq)
 
         # Merge the num_seen from the other_data_set, but take care not to
-        # double-count the actual samples of other_data_set since the .add
-        # call above will add one to self.num_seen each time
+        # double-count the actual samples of other_data_set since adding
+        # them above will add one to self.num_seen for each sample
         self.num_seen += other_data_set.num_seen - other_data_set.num_samples
 
 
@@ -426,7 +898,7 @@ class StatsEngine(object):
 
     def __init__(self):
         self.__settings = None
-        self.__stats_table = {}
+        self.__stats_table = StatsTable()
         self._transaction_events = SampledDataSet()
         self._error_events = SampledDataSet()
         self._custom_events = SampledDataSet()
@@ -440,11 +912,21 @@ class StatsEngine(object):
         self.__transaction_errors = []
         self._synthetics_events = LimitedDataSet()
         self.__synthetics_transactions = []
+        self.__forwarded_slow_sql = []
+        self.__forwarded_traces = []
 
     @property
     def settings(self):
         return self.__settings
 
+    def _create_stats_table(self):
+        settings = self.__settings
+
+        if settings is not None and settings.stats_engine.compact_metrics:
+            return CompactStatsTable()
+
+        return StatsTable()
+
     @property
     def stats_table(self):
         return self.__stats_table
@@ -501,11 +983,7 @@ class StatsEngine(object):
         # as an empty string anyway.
 
         key = (metric.name, '')
-        stats = self.__stats_table.get(key)
-        if stats is None:
-            stats = ApdexStats(apdex_t=metric.apdex_t)
-            self.__stats_table[key] = stats
-        stats.merge_apdex_metric(metric)
+        self.__stats_table.merge_apdex_metric(key, metric)
 
         return key
 
@@ -535,32 +1013,39 @@ class StatsEngine(object):
         # scope of None is reserved for apdex metrics.
 
         key = (metric.name, metric.scope or '')
-        stats = self.__stats_table.get(key)
-        if stats is None:
-            stats = TimeStats(call_count=1,
-                    total_call_time=metric.duration,
-                    total_exclusive_call_time=metric.exclusive,
-                    min_call_time=metric.duration,
-                    max_call_time=metric.duration,
-                    sum_of_squares=metric.duration ** 2)
-            self.__stats_table[key] = stats
-        else:
-            stats.merge_time_metric(metric)
+        self.__stats_table.merge_time_metric(key, metric)
 
         return key
 
     def record_time_metrics(self, metrics):
         """Record the time metrics supplied by the iterable for a single
         transaction, merging the data with any data from prior time
-        metrics with the same name and scope.
+        metrics with the same name and scope. The metrics are first
+        aggregated into a batch so that each unique metric is only
+        merged into the stats table once.
 
         """
 
         if not self.__settings:
             return
 
-        for metric in metrics:
-            self.record_time_metric(metric)
+        batch = TimeMetricBatch()
+        batch.extend(metrics)
+
+        self.record_time_metric_batch(batch)
+
+    def record_time_metric_batch(self, batch):
+        """Record a batch of time metrics for a single transaction which
+        have already been aggregated per metric name and scope, merging
+        the data with any data from prior time metrics with the same name
+        and scope.
+
+        """
+
+        if not self.__settings:
+            return
+
+        self.__stats_table.merge_time_metric_batch(batch)
 
     def record_exception(self, exc=None, value=None, tb=None, params={},
             ignore_errors=[]):
@@ -769,11 +1254,7 @@ class StatsEngine(object):
         else:
             new_stats = TimeStats(1, value, value, value, value, value**2)
 
-        stats = self.__stats_table.get(key)
-        if stats is None:
-            self.__stats_table[key] = new_stats
-        else:
-            stats.merge_stats(new_stats)
+        self.__stats_table.merge_stats(key, new_stats)
 
         return key
 
@@ -814,6 +1295,16 @@ class StatsEngine(object):
         if stats:
             stats.merge_slow_sql_node(node)
 
+            # Where explain plans are run by the worker, request the
+            # explain plan now so it is ready by the time of the harvest.
+
+            settings = self.__settings
+            if (settings.explain_plan_worker.enabled and
+                    stats.slow_sql_node is node):
+                request_explain_plan(settings, node.statement,
+                        node.connect_params, node.cursor_params,
+                        node.sql_parameters, node.execute_params)
+
         return key
 
     def _update_slow_transaction(self, transaction):
@@ -872,12 +1363,17 @@ class StatsEngine(object):
         if len(self.__synthetics_transactions) < maximum:
             self.__synthetics_transactions.append(transaction)
 
-    def record_transaction(self, transaction):
+    def record_transaction(self, transaction, span_events_threshold=None):
         """Record any apdex and time metrics for the transaction as
         well as any errors which occurred for the transaction. If the
         transaction qualifies to become the slow transaction remember
         it for later.
 
+        Where the transaction is being recorded into a workarea, the
+        span_events_threshold should be the minimum priority of the span
+        event reservoir the workarea will be merged into, so that span
+        events which could never be kept are not created.
+
         """
 
         if not self.__settings:
@@ -904,7 +1400,21 @@ class StatsEngine(object):
 
         self.merge_custom_metrics(transaction.custom_metrics.metrics())
 
-        self.record_time_metrics(transaction.time_metrics(self))
+        batch = TimeMetricBatch()
+        batch.extend(transaction.time_metrics(self))
+
+        self.record_time_metric_batch(batch)
+
+        # Transaction and error events are held by the reservoirs as
+        # deferred events, only created from the transaction when the
+        # reservoir is harvested. The deferred events hold a copy of the
+        # transaction without the trace hierarchy, along with the stats
+        # for the few metrics of this transaction the events need. The
+        # stats table can't be used as it may hold the metrics for prior
+        # transactions by the time the events are created.
+
+        event_source = None
+        event_stats = None
 
         # Capture any errors if error collection is enabled.
         # Only retain maximum number allowed per harvest.
@@ -922,9 +1432,15 @@ class StatsEngine(object):
         if (error_collector.capture_events and
                 error_collector.enabled and
                 settings.collect_error_events):
-            events = transaction.error_events(self.__stats_table)
-            for event in events:
-                self._error_events.add(event, priority=transaction.priority)
+            if transaction.errors:
+                event_source = transaction.event_source()
+                event_stats = _event_stats(batch)
+
+                events = [DeferredEvent(event_source.error_event, error,
+                        event_stats) for error in transaction.errors]
+
+                self._error_events.add_many(events,
+                        [transaction.priority] * len(events))
 
         # Capture any sql traces if transaction tracer enabled.
 
@@ -962,13 +1478,21 @@ class StatsEngine(object):
         # while transactions from regular requests are saved in another.
 
         if transaction.synthetics_resource_id:
-            event = transaction.transaction_event(self.__stats_table)
+            if event_stats is None:
+                event_stats = _event_stats(batch)
+
+            event = transaction.transaction_event(event_stats)
             self._synthetics_events.add(event)
 
         elif (settings.collect_analytics_events and
                 settings.transaction_events.enabled):
 
-            event = transaction.transaction_event(self.__stats_table)
+            if event_source is None:
+                event_source = transaction.event_source()
+                event_stats = _event_stats(batch)
+
+            event = DeferredEvent(event_source.transaction_event,
+                    event_stats)
             self._transaction_events.add(event, priority=transaction.priority)
 
         # Merge in custom events
@@ -985,8 +1509,48 @@ class StatsEngine(object):
                 for event in transaction.span_protos(settings):
                     self._span_stream.put(event)
             elif transaction.sampled:
-                for event in transaction.span_events(self.__settings):
-                    self._span_events.add(event, priority=transaction.priority)
+                self._record_span_events(transaction, span_events_threshold)
+
+    def _record_span_events(self, transaction, threshold=None):
+        span_events = self._span_events
+        priority = transaction.priority
+
+        minimum = span_events.minimum_priority
+
+        if threshold is not None and (minimum is None or threshold > minimum):
+            minimum = threshold
+
+        # All the span events for a transaction have the priority of the
+        # transaction. If that is not above the minimum priority for the
+        # reservoir, none could be kept, so the events are only counted
+        # as seen and never created. Otherwise no more events are created
+        # than the reservoir can hold, as where priorities are equal the
+        # earlier events are kept in preference to later ones.
+
+        if minimum is not None and priority <= minimum:
+            events = []
+            skipped = transaction.span_event_count()
+
+            if skipped:
+                internal_count_metric('Supportability/Python/SpanEvent/'
+                        'Skipped/Priority', skipped)
+
+        else:
+            events = list(itertools.islice(
+                    transaction.span_events(self.__settings),
+                    max(span_events.capacity, 0)))
+
+            skipped = 0
+
+            if len(events) == max(span_events.capacity, 0):
+                skipped = transaction.span_event_count() - len(events)
+
+                if skipped:
+                    internal_count_metric('Supportability/Python/'
+                            'SpanEvent/Skipped/Capacity', skipped)
+
+        span_events.add_many(events, [priority] * len(events))
+        span_events.num_seen += skipped
 
     def metric_data(self, normalizer=None):
         """Returns a list containing the low level metric data for
@@ -1004,7 +1568,6 @@ class StatsEngine(object):
             return []
 
         result = []
-        normalized_stats = {}
 
         # Metric Renaming and Re-Aggregation. After applying the metric
         # renaming rules, the metrics are re-aggregated to collapse the
@@ -1016,13 +1579,7 @@ class StatsEngine(object):
                     list(six.iteritems(self.__stats_table)))
 
         if normalizer is not None:
-            for key, value in six.iteritems(self.__stats_table):
-                key = (normalizer(key[0])[0], key[1])
-                stats = normalized_stats.get(key)
-                if stats is None:
-                    normalized_stats[key] = copy.copy(value)
-                else:
-                    stats.merge_stats(value)
+            normalized_stats = self.__stats_table.normalize(normalizer)
         else:
             normalized_stats = self.__stats_table
 
@@ -1065,7 +1622,7 @@ class StatsEngine(object):
         if not self.__settings:
             return []
 
-        if not self.__sql_stats_table:
+        if not self.__sql_stats_table and not self.__forwarded_slow_sql:
             return []
 
         if not self.__settings.slow_sql.enabled:
@@ -1139,6 +1696,14 @@ class StatsEngine(object):
 
             result.append(data)
 
+        # Slow SQL data forwarded by other processes has already been
+        # rendered. It is combined with that for this process, keeping
+        # the entries with the greatest maximum call time.
+
+        if self.__forwarded_slow_sql:
+            result = sorted(result + self.__forwarded_slow_sql,
+                    key=operator.itemgetter(8))[-maximum:]
+
         return result
 
     def transaction_trace_data(self, connections):
@@ -1164,7 +1729,7 @@ class StatsEngine(object):
         # Return an empty list if no transactions were captured.
 
         if not traces:
-            return []
+            return self._forwarded_trace_data([])
 
         # We want to limit the number of explain plans we do across
         # these. So work out what were the slowest and tag them.
@@ -1259,7 +1824,30 @@ class StatsEngine(object):
                     None,
                     trace.synthetics_resource_id, ])
 
-        return trace_data
+        return self._forwarded_trace_data(trace_data)
+
+    def _forwarded_trace_data(self, trace_data):
+        # Transaction traces forwarded by other processes have already
+        # been rendered, so are combined with those for this process.
+
+        if not self.__forwarded_traces:
+            return trace_data
+
+        return self._select_traces(trace_data + self.__forwarded_traces)
+
+    def _select_traces(self, trace_data):
+        # As when recording transaction traces, only the slowest
+        # transaction is kept, along with Synthetics transactions up to
+        # the limit for those.
+
+        synthetics = [trace for trace in trace_data if trace[9]]
+        others = [trace for trace in trace_data if not trace[9]]
+
+        maximum = self.__settings.agent_limits.synthetics_transactions
+
+        slowest = sorted(others, key=operator.itemgetter(1))[-1:]
+
+        return slowest + synthetics[:maximum]
 
     def slow_transaction_data(self):
         """Returns a list containing any slow transaction data collected
@@ -1324,13 +1912,15 @@ class StatsEngine(object):
         """
 
         self.__settings = settings
-        self.__stats_table = {}
+        self.__stats_table = self._create_stats_table()
         self.__sql_stats_table = {}
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
         self.__slow_transaction_old_duration = None
         self.__transaction_errors = []
         self.__synthetics_transactions = []
+        self.__forwarded_slow_sql = []
+        self.__forwarded_traces = []
 
         self.reset_transaction_events()
         self.reset_error_events()
@@ -1348,7 +1938,7 @@ class StatsEngine(object):
 
         """
 
-        self.__stats_table = {}
+        self.__stats_table = self._create_stats_table()
 
     def reset_transaction_events(self):
         """Resets the accumulated statistics back to initial state for
@@ -1434,8 +2024,10 @@ class StatsEngine(object):
         self.__slow_transaction = None
         self.__synthetics_transactions = []
         self.__sql_stats_table = {}
-        self.__stats_table = {}
+        self.__stats_table = self._create_stats_table()
         self.__transaction_errors = []
+        self.__forwarded_slow_sql = []
+        self.__forwarded_traces = []
 
     def harvest_snapshot(self, flexible=False):
         """Creates a snapshot of the accumulated statistics, error
@@ -1514,6 +2106,26 @@ class StatsEngine(object):
         self._merge_sql(snapshot)
         self._merge_traces(snapshot)
 
+    def merge_shard(self, shard):
+        """Merges data from a long lived per thread stats engine. Unlike
+        merge(), the shard has accumulated data for many transactions and
+        so the event reservoirs are merged in full, preserving the count
+        of events seen.
+        """
+
+        if not self.__settings:
+            return
+
+        self.merge_metric_stats(shard)
+        self._merge_transaction_events(shard, rollback=True)
+        self._merge_synthetics_events(shard, rollback=True)
+        self._merge_error_events(shard)
+        self._merge_error_traces(shard)
+        self._merge_custom_events(shard, rollback=True)
+        self._merge_span_events(shard, rollback=True)
+        self._merge_sql(shard)
+        self._merge_traces(shard)
+
     def rollback(self, snapshot):
         """Performs a "rollback" merge after a failed harvest. Snapshot is a
         copy of the main StatsEngine data that we attempted to harvest, but
@@ -1544,12 +2156,7 @@ class StatsEngine(object):
         if not self.__settings:
             return
 
-        for key, other in six.iteritems(snapshot.__stats_table):
-            stats = self.__stats_table.get(key)
-            if not stats:
-                self.__stats_table[key] = other
-            else:
-                stats.merge_stats(other)
+        self.__stats_table.merge_table(snapshot.__stats_table)
 
     def _merge_transaction_events(self, snapshot, rollback=False):
 
@@ -1663,12 +2270,138 @@ class StatsEngine(object):
             return
 
         for name, other in metrics:
-            key = (name, '')
-            stats = self.__stats_table.get(key)
-            if not stats:
-                self.__stats_table[key] = other
-            else:
-                stats.merge_stats(other)
+            self.__stats_table.merge_stats((name, ''), other)
+
+    def forwarded_data(self, connections=None):
+        """Returns the metric data, event reservoirs and error traces held
+        by the stats engine as plain data structures, for forwarding to a
+        local aggregator process. Where database connections are
+        supplied, the slow SQL and transaction trace data is rendered,
+        with any explain plans, and included. The data can be encoded
+        using the snapshot format for transfer.
+
+        """
+
+        def _reservoir(data_set):
+            if data_set is None:
+                return None
+            return (data_set.capacity, data_set.num_seen,
+                    [(priority, seen_at, _materialize(sample))
+                    for priority, seen_at, sample in data_set.pq])
+
+        synthetics_events = self._synthetics_events
+
+        if synthetics_events is not None:
+            synthetics_events = (synthetics_events.capacity,
+                    synthetics_events.num_seen, list(synthetics_events))
+
+        data = {
+            'metrics': [(key, _stats_kind(stats), list(stats))
+                    for key, stats in self.__stats_table.items()],
+            'transaction_events': _reservoir(self._transaction_events),
+            'error_events': _reservoir(self._error_events),
+            'custom_events': _reservoir(self._custom_events),
+            'span_events': _reservoir(self._span_events),
+            'synthetics_events': synthetics_events,
+            'errors': list(self.__transaction_errors),
+        }
+
+        if connections is not None:
+            data['slow_sql'] = self.slow_sql_data(connections)
+            data['transaction_traces'] = self.transaction_trace_data(
+                    connections)
+
+        return data
+
+    def merge_forwarded_data(self, data):
+        """Merges in data returned by forwarded_data() for the stats
+        engine of another process. Event reservoirs are merged in full,
+        as for a rollback, preserving the count of events seen. The data
+        is decoded in full before anything is merged, so where the data
+        is malformed an exception is raised and nothing is changed.
+
+        """
+
+        if not self.__settings:
+            return
+
+        shard = self.create_workarea()
+
+        for key, kind, values in data['metrics']:
+            shard.__stats_table.merge_stats(tuple(key),
+                    _stats_of_kind(kind, values))
+
+        for name in ('transaction_events', 'error_events', 'custom_events',
+                'span_events'):
+            reservoir = data.get(name)
+
+            if reservoir is not None:
+                capacity, num_seen, pq = reservoir
+                data_set = SampledDataSet(capacity)
+                data_set.pq = [(priority, seen_at, sample)
+                        for priority, seen_at, sample in pq]
+                data_set.num_seen = num_seen
+                setattr(shard, '_' + name, data_set)
+
+        if data.get('synthetics_events') is not None:
+            capacity, num_seen, samples = data['synthetics_events']
+            data_set = LimitedDataSet(capacity)
+            data_set.extend(samples)
+            data_set.num_seen = num_seen
+            shard._synthetics_events = data_set
+
+        shard.__transaction_errors = [TracedError(*error)
+                for error in data.get('errors', ())]
+
+        forwarded_slow_sql = self.__forwarded_slow_sql
+
+        if data.get('slow_sql'):
+            forwarded_slow_sql = self._merge_forwarded_slow_sql(
+                    data['slow_sql'])
+
+        forwarded_traces = self.__forwarded_traces
+
+        if data.get('transaction_traces'):
+            forwarded_traces = self._select_traces(
+                    forwarded_traces + list(data['transaction_traces']))
+
+        self.merge_shard(shard)
+
+        self.__forwarded_slow_sql = forwarded_slow_sql
+        self.__forwarded_traces = forwarded_traces
+
+    def _merge_forwarded_slow_sql(self, slow_sql_data):
+        # Entries for the same SQL from different processes are combined
+        # in the same way as for the slow SQL nodes of this process,
+        # keeping the details of the slowest call. Only the entries with
+        # the greatest maximum call time are retained.
+
+        # The existing entries are copied, as they are only replaced
+        # once all the forwarded data has been decoded.
+
+        entries = dict((entry[2], list(entry)) for entry in
+                self.__forwarded_slow_sql)
+
+        for entry in slow_sql_data:
+            existing = entries.get(entry[2])
+
+            if existing is None:
+                entries[entry[2]] = list(entry)
+                continue
+
+            if entry[8] > existing[8]:
+                existing[:5] = entry[:5]
+                existing[9] = entry[9]
+
+            existing[5] += entry[5]
+            existing[6] += entry[6]
+            existing[7] = min(existing[7], entry[7])
+            existing[8] = max(existing[8], entry[8])
+
+        maximum = self.__settings.agent_limits.slow_sql_data
+
+        return sorted(entries.values(),
+                key=operator.itemgetter(8))[-maximum:]
 
     def _snapshot(self):
         copy = object.__new__(StatsEngineSnapshot)
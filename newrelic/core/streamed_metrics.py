@@ -0,0 +1,71 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module provides the accumulator for the time metrics of nodes
+which are not retained by a transaction, when the 'stats_engine.
+incremental_metrics' setting is enabled. Once a transaction holds as many
+nodes as could be included in a transaction trace or reported as span
+events, the metrics for each further node are generated as soon as the
+node completes, and the node discarded.
+
+The name of the transaction isn't known until it completes, so scoped
+metrics are accumulated against a placeholder scope which is replaced by
+the transaction name when the metrics are reported.
+
+"""
+
+from newrelic.core.metric import AggregateTimeMetric, TimeMetricBatch
+
+_TRANSACTION_SCOPE = '<transaction>'
+
+
+class StreamedMetrics(object):
+
+    """Accumulates the time metrics for discarded nodes. This stands in
+    for both the stats engine and the transaction node when generating
+    the metrics for a node, so provides the settings as well as the
+    transaction type and a placeholder for the transaction name.
+
+    """
+
+    path = _TRANSACTION_SCOPE
+
+    def __init__(self, transaction_type, settings):
+        self.type = transaction_type
+        self.settings = settings
+
+        self._batch = TimeMetricBatch()
+        self.node_count = 0
+
+    def merge_node(self, node):
+        """Accumulates the time metrics for the node and any children it
+        holds, after which the node need no longer be retained.
+
+        """
+
+        self._batch.extend(node.time_metrics(self, self, None))
+        self.node_count += 1
+
+    def time_metrics(self, root):
+        """Returns a generator yielding the accumulated metrics, with the
+        scope of scoped metrics being the name of the transaction given by
+        the root transaction node.
+
+        """
+
+        for (name, scope), stats in self._batch.stats():
+            if scope == _TRANSACTION_SCOPE:
+                scope = root.path
+
+            yield AggregateTimeMetric(name, scope, *stats)
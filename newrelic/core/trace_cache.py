@@ -28,6 +28,11 @@ try:
 except ImportError:
     import _thread as thread
 
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
 from newrelic.core.config import global_settings
 from newrelic.core.loop_node import LoopNode
 
@@ -48,6 +53,38 @@ def current_task(asyncio):
         pass
 
 
+def task_lookup(asyncio):
+    """Returns a function for obtaining the task running in the calling
+    thread. Asking asyncio for the current task raises an exception when
+    the thread has no running event loop, which is costly for threaded
+    applications where asyncio is imported but never run. Where possible
+    the running loop of the thread is therefore checked first, so that
+    the task is only looked up on threads running an event loop.
+
+    """
+
+    get_running_loop = getattr(asyncio, "_get_running_loop", None)
+
+    current_task_for_loop = getattr(asyncio, "current_task", None)
+    if current_task_for_loop is None:
+        current_task_for_loop = getattr(asyncio.Task, "current_task", None)
+
+    if get_running_loop is None or current_task_for_loop is None:
+        return lambda: current_task(asyncio)
+
+    def _current_task():
+        loop = get_running_loop()
+        if loop is None:
+            return
+
+        try:
+            return current_task_for_loop(loop)
+        except:
+            pass
+
+    return _current_task
+
+
 def all_tasks(asyncio):
     if not asyncio:
         return
@@ -85,6 +122,19 @@ class cached_module(object):
             return module
 
 
+class cached_task_lookup(object):
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        if instance.asyncio:
+            lookup = task_lookup(instance.asyncio)
+            instance.__dict__["_current_task"] = lookup
+            return lookup
+
+        return lambda: None
+
+
 class TraceCacheNoActiveTraceError(RuntimeError):
     pass
 
@@ -96,6 +146,12 @@ class TraceCacheActiveTraceError(RuntimeError):
 class TraceCache(object):
     asyncio = cached_module("asyncio")
     greenlet = cached_module("greenlet")
+    _current_task = cached_task_lookup()
+
+    # Whether the current trace is carried into asyncio tasks by the cache
+    # itself, without needing to be copied when each task is created.
+
+    propagates_context = False
 
     def __init__(self):
         self._cache = weakref.WeakValueDictionary()
@@ -124,7 +180,7 @@ class TraceCache(object):
                 return id(current)
 
         if self.asyncio:
-            task = current_task(self.asyncio)
+            task = self._current_task()
             if task is not None:
                 return id(task)
 
@@ -253,6 +309,11 @@ class TraceCache(object):
 
         self._cache[thread_id] = trace
 
+        self._save_coroutine(trace)
+
+    def _save_coroutine(self, trace):
+        thread_id = trace.thread_id
+
         # We judge whether we are actually running in a coroutine by
         # seeing if the current thread ID is actually listed in the set
         # of all current frames for executing threads. If we are
@@ -407,6 +468,144 @@ class TraceCache(object):
             root.add_child(node)
 
 
+class ContextTraceCache(TraceCache):
+    """Trace cache which holds the current trace in a context variable,
+    rather than in a dictionary keyed by the thread, greenlet or task ID
+    of the caller. The current trace is then looked up without needing
+    the ID of the caller, and is carried into asyncio tasks, and into any
+    callable run in a copy of the context, by the context variable itself.
+
+    Only the root traces of transactions are held in the dictionary, so
+    that active transactions can still be reported against their threads.
+    As the traces held by other tasks can't be found, any which are still
+    active when a transaction completes are not forced to complete, and
+    blocking of the event loop is only attributed to transactions with no
+    active traces.
+
+    """
+
+    propagates_context = True
+
+    def __init__(self):
+        super(ContextTraceCache, self).__init__()
+        self._context = contextvars.ContextVar("newrelic_trace", default=None)
+
+    def task_start(self, task):
+        pass
+
+    def task_stop(self, task):
+        pass
+
+    def current_transaction(self):
+        trace = self._context.get()
+        return trace and trace.transaction
+
+    def current_trace(self):
+        return self._context.get()
+
+    def prepare_for_root(self):
+        trace = self._context.get()
+        if not trace:
+            return None
+
+        if not hasattr(trace, "_task"):
+            return trace
+
+        task = self._current_task()
+        if task is not None and id(trace._task) != id(task):
+            self._context.set(None)
+            return None
+
+        if trace.root and trace.root.exited:
+            self._context.set(None)
+            return None
+
+        return trace
+
+    def save_trace(self, trace):
+        current = self._context.get()
+
+        if current is not None:
+            cache_root = current.root
+            if cache_root and cache_root is not trace.root and not cache_root.exited:
+                # Cached trace exists and has a valid root still
+                _logger.error(
+                    "Runtime instrumentation error. Attempt to "
+                    "save a trace from an inactive transaction. "
+                    "Report this issue to New Relic support.\n%s",
+                    "".join(traceback.format_stack()[:-1]),
+                )
+
+                raise TraceCacheActiveTraceError("transaction already active")
+
+        self._context.set(trace)
+
+        if trace.root is trace:
+            self._cache[trace.thread_id] = trace
+
+        self._save_coroutine(trace)
+
+    def thread_start(self, trace):
+        if self._context.get() is not None:
+            _logger.error(
+                "Runtime instrumentation error. An active "
+                "trace already exists in the current context. Report "
+                "this issue to New Relic support.\n "
+            )
+            return None
+
+        return self._context.set(trace)
+
+    def thread_stop(self, token):
+        if token:
+            try:
+                self._context.reset(token)
+            except ValueError:
+                # The token was created in a different context.
+                self._context.set(None)
+
+    def pop_current(self, trace):
+        if hasattr(trace, "_task"):
+            delattr(trace, "_task")
+
+        # A trace may exit in a different context to the one it was
+        # entered in, in which case the current trace is left alone.
+
+        if self._context.get() is trace:
+            self._context.set(trace.parent)
+
+    def complete_root(self, root):
+        if hasattr(root, "_task"):
+            root._task = None
+
+        current = self._context.get()
+
+        if current is None:
+            # The transaction may be completed from a different context
+            # to the one it was started in, such as when a coroutine
+            # is closed from another task. The root left in the context
+            # it was started in is ignored once exited.
+
+            if self._cache.get(root.thread_id) is not root:
+                raise TraceCacheNoActiveTraceError("no active trace")
+
+        elif root is not current:
+            _logger.error(
+                "Runtime instrumentation error. Attempt to "
+                "drop the root when it is not the current "
+                "trace. Report this issue to New Relic support.\n%s",
+                "".join(traceback.format_stack()[:-1]),
+            )
+
+            raise RuntimeError("not the current trace")
+
+        else:
+            self._context.set(None)
+
+        self._cache.pop(root.thread_id, None)
+        root._greenlet = None
+
+
 _trace_cache = TraceCache()
 
 
@@ -414,9 +613,29 @@ def trace_cache():
     return _trace_cache
 
 
+def use_context_trace_cache():
+    """Replaces the trace cache with one which holds the current trace in
+    a context variable. This must be done before any transactions are
+    started. Returns False if context variables aren't available, in
+    which case the existing trace cache is retained.
+
+    """
+
+    global _trace_cache
+
+    if contextvars is None:
+        return False
+
+    if not isinstance(_trace_cache, ContextTraceCache):
+        _trace_cache = ContextTraceCache()
+
+    return True
+
+
 def greenlet_loaded(module):
     _trace_cache.greenlet = module
 
 
 def asyncio_loaded(module):
     _trace_cache.asyncio = module
+    _trace_cache._current_task = task_lookup(module)
@@ -50,7 +50,7 @@ _TransactionNode = namedtuple('_TransactionNode',
         'distributed_trace_intrinsics', 'user_attributes', 'priority',
         'sampled', 'parent_transport_duration', 'parent_span', 'parent_type',
         'parent_account', 'parent_app', 'parent_tx', 'parent_transport_type',
-        'root_span_guid', 'trace_id', 'loop_time'])
+        'root_span_guid', 'trace_id', 'loop_time', 'streamed_metrics'])
 
 
 class TransactionNode(_TransactionNode):
@@ -235,6 +235,12 @@ class TransactionNode(_TransactionNode):
             for metric in child.time_metrics(stats, self, self):
                 yield metric
 
+        # And the metrics for any nodes which weren't retained.
+
+        if self.streamed_metrics is not None:
+            for metric in self.streamed_metrics.time_metrics(self):
+                yield metric
+
     def apdex_metrics(self, stats):
         """Return a generator yielding the apdex metrics for this node.
 
@@ -470,37 +476,46 @@ class TransactionNode(_TransactionNode):
 
         return intrinsics
 
-    def error_events(self, stats_table):
+    def event_source(self):
+        """Returns a copy of the transaction node from which the transaction
+        and error events for the transaction can still be created, but
+        which doesn't hold the trace hierarchy or other data only needed
+        for metrics and traces. This can be retained until the events are
+        required without retaining the whole transaction.
 
-        errors = []
-        for error in self.errors:
+        """
 
-            intrinsics = self.error_event_intrinsics(error, stats_table)
+        return self._replace(root=None, slow_sql=(), custom_events=None,
+                custom_metrics=None, streamed_metrics=None)
 
-            # Add user and agent attributes to event
+    def error_events(self, stats_table):
+        return [self.error_event(error, stats_table) for error in self.errors]
 
-            agent_attributes = {}
-            for attr in self.agent_attributes:
-                if attr.destinations & DST_ERROR_COLLECTOR:
-                    agent_attributes[attr.name] = attr.value
+    def error_event(self, error, stats_table):
 
-            user_attributes = {}
-            for attr in self.user_attributes:
-                if attr.destinations & DST_ERROR_COLLECTOR:
-                    user_attributes[attr.name] = attr.value
+        intrinsics = self.error_event_intrinsics(error, stats_table)
 
-            # add error specific custom params to this error's userAttributes
+        # Add user and agent attributes to event
 
-            err_attrs = create_user_attributes(error.custom_params,
-                    self.settings.attribute_filter)
-            for attr in err_attrs:
-                if attr.destinations & DST_ERROR_COLLECTOR:
-                    user_attributes[attr.name] = attr.value
+        agent_attributes = {}
+        for attr in self.agent_attributes:
+            if attr.destinations & DST_ERROR_COLLECTOR:
+                agent_attributes[attr.name] = attr.value
 
-            error_event = [intrinsics, user_attributes, agent_attributes]
-            errors.append(error_event)
+        user_attributes = {}
+        for attr in self.user_attributes:
+            if attr.destinations & DST_ERROR_COLLECTOR:
+                user_attributes[attr.name] = attr.value
+
+        # add error specific custom params to this error's userAttributes
 
-        return errors
+        err_attrs = create_user_attributes(error.custom_params,
+                self.settings.attribute_filter)
+        for attr in err_attrs:
+            if attr.destinations & DST_ERROR_COLLECTOR:
+                user_attributes[attr.name] = attr.value
+
+        return [intrinsics, user_attributes, agent_attributes]
 
     def error_event_intrinsics(self, error, stats_table):
 
@@ -590,6 +605,9 @@ class TransactionNode(_TransactionNode):
                        user_attributes=u_attrs,
                        agent_attributes=a_attrs)
 
+    def span_event_count(self):
+        return self.root.span_event_count()
+
     def span_events(self, settings, attr_class=dict):
         base_attrs = attr_class((
             ('transactionId', self.guid),
@@ -9,7 +9,11 @@ def _bind_thread_handler(loop, source_task, *args, **kwargs):
 class ContextOf(object):
     def __init__(self, trace_cache_id):
         self.trace_cache = trace_cache()
-        self.trace = self.trace_cache._cache.get(trace_cache_id)
+        self.trace = None
+        # Where the trace cache propagates context itself, the context
+        # is already carried across by asgiref.
+        if not self.trace_cache.propagates_context:
+            self.trace = self.trace_cache._cache.get(trace_cache_id)
         self.thread_id = None
         self.restore = None
 
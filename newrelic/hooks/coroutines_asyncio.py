@@ -23,7 +23,11 @@ def remove_from_cache(task):
 
 
 def propagate_task_context(task):
-    trace_cache().task_start(task)
+    cache = trace_cache()
+    if cache.propagates_context:
+        return task
+
+    cache.task_start(task)
     task.add_done_callback(remove_from_cache)
     return task
 
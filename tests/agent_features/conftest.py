@@ -52,5 +52,6 @@ if six.PY2:
         'test_asgi_transaction.py',
         'test_asgi_browser.py',
         'test_asgi_distributed_tracing.py',
-        'test_asgi_w3c_trace_context.py'
+        'test_asgi_w3c_trace_context.py',
+        'test_context_trace_cache.py',
     ]
@@ -0,0 +1,117 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+
+import pytest
+
+import newrelic.core.trace_cache
+
+from newrelic.api.background_task import background_task
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.time_trace import current_trace
+from newrelic.api.transaction import current_transaction
+from newrelic.core.trace_cache import ContextTraceCache, trace_cache
+
+from testing_support.fixtures import validate_transaction_metrics
+
+contextvars = pytest.importorskip('contextvars')
+
+
+@pytest.fixture(autouse=True)
+def context_trace_cache(monkeypatch):
+    cache = ContextTraceCache()
+    monkeypatch.setattr(newrelic.core.trace_cache, '_trace_cache', cache)
+    return cache
+
+
+async def _child(name):
+    with FunctionTrace(name):
+        await asyncio.sleep(0)
+
+
+@validate_transaction_metrics('test_context_trace_cache:test_task_propagation',
+        scoped_metrics=[('Function/child_1', 1), ('Function/child_2', 1)],
+        background_task=True)
+def test_task_propagation(context_trace_cache):
+    @background_task(name='test_context_trace_cache:test_task_propagation')
+    async def _test():
+        with FunctionTrace('parent'):
+            await asyncio.gather(_child('child_1'), _child('child_2'))
+
+        # Nothing need be held for the tasks once they complete.
+
+        assert list(context_trace_cache._cache.values()) == [
+                current_trace()]
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        loop.run_until_complete(_test())
+    finally:
+        loop.close()
+
+    assert not context_trace_cache._cache
+    assert trace_cache().current_trace() is None
+
+
+@validate_transaction_metrics('test_context_trace_cache:test_copied_context',
+        scoped_metrics=[('Function/executor', 1)],
+        background_task=True)
+def test_copied_context():
+    def _executor():
+        with FunctionTrace('executor'):
+            return current_transaction()
+
+    @background_task(name='test_context_trace_cache:test_copied_context')
+    async def _test():
+        context = contextvars.copy_context()
+        loop = asyncio.get_event_loop()
+
+        transaction = await loop.run_in_executor(None, context.run,
+                _executor)
+
+        assert transaction is current_transaction()
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        loop.run_until_complete(_test())
+    finally:
+        loop.close()
+
+
+@background_task()
+def test_thread_start_stop():
+    cache = trace_cache()
+    trace = current_trace()
+
+    result = []
+
+    def _thread():
+        token = cache.thread_start(trace)
+        result.append(current_transaction())
+        cache.thread_stop(token)
+        result.append(current_transaction())
+
+    thread = threading.Thread(target=_thread)
+    thread.start()
+    thread.join()
+
+    assert result == [current_transaction(), None]
+
+    # A trace can't be started for a context with an active trace.
+
+    assert cache.thread_start(trace) is None
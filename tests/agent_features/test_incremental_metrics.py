@@ -0,0 +1,187 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from newrelic.api.background_task import background_task
+from newrelic.api.transaction import (current_transaction,
+        set_transaction_name)
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics, trace_batch_loop)
+
+
+def force_sampled(sampled):
+    @transient_function_wrapper('newrelic.core.adaptive_sampler',
+            'AdaptiveSampler.compute_sampled')
+    def _force_sampled(wrapped, instance, args, kwargs):
+        wrapped(*args, **kwargs)
+        return sampled
+
+    return _force_sampled
+
+
+def validate_retained_nodes(count, streamed):
+    @transient_function_wrapper('newrelic.core.stats_engine',
+            'StatsEngine.record_transaction')
+    def _validate_retained_nodes(wrapped, instance, args, kwargs):
+        def _bind_params(transaction, *args, **kwargs):
+            return transaction
+
+        transaction = _bind_params(*args, **kwargs)
+
+        def _count(node):
+            return 1 + sum(_count(child) for child in node.children)
+
+        assert sum(_count(child) for child in
+                transaction.root.children) == count
+
+        if not count:
+            assert transaction.suppress_transaction_trace
+
+        if streamed:
+            assert transaction.streamed_metrics.node_count == streamed
+        else:
+            assert transaction.streamed_metrics is None
+
+        return wrapped(*args, **kwargs)
+
+    return _validate_retained_nodes
+
+
+_scoped_metrics = [
+    ('Function/loop', 100),
+    ('Datastore/statement/Postgres/users/select', 100),
+]
+
+_rollup_metrics = [
+    ('Datastore/all', 100),
+    ('Datastore/allOther', 100),
+    ('Datastore/Postgres/all', 100),
+]
+
+_settings = {
+    'stats_engine.incremental_metrics': True,
+    'agent_limits.nodes_per_transaction': 0,
+    'agent_limits.transaction_traces_nodes': 5,
+    'event_harvest_config.harvest_limits.span_event_data': 3,
+}
+
+
+# Each iteration of the loop completes two nodes, so only the datastore
+# node of the third iteration is retained, and it is accumulated along
+# with the function node holding it. Every node in later iterations is
+# accumulated as it completes.
+
+@override_application_settings(_settings)
+@validate_retained_nodes(4, 1 + 97 * 2)
+@validate_transaction_metrics('renamed', group='Batch',
+        scoped_metrics=_scoped_metrics, rollup_metrics=_rollup_metrics,
+        background_task=True)
+@background_task()
+def test_incremental_metrics():
+    trace_batch_loop(100)
+
+    # The scope of metrics already accumulated is the final name of the
+    # transaction.
+
+    set_transaction_name('renamed', group='Batch')
+
+
+@override_application_settings({'stats_engine.incremental_metrics': False})
+@validate_retained_nodes(200, None)
+@validate_transaction_metrics(
+        'test_incremental_metrics:test_incremental_metrics_disabled',
+        scoped_metrics=_scoped_metrics, rollup_metrics=_rollup_metrics,
+        background_task=True)
+@background_task()
+def test_incremental_metrics_disabled():
+    trace_batch_loop(100)
+
+
+_metrics_only_settings = {
+    'distributed_tracing.enabled': True,
+    'stats_engine.unsampled_metrics_only': True,
+    'agent_limits.nodes_per_transaction': 0,
+}
+
+
+# Transactions which aren't sampled retain no nodes, and so have neither
+# a transaction trace nor span events, while those which are sampled are
+# traced in full.
+
+@pytest.mark.parametrize('sampled,retained,streamed', (
+    (False, 0, 200),
+    (True, 200, None),
+))
+def test_unsampled_metrics_only(sampled, retained, streamed):
+
+    @override_application_settings(_metrics_only_settings)
+    @force_sampled(sampled)
+    @validate_retained_nodes(retained, streamed)
+    @validate_transaction_metrics('_test',
+            scoped_metrics=_scoped_metrics, rollup_metrics=_rollup_metrics,
+            background_task=True)
+    @background_task(name='_test')
+    def _test():
+        transaction = current_transaction()
+
+        assert transaction.sampled is sampled
+        assert transaction.should_record_segment_params is sampled
+
+        trace_batch_loop(100)
+
+    _test()
+
+
+_payload = {
+    'v': [0, 1],
+    'd': {
+        'ac': '1',
+        'ap': '2827902',
+        'id': '7d3efb1b173fecfa',
+        'pr': 10.001,
+        'sa': True,
+        'ti': 1518469636035,
+        'tr': 'd6b4ba0c3a712ca',
+        'ty': 'App',
+    }
+}
+
+
+# Nodes may already have been dropped by the time a distributed trace
+# payload is accepted, so the sampling decision made on entering the
+# transaction is kept.
+
+@override_application_settings(dict(_metrics_only_settings,
+        trusted_account_key='1'))
+@force_sampled(False)
+@validate_retained_nodes(0, 200)
+@background_task(name='_test')
+def test_unsampled_metrics_only_payload_accepted():
+    trace_batch_loop(50)
+
+    transaction = current_transaction()
+
+    assert transaction.accept_distributed_trace_headers(
+            [('newrelic', json.dumps(_payload))])
+
+    assert transaction.parent_span == '7d3efb1b173fecfa'
+    assert transaction.sampled is False
+    assert transaction.priority < 1.0
+
+    trace_batch_loop(50)
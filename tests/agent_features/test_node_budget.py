@@ -0,0 +1,88 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.background_task import background_task
+from newrelic.common.object_wrapper import transient_function_wrapper
+from newrelic.core.aggregate_node import AggregateNode
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics, validate_tt_segment_params,
+        dt_enabled, trace_batch_loop)
+from testing_support.validators.validate_span_events import (
+        validate_span_events)
+
+
+def validate_root_children(count, call_counts):
+    @transient_function_wrapper('newrelic.core.stats_engine',
+            'StatsEngine.record_transaction')
+    def _validate_root_children(wrapped, instance, args, kwargs):
+        def _bind_params(transaction, *args, **kwargs):
+            return transaction
+
+        transaction = _bind_params(*args, **kwargs)
+        children = transaction.root.children
+
+        assert len(children) == count
+
+        assert [child.call_count for child in children
+                if type(child) is AggregateNode] == call_counts
+
+        return wrapped(*args, **kwargs)
+
+    return _validate_root_children
+
+
+_scoped_metrics = [
+    ('Function/loop', 100),
+    ('Datastore/statement/Postgres/users/select', 100),
+]
+
+_rollup_metrics = [
+    ('Datastore/all', 100),
+    ('Datastore/allOther', 100),
+    ('Datastore/Postgres/all', 100),
+]
+
+
+@override_application_settings({'agent_limits.nodes_per_transaction': 10})
+@validate_root_children(6, [95])
+@validate_transaction_metrics('test_node_budget:test_nodes_folded',
+        scoped_metrics=_scoped_metrics, rollup_metrics=_rollup_metrics,
+        background_task=True)
+@background_task()
+def test_nodes_folded():
+    trace_batch_loop(100)
+
+
+@override_application_settings({'agent_limits.nodes_per_transaction': 0})
+@validate_root_children(100, [])
+@validate_transaction_metrics('test_node_budget:test_nodes_not_folded',
+        scoped_metrics=_scoped_metrics, rollup_metrics=_rollup_metrics,
+        background_task=True)
+@background_task()
+def test_nodes_not_folded():
+    trace_batch_loop(100)
+
+
+@dt_enabled
+@override_application_settings({
+    'agent_limits.nodes_per_transaction': 10,
+    'span_events.enabled': True,
+    'transaction_tracer.transaction_threshold': 0.0,
+})
+@validate_span_events(count=6, exact_intrinsics={'name': 'Function/loop'})
+@validate_tt_segment_params(present_params=('call_count',))
+@background_task()
+def test_folded_nodes_traced():
+    trace_batch_loop(100)
@@ -36,3 +36,28 @@ def test_trace_after_end_of_transaction(caplog):
     error_messages = [record for record in caplog.records
             if record.levelno >= logging.ERROR]
     assert not error_messages
+
+
+@validate_transaction_metrics(
+    'test_trace_reused_after_complete',
+    background_task=True,
+    scoped_metrics=[('Function/reused', 1), ('Function/child', 2)],
+)
+@background_task(name='test_trace_reused_after_complete')
+def test_trace_reused_after_complete(caplog):
+    trace = FunctionTrace('reused')
+
+    with trace:
+        with FunctionTrace('child'):
+            pass
+
+    # Entering the trace again mustn't record it a second time or make
+    # it the parent of any further traces.
+
+    with trace:
+        with FunctionTrace('child'):
+            pass
+
+    error_messages = [record for record in caplog.records
+            if record.levelno >= logging.ERROR]
+    assert len(error_messages) == 1
@@ -0,0 +1,210 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+
+from newrelic.core import adaptive_sampler
+from newrelic.core.adaptive_sampler import (AdaptiveSampler,
+        ShardedAdaptiveSampler)
+
+SAMPLING_TARGET = 10
+NUM_THREADS = 8
+NUM_PERIODS = 20
+CALLS_PER_THREAD = 500
+
+
+def _run_period(sampler):
+    counts = [0] * NUM_THREADS
+    start = threading.Event()
+
+    def _worker(index):
+        start.wait()
+        for _ in range(CALLS_PER_THREAD):
+            if sampler.compute_sampled():
+                counts[index] += 1
+
+    threads = [threading.Thread(target=_worker, args=(index,))
+            for index in range(NUM_THREADS)]
+
+    for thread in threads:
+        thread.start()
+
+    start.set()
+
+    for thread in threads:
+        thread.join()
+
+    # Start a new sampling period on the next call.
+
+    sampler.last_reset = time.time() - sampler.period
+
+    return sum(counts)
+
+
+@pytest.mark.parametrize('sampler_type', (AdaptiveSampler,
+        ShardedAdaptiveSampler))
+def test_sampling_target_under_concurrency(sampler_type):
+    sampler = sampler_type(SAMPLING_TARGET, 60.0)
+
+    sampled = [_run_period(sampler) for _ in range(NUM_PERIODS)]
+
+    # Exactly the target is sampled in the first period, and never more
+    # than twice the target in later periods, however many threads are
+    # computing the sampling decision at once.
+
+    assert sampled[0] == SAMPLING_TARGET
+    assert max(sampled[1:]) <= 2 * SAMPLING_TARGET
+
+    # Over a number of periods the number sampled averages out at about
+    # the target.
+
+    mean = sum(sampled[1:]) / float(NUM_PERIODS - 1)
+
+    assert 0.5 * SAMPLING_TARGET <= mean <= 1.5 * SAMPLING_TARGET, sampled
+
+
+def test_sharded_counts_flushed():
+    sampler = ShardedAdaptiveSampler(SAMPLING_TARGET, 60.0)
+    interval = sampler.flush_interval
+    num_calls = 3 * interval + 1
+
+    for _ in range(num_calls):
+        sampler.compute_sampled()
+
+    # The counts held by a shard are only added to the total for the
+    # period every flush interval, or when a transaction is sampled.
+
+    held = sampler._shard().computed_count
+
+    assert 0 < held < interval
+    assert sampler.computed_count + held == num_calls
+    assert sampler.sampled_count == SAMPLING_TARGET
+
+
+def test_sharded_counts_discarded_on_reset():
+    sampler = ShardedAdaptiveSampler(SAMPLING_TARGET, 60.0)
+
+    for _ in range(SAMPLING_TARGET + 1):
+        sampler.compute_sampled()
+
+    assert sampler._shard().computed_count
+
+    # Counts held by the shard of a thread when a new period is started by
+    # another thread are not added to the totals for the new period.
+
+    def _reset():
+        sampler.last_reset = time.time() - sampler.period
+        sampler.compute_sampled()
+
+    thread = threading.Thread(target=_reset)
+    thread.start()
+    thread.join()
+
+    assert sampler.computed_count_last == SAMPLING_TARGET
+    assert sampler.computed_count == 0
+    assert sampler._shard().computed_count == 0
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+def _run_slow_threads(sampler, clock, num_threads, calls_per_period,
+        num_periods):
+    # Each thread computes the sampling decision for a transaction in
+    # turn, with the calls spread evenly across each period. Returns for
+    # each period the number sampled at each step through the period.
+
+    sampled = [[0] * calls_per_period for _ in range(num_periods)]
+    turns = [threading.Event() for _ in range(num_threads)]
+    done = threading.Event()
+    steps = []
+
+    def _worker(index):
+        while True:
+            turns[index].wait()
+            turns[index].clear()
+
+            if not steps:
+                return
+
+            period, step = steps[-1]
+
+            if sampler.compute_sampled():
+                sampled[period][step] += 1
+
+            done.set()
+
+    threads = [threading.Thread(target=_worker, args=(index,))
+            for index in range(num_threads)]
+
+    for thread in threads:
+        thread.start()
+
+    for period in range(num_periods):
+        for step in range(calls_per_period):
+            steps.append((period, step))
+
+            for turn in turns:
+                done.clear()
+                turn.set()
+                done.wait()
+
+            clock.now += sampler.period / calls_per_period
+
+    del steps[:]
+
+    for turn in turns:
+        turn.set()
+
+    for thread in threads:
+        thread.join()
+
+    return sampled
+
+
+@pytest.mark.parametrize('sampler_type', (AdaptiveSampler,
+        ShardedAdaptiveSampler))
+def test_sampling_target_many_slow_threads(sampler_type, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(adaptive_sampler, 'time', clock)
+
+    sampler = sampler_type(SAMPLING_TARGET, 60.0)
+
+    # Many threads, each computing fewer transactions in a period than
+    # the flush interval of the sharded sampler.
+
+    sampled = _run_slow_threads(sampler, clock, num_threads=40,
+            calls_per_period=10, num_periods=NUM_PERIODS)
+
+    totals = [sum(steps) for steps in sampled[1:]]
+
+    # The number sampled averages out at about the target, rather than
+    # being twice the target, and the transactions sampled are spread
+    # across the period rather than all being early in the period.
+
+    mean = sum(totals) / float(NUM_PERIODS - 1)
+
+    assert 0.5 * SAMPLING_TARGET <= mean <= 1.5 * SAMPLING_TARGET, totals
+
+    early = sum(sum(steps[:2]) for steps in sampled[1:])
+
+    assert early < 0.5 * sum(totals), sampled
@@ -218,6 +218,24 @@ def test_send(status_code):
     assert protocol.finalize() is None
 
 
+@pytest.mark.parametrize("method", ("metric_data", "get_agent_commands"))
+def test_send_streamed_payload(method):
+    HttpClientRecorder.STATUS_CODE = 202
+    settings = finalize_application_settings(
+        {"agent_limits.payload_chunk_size": 2, "agent_run_id": "RUN_TOKEN"}
+    )
+    protocol = AgentProtocol(settings, client_cls=HttpClientRecorder)
+    protocol.send(method, (1, [2, 3]))
+
+    request = HttpClientRecorder.SENT[0]
+
+    if method in AgentProtocol.STREAMED_METHODS:
+        assert not isinstance(request.payload, bytes)
+        assert b"".join(request.payload) == b"[1,[2,3]]"
+    else:
+        assert request.payload == b"[1,[2,3]]"
+
+
 @pytest.mark.parametrize(
     "status_code,expected_exc,log_level",
     (
@@ -0,0 +1,150 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.aggregate_node import AggregateNode, fold_node
+from newrelic.core.datastore_node import DatastoreNode
+from newrelic.core.external_node import ExternalNode
+from newrelic.core.function_node import FunctionNode
+from newrelic.core.metric import TimeMetricBatch
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
+
+from testing_support.fixtures import create_stats_engine
+
+
+class _Root(object):
+    path = 'OtherTransaction/Function/batch'
+    type = 'OtherTransaction'
+
+
+def _datastore_node(start_time, duration, operation='select'):
+    return DatastoreNode(product='Postgres', target='users',
+            operation=operation, children=EMPTY_CHILDREN,
+            start_time=start_time, end_time=start_time + duration,
+            duration=duration, exclusive=duration, host='localhost',
+            port_path_or_id='5432', database_name='db', guid='1',
+            agent_attributes=EMPTY_ATTRIBUTES,
+            user_attributes=EMPTY_ATTRIBUTES)
+
+
+def _function_node(name, start_time, children=EMPTY_CHILDREN,
+        duration=1.0):
+    exclusive = duration - sum(child.duration for child in children)
+    return FunctionNode(group='Function', name=name, children=children,
+            start_time=start_time, end_time=start_time + duration,
+            duration=duration, exclusive=exclusive, label=None, params=None,
+            rollup=None, guid='2', agent_attributes=EMPTY_ATTRIBUTES,
+            user_attributes=EMPTY_ATTRIBUTES)
+
+
+def _loop_nodes(count):
+    nodes = []
+
+    for index in range(count):
+        start_time = float(index)
+        duration = 0.25 * (index % 3 + 1)
+        children = [_datastore_node(start_time, duration / 2),
+                _datastore_node(start_time, duration / 4, 'insert')]
+        nodes.append(_function_node('loop', start_time, children,
+                duration))
+
+    return nodes
+
+
+def _metrics(nodes):
+    stats = create_stats_engine()
+    batch = TimeMetricBatch()
+
+    for node in nodes:
+        batch.extend(node.time_metrics(stats, _Root(), None))
+
+    return dict(batch.stats())
+
+
+def test_folded_metrics_are_exact():
+    nodes = _loop_nodes(100)
+
+    children = []
+    index = {}
+
+    folded = [fold_node(children, index, node) for node in nodes]
+
+    assert folded == [False] + [True] * 99
+    assert len(children) == 1
+
+    aggregate = children[0]
+
+    assert type(aggregate) is AggregateNode
+    assert aggregate.call_count == 100
+    assert len(aggregate.children) == 2
+    assert [child.call_count for child in aggregate.children] == [100, 100]
+
+    expected = _metrics(nodes)
+    actual = _metrics(children)
+
+    assert sorted(actual) == sorted(expected)
+
+    for key, values in expected.items():
+        assert actual[key] == pytest.approx(values), key
+
+
+def test_fold_aggregate_into_aggregate():
+    nodes = _loop_nodes(10)
+
+    children = []
+    index = {}
+
+    # Calls already folded under one parent are folded again where the
+    # parents are themselves folded.
+
+    for node in nodes:
+        inner = []
+        inner_index = {}
+        for child in node.children + node.children:
+            fold_node(inner, inner_index, child)
+        fold_node(children, index, node._replace(children=inner))
+
+    aggregate = children[0]
+
+    assert aggregate.call_count == 10
+    assert [child.call_count for child in aggregate.children] == [20, 20]
+
+
+def test_nodes_without_key_not_folded():
+    node = ExternalNode(library='library', url='http://example.com',
+            method='GET', children=EMPTY_CHILDREN, start_time=0.0,
+            end_time=1.0, duration=1.0, exclusive=1.0, params={},
+            guid='3', agent_attributes={}, user_attributes={})
+
+    children = []
+    index = {}
+
+    assert not fold_node(children, index, node)
+    assert not fold_node(children, index, node)
+    assert children == [node, node]
+
+
+def test_different_names_not_folded():
+    children = []
+    index = {}
+
+    fold_node(children, index, _function_node('a', 0.0))
+    fold_node(children, index, _function_node('b', 1.0))
+    fold_node(children, index, _function_node('a', 2.0))
+
+    assert [child.name for child in children] == ['a', 'b']
+    assert children[0].call_count == 2
+    assert children[0].start_time == 0.0
+    assert children[0].end_time == 3.0
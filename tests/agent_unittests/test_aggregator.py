@@ -0,0 +1,318 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import sys
+import tempfile
+
+import pytest
+
+from newrelic.packages.six.moves import queue
+
+from newrelic.core.aggregator import (AggregatorClient, AggregatorServer,
+        socket_path_for)
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.metric import ApdexMetric, TimeMetric
+from newrelic.core.snapshot_format import decode_snapshot, encode_snapshot
+from newrelic.core.stats_engine import CountStats
+
+from testing_support.fixtures import create_stats_engine
+
+
+def _record_worker_data(stats):
+    stats.record_time_metric(TimeMetric(name='Function/a', scope='',
+            duration=1.0, exclusive=None))
+    stats.record_apdex_metric(ApdexMetric(name='Apdex', satisfying=1,
+            tolerating=0, frustrating=0, apdex_t=0.5))
+    stats.stats_table.merge_stats(('Custom/count', ''),
+            CountStats(call_count=3))
+
+    stats.transaction_events.add({'name': 'transaction'}, priority=0.5)
+    stats.custom_events.add({'name': 'custom'}, priority=0.25)
+
+    try:
+        raise ValueError('oops')
+    except ValueError:
+        stats.record_exception(*sys.exc_info())
+
+
+def _metric_data(stats):
+    return dict(((key['name'], key['scope']), value)
+            for key, value in stats.metric_data())
+
+
+@pytest.mark.parametrize('compact_metrics', (True, False))
+def test_merge_forwarded_data(compact_metrics):
+    worker = create_stats_engine({
+            'stats_engine.compact_metrics': compact_metrics})
+    _record_worker_data(worker)
+
+    data = decode_snapshot(encode_snapshot(worker.forwarded_data()))
+
+    aggregator = create_stats_engine({
+            'stats_engine.compact_metrics': not compact_metrics})
+    aggregator.merge_forwarded_data(data)
+    aggregator.merge_forwarded_data(data)
+
+    metric_data = _metric_data(aggregator)
+
+    assert metric_data[('Function/a', '')] == [2, 2.0, 2.0, 1.0, 1.0, 2.0]
+    assert metric_data[('Apdex', '')] == [2, 0, 0, 0.5, 0.5, 0]
+    assert metric_data[('Custom/count', '')][0] == 6
+
+    assert aggregator.transaction_events.num_seen == 2
+    assert aggregator.custom_events.num_seen == 2
+    assert aggregator.error_events.num_seen == 2
+    assert len(aggregator.error_data()) == 2
+    assert aggregator.error_data()[0].message == 'oops'
+
+
+def test_merge_forwarded_flexible_snapshot():
+    worker = create_stats_engine()
+    _record_worker_data(worker)
+
+    # Event types not included in a flexible harvest are absent from the
+    # snapshot.
+
+    snapshot = worker.harvest_snapshot(flexible=True)
+
+    aggregator = create_stats_engine()
+    aggregator.merge_forwarded_data(snapshot.forwarded_data())
+
+    assert aggregator.metrics_count() == 0
+    assert aggregator.transaction_events.num_seen == 0
+
+
+def test_aggregator_forward(tmpdir):
+    path = os.path.join(str(tmpdir), 'aggregator.sock')
+    received = queue.Queue()
+
+    def merge(app_name, message):
+        received.put((app_name, message))
+
+    server = AggregatorServer(path, merge)
+    server.start()
+
+    worker = create_stats_engine()
+    _record_worker_data(worker)
+
+    client = AggregatorClient(path)
+
+    try:
+        data = worker.forwarded_data()
+
+        assert client.forward('Python Agent Test', data, ['Linked'], 2)
+        assert client.forward('Python Agent Test', data)
+
+        app_name, message = received.get(timeout=5.0)
+
+        assert app_name == 'Python Agent Test'
+        assert message['pid'] == os.getpid()
+        assert message['linked_applications'] == ['Linked']
+        assert message['transaction_count'] == 2
+
+        aggregator = create_stats_engine()
+        aggregator.merge_forwarded_data(message['stats'])
+
+        assert _metric_data(aggregator) == _metric_data(worker)
+
+        assert received.get(timeout=5.0)[1]['transaction_count'] == 0
+
+    finally:
+        server.stop()
+
+    # Once the aggregator has gone away the worker must report the data
+    # itself.
+
+    assert not os.path.exists(path)
+    assert not client.forward('Python Agent Test', data)
+
+
+def test_aggregator_rejected(tmpdir):
+    path = os.path.join(str(tmpdir), 'aggregator.sock')
+    merged = []
+
+    def merge(app_name, message):
+        merged.append(app_name)
+        return len(merged) > 1
+
+    server = AggregatorServer(path, merge)
+    server.start()
+
+    worker = create_stats_engine()
+    _record_worker_data(worker)
+
+    client = AggregatorClient(path)
+
+    try:
+        # A snapshot the aggregator couldn't merge is rejected, with the
+        # worker remaining responsible for it.
+        assert not client.forward('Python Agent Test',
+                worker.forwarded_data())
+        assert client.forward('Python Agent Test', worker.forwarded_data())
+
+    finally:
+        server.stop()
+
+    assert merged == ['Python Agent Test', 'Python Agent Test']
+
+
+def test_aggregator_merge_failed(tmpdir):
+    path = os.path.join(str(tmpdir), 'aggregator.sock')
+    aggregator = create_stats_engine()
+
+    def merge(app_name, message):
+        aggregator.merge_forwarded_data(message['stats'])
+
+    server = AggregatorServer(path, merge)
+    server.start()
+
+    worker = create_stats_engine()
+    _record_worker_data(worker)
+
+    data = worker.forwarded_data()
+    malformed = dict(data, errors=[('malformed',)])
+
+    client = AggregatorClient(path)
+
+    try:
+        # A snapshot which raises an exception when merged is rejected,
+        # with nothing having been merged from it.
+        assert not client.forward('Python Agent Test', malformed)
+        assert aggregator.metrics_count() == 0
+        assert aggregator.transaction_events.num_seen == 0
+
+        assert client.forward('Python Agent Test', data)
+        assert aggregator.transaction_events.num_seen == 1
+
+    finally:
+        server.stop()
+
+
+def test_aggregator_other_user(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'aggregator.sock')
+    received = []
+
+    server = AggregatorServer(path,
+            lambda app_name, message: received.append(app_name))
+    server.start()
+
+    worker = create_stats_engine()
+    _record_worker_data(worker)
+
+    client = AggregatorClient(path)
+
+    # Data is never forwarded to an aggregator running as another user.
+    uid = os.getuid()
+    monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+
+    try:
+        assert not client.forward('Python Agent Test',
+                worker.forwarded_data())
+
+    finally:
+        monkeypatch.undo()
+        server.stop()
+
+    assert received == []
+
+
+def test_aggregator_default_socket_path(tmpdir, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+
+    settings = finalize_application_settings({})
+
+    path = socket_path_for(settings.aggregator)
+    directory = os.path.dirname(path)
+
+    assert directory == os.path.join(str(tmpdir),
+            'newrelic-aggregator-%d' % os.getuid())
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    # A directory owned by another user is never used.
+    uid = os.getuid()
+    monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+    os.rename(directory, os.path.join(str(tmpdir),
+            'newrelic-aggregator-%d' % (uid + 1)))
+
+    with pytest.raises(OSError):
+        socket_path_for(settings.aggregator)
+
+
+def _slow_sql(identifier, count, max_call_time, params):
+    return ['WebTransaction/Function/view', '/view', identifier,
+            'SELECT * FROM users', 'Datastore/statement/Postgres/users/select',
+            count, max_call_time * count, max_call_time / 2, max_call_time,
+            params]
+
+
+def _trace(duration, synthetics_resource_id=None):
+    return [0.0, duration, 'WebTransaction/Function/view', None, 'data',
+            'guid', None, False, None, synthetics_resource_id]
+
+
+def test_merge_forwarded_slow_sql_and_traces():
+    aggregator = create_stats_engine()
+
+    aggregator.merge_forwarded_data({'metrics': [],
+            'slow_sql': [_slow_sql(1, 2, 1.0, 'a'), _slow_sql(2, 1, 0.5, 'b')],
+            'transaction_traces': [_trace(1.0), _trace(0.5, 'resource')]})
+
+    aggregator.merge_forwarded_data({'metrics': [],
+            'slow_sql': [_slow_sql(1, 1, 2.0, 'c')],
+            'transaction_traces': [_trace(2.0)]})
+
+    slow_sql = dict((entry[2], entry)
+            for entry in aggregator.slow_sql_data(None))
+
+    # Entries for the same SQL are combined, keeping the parameters of
+    # the slowest call.
+
+    assert slow_sql[1][5:] == [3, 4.0, 0.5, 2.0, 'c']
+    assert slow_sql[2][5:] == [1, 0.5, 0.25, 0.5, 'b']
+
+    # Only the slowest transaction trace is kept, along with any for
+    # Synthetics transactions.
+
+    traces = aggregator.transaction_trace_data(None)
+
+    assert [trace[1] for trace in traces] == [2.0, 0.5]
+
+    aggregator.harvest_snapshot()
+
+    assert aggregator.slow_sql_data(None) == []
+    assert aggregator.transaction_trace_data(None) == []
+
+
+def test_merge_forwarded_malformed():
+    aggregator = create_stats_engine()
+
+    aggregator.merge_forwarded_data({'metrics': [],
+            'slow_sql': [_slow_sql(1, 2, 1.0, 'a')]})
+
+    worker = create_stats_engine()
+    _record_worker_data(worker)
+
+    data = worker.forwarded_data()
+    data['slow_sql'] = [_slow_sql(1, 1, 2.0, 'b')[:5]]
+
+    with pytest.raises(IndexError):
+        aggregator.merge_forwarded_data(data)
+
+    # Nothing is merged from a malformed snapshot.
+
+    assert aggregator.metrics_count() == 0
+    assert aggregator.transaction_events.num_seen == 0
+    assert aggregator.slow_sql_data(None)[0][5:] == [2, 2.0, 0.5, 1.0, 'a']
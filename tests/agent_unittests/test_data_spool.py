@@ -0,0 +1,252 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import time
+
+import pytest
+
+from newrelic.common.agent_http import DeveloperModeClient
+from newrelic.common.encoding_utils import json_decode
+from newrelic.core.agent_protocol import AgentProtocol
+from newrelic.core.application import Application
+from newrelic.core.config import (finalize_application_settings,
+        global_settings)
+from newrelic.core.data_spool import DataSpool, SpooledPayload
+from newrelic.network.exceptions import (DiscardDataForRequest,
+        ForceAgentDisconnect, ForceAgentRestart, NetworkInterfaceException,
+        RetryDataForRequest)
+
+from testing_support.fixtures import override_generic_settings
+
+
+@pytest.fixture
+def spool(tmpdir):
+    return DataSpool(str(tmpdir), 'test', max_size=1024, max_age=60.0,
+            max_attempts=2)
+
+
+def _replay(spool, raises=None):
+    sent = []
+
+    def send(method, payload):
+        sent.append((method, payload))
+        if raises is not None:
+            raise raises()
+
+    spool.replay(send)
+
+    return sent
+
+
+def test_data_spool_replay(spool):
+    assert spool.append('metric_data', b'[1]')
+    assert spool.append('span_event_data', b'[2]')
+
+    assert _replay(spool) == [('metric_data', b'[1]'),
+            ('span_event_data', b'[2]')]
+
+    # Replayed payloads are removed from the spool.
+    assert _replay(spool) == []
+    assert os.listdir(spool.directory) == []
+
+
+def test_data_spool_max_size(spool):
+    assert spool.append('metric_data', b'*' * 512)
+    assert not spool.append('metric_data', b'*' * 512)
+
+    assert len(_replay(spool)) == 1
+
+
+def test_data_spool_max_age(spool):
+    spool.append('metric_data', b'[1]')
+    spool.max_age = -1.0
+
+    assert _replay(spool) == []
+    assert os.listdir(spool.directory) == []
+
+
+def test_data_spool_max_attempts(spool):
+    spool.append('metric_data', b'[1]')
+    spool.append('metric_data', b'[2]')
+
+    # Only the first send is attempted when it needs to be retried, but
+    # all the payloads are retained.
+    assert _replay(spool, RetryDataForRequest) == [('metric_data', b'[1]')]
+    assert _replay(spool, RetryDataForRequest) == [('metric_data', b'[1]')]
+
+    # The first payload has now been retried the maximum number of times.
+    assert _replay(spool) == [('metric_data', b'[2]')]
+
+
+def test_data_spool_discard(spool):
+    spool.append('metric_data', b'[1]')
+
+    assert len(_replay(spool, DiscardDataForRequest)) == 1
+    assert _replay(spool) == []
+
+
+@pytest.mark.parametrize('exc', (ForceAgentRestart, ForceAgentDisconnect))
+def test_data_spool_force_agent(spool, exc):
+    spool.append('metric_data', b'[1]')
+    spool.append('metric_data', b'[2]')
+
+    # The request to restart or disconnect is passed on, with the
+    # records retained for the next session.
+    with pytest.raises(exc):
+        _replay(spool, exc)
+
+    assert _replay(spool) == [('metric_data', b'[1]'),
+            ('metric_data', b'[2]')]
+
+
+def test_data_spool_network_failure(spool):
+    spool.append('metric_data', b'[1]')
+
+    # Failures other than a retry don't count towards the maximum
+    # number of attempts.
+    for _ in range(spool.max_attempts):
+        assert _replay(spool, NetworkInterfaceException) == [
+                ('metric_data', b'[1]')]
+
+    assert _replay(spool) == [('metric_data', b'[1]')]
+
+
+def test_data_spool_private(tmpdir):
+    directory = os.path.join(str(tmpdir), 'spool')
+
+    spool = DataSpool(directory, 'test', max_size=1024, max_age=60.0,
+            max_attempts=2)
+
+    assert spool.append('metric_data', b'[1]')
+
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(spool.path).st_mode) == 0o600
+
+
+def test_data_spool_foreign_directory(spool, monkeypatch):
+    uid = os.getuid()
+
+    spool.append('metric_data', b'[1]')
+
+    # A spool directory owned by another user is never written to or
+    # replayed from.
+    monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+
+    assert not spool.append('metric_data', b'[2]')
+    assert _replay(spool) == []
+
+    monkeypatch.undo()
+
+    assert _replay(spool) == [('metric_data', b'[1]')]
+
+
+def test_data_spool_truncated_segment(spool):
+    spool.append('metric_data', b'[1]')
+
+    # Simulate a process which was killed part way through writing a
+    # record to its segment file.
+    path = os.path.join(spool.directory, 'test.1.spool')
+    with open(path, 'wb') as fp:
+        record = SpooledPayload('metric_data', b'[2]', time.time() - 1.0)
+        fp.write(record.encode())
+        fp.write(SpooledPayload('metric_data', b'[3]').encode()[:-1])
+
+    assert _replay(spool) == [('metric_data', b'[2]'),
+            ('metric_data', b'[1]')]
+
+
+class StandInCollectorClient(DeveloperModeClient):
+    AVAILABLE = True
+    SENT = []
+
+    def send_request(self, method="POST",
+            path="/agent_listener/invoke_raw_method", params=None,
+            headers=None, payload=None):
+        if not self.AVAILABLE:
+            return 503, b''
+
+        if not isinstance(payload, bytes):
+            payload = b''.join(payload)
+
+        self.SENT.append((params['method'], json_decode(
+                payload.decode('utf-8'))))
+
+        return super(StandInCollectorClient, self).send_request(method,
+                path, params, headers, payload)
+
+
+def test_data_spool_collector_outage(tmpdir):
+    settings = finalize_application_settings({
+        'app_name': 'Python Agent Test (Data Spool)',
+        'agent_run_id': 'RUN_1',
+        'data_spool.enabled': True,
+        'data_spool.directory': str(tmpdir),
+        'agent_limits.payload_chunk_size': 1,
+    })
+
+    StandInCollectorClient.AVAILABLE = False
+    StandInCollectorClient.SENT = []
+
+    protocol = AgentProtocol(settings, client_cls=StandInCollectorClient)
+
+    # While the collector is unavailable, payloads for spooled methods
+    # are written to the spool rather than being retried.
+    protocol.send('analytic_event_data', ('RUN_1', {}, [[{}, {}, {}]]))
+
+    with pytest.raises(RetryDataForRequest):
+        protocol.send('sql_trace_data', ([],))
+
+    StandInCollectorClient.AVAILABLE = True
+
+    settings = finalize_application_settings({'agent_run_id': 'RUN_2'},
+            settings)
+    protocol = AgentProtocol(settings, client_cls=StandInCollectorClient)
+
+    assert protocol.replay_data_spool() == 1
+
+    # The replayed payload is updated with the new agent run ID.
+    assert StandInCollectorClient.SENT == [
+            ('analytic_event_data', ['RUN_2', {}, [[{}, {}, {}]]])]
+
+    assert protocol.replay_data_spool() == 0
+
+
+def test_data_spool_replayed_on_harvest(tmpdir):
+    app_name = 'Python Agent Test (Data Spool)'
+
+    @override_generic_settings(global_settings(), {
+        'developer_mode': True,
+        'data_spool.enabled': True,
+        'data_spool.directory': str(tmpdir),
+    })
+    def _test():
+        app = Application(app_name)
+        app.connect_to_data_collector(None)
+
+        # Data is only replayed from the harvest, once the data
+        # collector has accepted the data for the harvest, not when the
+        # session is activated.
+        spool = DataSpool.for_application(app.configuration.app_name,
+                app.configuration.data_spool)
+        spool.append('analytic_event_data', b'["RUN", {}, []]')
+
+        assert os.listdir(str(tmpdir))
+
+        app.harvest()
+
+        assert os.listdir(str(tmpdir)) == []
+
+    _test()
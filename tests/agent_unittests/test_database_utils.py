@@ -0,0 +1,443 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.api.database_trace import register_database_client
+from newrelic.core.config import global_settings
+from newrelic.core.database_utils import (ExplainPlanCache,
+        ExplainPlanResults, ExplainPlanWorker, SQLConnections, SQLStatement,
+        SQLStatementCache, explain_plan, sql_statement)
+
+
+class DummyDB(object):
+    def __init__(self, quoting_style):
+        self.quoting_style = quoting_style
+
+
+@pytest.mark.parametrize('quoting_style,sql,obfuscated', (
+    ('single', "SELECT * FROM t WHERE a = 'x' AND b = \"y\"",
+            'SELECT * FROM t WHERE a = ? AND b = "y"'),
+    ('single+double', "SELECT * FROM t WHERE a = 'x' AND b = \"y\"",
+            'SELECT * FROM t WHERE a = ? AND b = ?'),
+    ('single+dollar', 'SELECT * FROM t WHERE a = $tag$x$tag$ AND b = $1',
+            'SELECT * FROM t WHERE a = ? AND b = $?'),
+    ('single+oracle', "SELECT * FROM t WHERE a = q'[x]' AND b = TRUEq'{y}'",
+            'SELECT * FROM t WHERE a = ? AND b = ??'),
+    ('single', "SELECT * FROM t WHERE a = 'unterminated", '?'),
+    ('single', "SELECT * FROM t -- it's\nWHERE a = 1", '?'),
+    ('single', 'SELECT * FROM t WHERE a = -1.5e3 AND b = 0xFF AND c = :1 '
+            'AND d = x1', 'SELECT * FROM t WHERE a = ? AND b = ? AND c = :1 '
+            'AND d = x1'),
+    ('single', "SELECT * FROM t WHERE id = "
+            "'{12345678-1234-1234-1234-123456789abc}' OR "
+            "id = 12345678123412341234123456789abc",
+            'SELECT * FROM t WHERE id = ? OR id = ?'),
+    ('single', 'SELECT * FROM t WHERE a IS NULL AND b = true AND '
+            'c = nullable', 'SELECT * FROM t WHERE a IS ? AND b = ? AND '
+            'c = nullable'),
+    ('single', 'SELECT * /* comment */ FROM t WHERE a = 1 # trailing',
+            'SELECT *  FROM t WHERE a = ? '),
+))
+def test_obfuscate_sql(quoting_style, sql, obfuscated):
+    statement = SQLStatement(sql, DummyDB(quoting_style))
+
+    assert statement.obfuscated == obfuscated
+
+
+@pytest.mark.parametrize('sql,normalized', (
+    ('SELECT a,  b\n FROM t WHERE c IN (%s, %s) AND d = %(name)s AND '
+            'e = :name', 'SELECT a,b FROM t WHERE c IN(?)AND d=?AND e=?'),
+    ('  INSERT INTO t (a, b) VALUES (?, ?)  ', 'INSERT INTO t(?)VALUES(?)'),
+))
+def test_normalize_sql(sql, normalized):
+    statement = SQLStatement(sql, DummyDB('single'))
+
+    assert statement.normalized == normalized
+
+
+def test_large_sql_statement():
+    values = ', '.join("(%d, 'name %d', 0x%x)" % (index, index, index)
+            for index in range(1000))
+
+    sql = '/* batch */ INSERT INTO users (id, name, flags) VALUES ' + values
+
+    statement = SQLStatement(sql, DummyDB('single'))
+
+    assert statement.operation == 'insert'
+    assert statement.target == 'users'
+    assert statement.obfuscated == (' INSERT INTO users (id, name, flags) '
+            'VALUES ' + ', '.join(['(?, ?, ?)'] * 1000))
+    assert statement.normalized == 'INSERT INTO users(?)VALUES' + ','.join(
+            ['(?)'] * 1000)
+
+
+def test_uncommented_sql_without_comments():
+    sql = 'SELECT * FROM users WHERE id = 1'
+
+    statement = SQLStatement(sql, DummyDB('single'))
+
+    assert statement.uncommented == sql
+    assert statement.operation == 'select'
+    assert statement.target == 'users'
+
+
+def _statement_cache_metrics(hits=0, misses=0, evictions=0):
+    counts = (('Hits', hits), ('Misses', misses), ('Evictions', evictions))
+
+    return [('Supportability/Python/DatabaseUtils/StatementCache/%s' %
+            name, count) for name, count in counts if count]
+
+
+def test_statement_cache_hit():
+    cache = SQLStatementCache()
+
+    statement = cache.statement('SELECT 1', None, 10, 1024)
+
+    assert cache.statement('SELECT 1', None, 10, 1024) is statement
+    assert cache.statement('SELECT 2', None, 10, 1024) is not statement
+
+    assert cache.metrics() == _statement_cache_metrics(hits=1, misses=2)
+    assert cache.metrics() == []
+
+
+def test_statement_cache_maximum_entries():
+    cache = SQLStatementCache()
+
+    first = cache.statement('SELECT 1', None, 2, 1024)
+    cache.statement('SELECT 2', None, 2, 1024)
+
+    # Using the first statement makes the second the least recently
+    # used, so it is the one evicted.
+
+    assert cache.statement('SELECT 1', None, 2, 1024) is first
+    cache.statement('SELECT 3', None, 2, 1024)
+
+    assert len(cache) == 2
+    assert cache.statement('SELECT 1', None, 2, 1024) is first
+
+    assert cache.metrics() == _statement_cache_metrics(hits=2, misses=3,
+            evictions=1)
+
+
+def test_statement_cache_hit_without_lock():
+    cache = SQLStatementCache()
+
+    statement = cache.statement('SELECT 1', None, 10, 1024)
+
+    class Lock(object):
+        def __enter__(self):
+            raise AssertionError('Lock acquired for a cached statement.')
+
+        def __exit__(self, *args):
+            pass
+
+    cache._lock = Lock()
+
+    assert cache.statement('SELECT 1', None, 10, 1024) is statement
+
+    with pytest.raises(AssertionError):
+        cache.statement('SELECT 2', None, 10, 1024)
+
+
+def test_statement_cache_maximum_size():
+    cache = SQLStatementCache()
+
+    for index in range(10):
+        cache.statement('SELECT %d' % index, None, 100, 24)
+
+    assert len(cache) == 3
+    assert cache.size == 24
+
+    # A statement larger than the cache is returned but not retained.
+
+    statement = cache.statement('SELECT' + ' ' * 24, None, 100, 24)
+
+    assert statement.operation == 'select'
+    assert len(cache) == 3
+
+    assert cache.metrics() == _statement_cache_metrics(misses=11,
+            evictions=7)
+
+
+@override_generic_settings(global_settings(), {
+    'agent_limits.sql_statement_cache_entries': 0,
+})
+def test_sql_statement_cache_disabled():
+    sql = 'SELECT * FROM disabled'
+
+    assert sql_statement(sql, None) is not sql_statement(sql, None)
+
+
+@pytest.mark.parametrize('sql', (
+    'SELECT * FROM users WHERE id = %s AND name = %(name)s',
+    'SELECT * FROM users WHERE id = ? AND deleted IS NOT NULL',
+    'UPDATE users SET active = TRUE, nullable = :value WHERE id = :id',
+    "SELECT * FROM users WHERE id = %s AND name = 'literal'",
+    'SELECT * FROM users WHERE id = %s LIMIT 10 -- comment',
+    'SELECT * FROM abcdef-abcdef-abcdef-abcdef-abcdefabcdef',
+))
+@pytest.mark.parametrize('quoting_style', ('single', 'single+double',
+        'single+dollar', 'single+oracle'))
+def test_obfuscate_parameterized_sql(sql, quoting_style):
+    expected = SQLStatement(sql, DummyDB(quoting_style))
+
+    statement = SQLStatement(sql, DummyDB(quoting_style))
+    statement.parameterized = True
+
+    assert statement.obfuscated == expected.obfuscated
+    assert statement.normalized == expected.normalized
+
+
+class ExplainCursor(object):
+    description = (('plan',),)
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, *args, **kwargs):
+        self.connection.module.queries.append(query)
+
+    def fetchall(self):
+        return [('SCAN TABLE users',)]
+
+
+class ExplainConnection(object):
+    def __init__(self, module):
+        self.module = module
+
+    def cursor(self):
+        return ExplainCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.module.closed += 1
+
+
+class ExplainDBAPI2(object):
+    __name__ = 'explain_dbapi2'
+
+    NotSupportedError = NotImplementedError
+
+    def __init__(self):
+        self.queries = []
+        self.closed = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def connect(self, *args, **kwargs):
+        self.release.wait()
+        return ExplainConnection(self)
+
+
+def _explain_dbapi2():
+    module = ExplainDBAPI2()
+    register_database_client(module, 'Explain', explain_query='EXPLAIN',
+            explain_stmts=('select',))
+    return module
+
+
+def _request_args(sql, module):
+    return (sql_statement(sql, module), ((), {}), None, None, None)
+
+
+def _wait_for_results(worker, count):
+    results = {}
+    deadline = time.time() + 5.0
+
+    while len(results) < count and time.time() < deadline:
+        results.update(worker.collect())
+        time.sleep(0.01)
+
+    return results
+
+
+def test_explain_plan_worker():
+    module = _explain_dbapi2()
+    worker = ExplainPlanWorker(10, 30.0, 4)
+
+    args = _request_args('SELECT * FROM users WHERE id = 1', module)
+
+    assert worker.request(*args)
+
+    # A request for the same statement, differing only in its literals,
+    # is not repeated while the first is outstanding.
+
+    assert worker.request(*_request_args(
+            'SELECT * FROM users WHERE id = 2', module))
+
+    results = _wait_for_results(worker, 1)
+
+    assert list(results.values()) == [(['plan'], [('SCAN TABLE users',)])]
+    assert module.queries == ['EXPLAIN SELECT * FROM users WHERE id = 1']
+
+
+def test_explain_plan_results_do_not_wait():
+    module = _explain_dbapi2()
+    module.release.clear()
+
+    worker = ExplainPlanWorker(10, 30.0, 4)
+
+    args = _request_args('SELECT * FROM users', module)
+
+    # Until the worker completes the explain plan, none is returned and
+    # the harvest doesn't wait on the database, with the explain plan
+    # being available at the next harvest instead.
+
+    try:
+        results = ExplainPlanResults(worker)
+
+        assert explain_plan(results, *(args + ('raw',))) is None
+
+    finally:
+        module.release.set()
+
+    deadline = time.time() + 5.0
+
+    while worker._pending and time.time() < deadline:
+        time.sleep(0.01)
+
+    results = ExplainPlanResults(worker)
+
+    assert explain_plan(results, *(args + ('raw',))) == (['plan'],
+            [('SCAN TABLE users',)])
+
+
+def test_explain_plan_worker_queue_full():
+    module = _explain_dbapi2()
+    module.release.clear()
+
+    worker = ExplainPlanWorker(1, 30.0, 4)
+
+    try:
+        assert worker.request(*_request_args('SELECT * FROM a', module))
+
+        deadline = time.time() + 5.0
+
+        while len(worker) and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert worker.request(*_request_args('SELECT * FROM b', module))
+        assert not worker.request(*_request_args('SELECT * FROM c', module))
+
+    finally:
+        module.release.set()
+
+    assert worker.metrics() == [
+            ('Supportability/Python/DatabaseUtils/ExplainPlanWorker/Dropped',
+            1)]
+    assert worker.metrics() == []
+
+
+def test_explain_plan_worker_expired_requests():
+    module = _explain_dbapi2()
+    module.release.clear()
+
+    worker = ExplainPlanWorker(10, 0.1, 4)
+
+    try:
+        worker.request(*_request_args('SELECT * FROM a', module))
+
+        deadline = time.time() + 5.0
+
+        while len(worker) and time.time() < deadline:
+            time.sleep(0.01)
+
+        worker.request(*_request_args('SELECT * FROM b', module))
+
+        time.sleep(0.2)
+
+    finally:
+        module.release.set()
+
+    results = _wait_for_results(worker, 1)
+
+    assert len(results) == 1
+    assert module.queries == ['EXPLAIN SELECT * FROM a']
+
+    # The connection is closed once the worker has been idle for the
+    # timeout.
+
+    deadline = time.time() + 5.0
+
+    while not module.closed and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert module.closed == 1
+    assert worker.metrics() == [
+            ('Supportability/Python/DatabaseUtils/ExplainPlanWorker/Expired',
+            1)]
+
+
+def _explain_plan_cache_metrics(hits=0, misses=0, evictions=0):
+    counts = (('Hits', hits), ('Misses', misses), ('Evictions', evictions))
+
+    return [('Supportability/Python/DatabaseUtils/ExplainPlanCache/%s' %
+            name, count) for name, count in counts if count]
+
+
+def test_explain_plan_cache():
+    cache = ExplainPlanCache()
+
+    cache.put('a', (['plan'], [('a',)]), 2)
+    cache.put('b', (['plan'], [('b',)]), 2)
+
+    assert cache.get('a', 60.0) == (['plan'], [('a',)])
+    assert cache.contains('b', 60.0)
+
+    # Using the second explain plan makes the first the least recently
+    # used, so it is the one evicted.
+
+    cache.put('c', (['plan'], [('c',)]), 2)
+
+    assert len(cache) == 2
+    assert cache.get('a', 60.0) is None
+
+    # An explain plan older than the maximum age is discarded.
+
+    assert cache.get('b', -1.0) is None
+    assert not cache.contains('c', -1.0)
+    assert len(cache) == 0
+
+    assert cache.metrics() == _explain_plan_cache_metrics(hits=1, misses=2,
+            evictions=3)
+    assert cache.metrics() == []
+
+
+@pytest.mark.parametrize('entries,queries', ((100, 1), (0, 2)))
+def test_explain_plan_cached(entries, queries):
+    module = _explain_dbapi2()
+
+    args = _request_args('SELECT * FROM cached_%d WHERE id = 1' % entries,
+            module) + ('raw',)
+
+    @override_generic_settings(global_settings(), {
+        'agent_limits.explain_plan_cache_entries': entries,
+    })
+    def _test():
+        for _ in range(2):
+            with SQLConnections() as connections:
+                assert explain_plan(connections, *args) == (['plan'],
+                        [('SCAN TABLE users',)])
+
+    _test()
+
+    assert len(module.queries) == queries
@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import random
 import pytest
 import six
 import tempfile
+import threading
 import time
 
 from newrelic.common.object_wrapper import (transient_function_wrapper,
@@ -25,13 +27,17 @@ from testing_support.fixtures import (override_generic_settings,
         function_not_called, failing_endpoint)
 
 from newrelic.common.agent_http import DeveloperModeClient
+from newrelic.core.adaptive_sampler import ShardedAdaptiveSampler
+from newrelic.core.aggregator import AggregatorServer
 from newrelic.core.application import Application
+from newrelic.core.harvest_pipeline import HarvestSends
 from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
 from newrelic.core.transaction_node import TransactionNode
 from newrelic.core.root_node import RootNode
 from newrelic.core.custom_event import create_custom_event
 from newrelic.core.error_node import ErrorNode
 from newrelic.core.function_node import FunctionNode
+from newrelic.core.datastore_node import DatastoreNode
 
 from newrelic.network.exceptions import RetryDataForRequest, ForceAgentDisconnect
 
@@ -149,6 +155,7 @@ def transaction_node(request):
             root_span_guid=None,
             trace_id='4485b89db608aece',
             loop_time=0.0,
+            streamed_metrics=None,
     )
     return node
 
@@ -450,6 +457,351 @@ def test_transaction_count(transaction_node):
     assert app._transaction_count == 0
 
 
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'stats_engine.sharded': True,
+})
+def test_sharded_stats_engine(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    num_threads = 4
+
+    threads = [threading.Thread(target=app.record_transaction,
+            args=(transaction_node,)) for _ in range(num_threads)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Nothing is merged into the application until harvest time
+    assert len(app._stats_shards) == num_threads
+    assert app._transaction_count == 0
+    assert app._stats_engine.transaction_events.num_seen == 0
+
+    with app._stats_lock:
+        app._merge_stats_shards()
+
+    assert app._transaction_count == num_threads
+    assert app._last_transaction == transaction_node.end_time
+
+    transaction_events = app._stats_engine.transaction_events
+    assert transaction_events.num_seen == num_threads
+    assert transaction_events.num_samples == num_threads
+
+    custom_events = app._stats_engine.custom_events
+    num_custom_events = transaction_node.custom_events.num_seen
+    assert custom_events.num_seen == num_threads * num_custom_events
+
+    stats = app._stats_engine.stats_table[('OtherTransaction/all', '')]
+    assert stats.call_count == num_threads
+
+    # Shards for threads which have exited are discarded
+    assert not app._stats_shards
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'stats_engine.sharded': True,
+})
+def test_sharded_stats_engine_event_intrinsics(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    datastore = DatastoreNode(
+            product='Postgres',
+            target='users',
+            operation='select',
+            children=(),
+            start_time=1524764430.0,
+            end_time=1524764430.05,
+            duration=0.05,
+            exclusive=0.05,
+            host=None,
+            port_path_or_id=None,
+            database_name=None,
+            guid=None,
+            agent_attributes={},
+            user_attributes={})
+
+    root = transaction_node.root._replace(children=(datastore,))
+
+    # Each transaction recorded into the shard of the thread has event
+    # intrinsics for that transaction alone.
+
+    for _ in range(2):
+        app.record_transaction(transaction_node._replace(root=root,
+                errors=(), custom_events=SampledDataSet()))
+
+    with app._stats_lock:
+        app._merge_stats_shards()
+
+    transaction_events = list(app._stats_engine.transaction_events.samples)
+    assert len(transaction_events) == 2
+
+    for intrinsics, _, _ in transaction_events:
+        assert intrinsics['databaseCallCount'] == 1
+        assert intrinsics['databaseDuration'] == 0.05
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'stats_engine.sharded': True,
+})
+def test_sharded_stats_engine_harvest(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    app.record_transaction(transaction_node)
+    app.record_transaction(transaction_node)
+
+    # The shard of the current thread is retained across harvests
+    shard = app._stats_shard()
+    assert shard.transaction_count == 2
+
+    @validate_metric_payload(metrics=[('OtherTransaction/all', 2)],
+            endpoints_called=[])
+    def _harvest():
+        app.harvest()
+
+    _harvest()
+
+    assert app._stats_shards == [shard]
+    assert shard.transaction_count == 0
+    assert shard.stats_engine.transaction_events.num_seen == 0
+    assert app._transaction_count == 0
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'stats_engine.sharded': True,
+})
+def test_sharded_stats_engine_idle_shard(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    app.record_transaction(transaction_node)
+
+    shard = app._stats_shard()
+
+    with app._stats_lock:
+        app._merge_stats_shards()
+
+    assert app._stats_shards == [shard]
+
+    # A shard which records nothing for a harvest period is discarded
+    # even though the thread which owns it is still alive, as is always
+    # the case for the dummy thread of a greenlet.
+
+    with app._stats_lock:
+        app._merge_stats_shards()
+
+    assert shard.retired
+    assert not app._stats_shards
+
+    # A new shard is registered when the thread next records data.
+
+    app.record_transaction(transaction_node)
+
+    assert len(app._stats_shards) == 1
+    assert app._stats_shards[0] is not shard
+    assert shard.transaction_count == 0
+
+    with app._stats_lock:
+        app._merge_stats_shards()
+
+    assert app._transaction_count == 2
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'harvest_pipeline.enabled': True,
+})
+def test_harvest_pipeline(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    app.record_transaction(transaction_node)
+
+    endpoints_called = []
+
+    @validate_metric_payload(metrics=[('OtherTransaction/all', 1)],
+            endpoints_called=endpoints_called)
+    def _harvest():
+        app.harvest(flexible=True)
+        app.harvest(flexible=False)
+
+        # The harvest only snapshots the data, sending it is left to the
+        # sender thread of the pipeline.
+        assert app._harvest_pipeline.drain(timeout=10.0)
+
+    _harvest()
+
+    assert 'analytic_event_data' in endpoints_called
+    assert 'metric_data' in endpoints_called
+
+    # The final harvest on shutdown is sent immediately. It includes
+    # the supportability metrics from queueing the previous default
+    # harvest, those from the flexible harvest having been sent with it.
+    del endpoints_called[:]
+
+    @validate_metric_payload(metrics=[
+            ('Supportability/Python/Harvest/Pipeline/Queued', 1)],
+            endpoints_called=endpoints_called)
+    def _harvest_shutdown():
+        app.harvest(shutdown=True)
+
+    _harvest_shutdown()
+
+    assert 'metric_data' in endpoints_called
+    assert not app._harvest_pipeline.active
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'harvest_pipeline.enabled': True,
+    'harvest_pipeline.queue_size': 1,
+})
+def test_harvest_pipeline_full(transaction_node, monkeypatch):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    sent = []
+    blocked = threading.Event()
+
+    def _send_harvest_job(job, queue_time):
+        blocked.wait(10.0)
+        sent.append(job)
+
+    monkeypatch.setattr(app, '_send_harvest_job', _send_harvest_job)
+
+    # The first snapshot is taken off the queue by the sender thread
+    # which then blocks, the second snapshot is queued.
+    app.harvest(flexible=True)
+
+    timeout = time.time() + 10.0
+    while len(app._harvest_pipeline) and time.time() < timeout:
+        time.sleep(0.01)
+
+    app.harvest(flexible=True)
+    assert len(app._harvest_pipeline) == 1
+
+    # With the queue full, the snapshot is rolled back into the stats
+    # engine rather than the harvest thread being blocked.
+    app.record_transaction(transaction_node)
+    app.harvest(flexible=True)
+
+    assert app._stats_engine.transaction_events.num_seen == 1
+
+    full_metric = app._stats_engine.stats_table[
+            ('Supportability/Python/Harvest/Pipeline/Full', '')]
+    assert full_metric.call_count == 1
+
+    blocked.set()
+    assert app._harvest_pipeline.drain(timeout=10.0)
+    assert len(sent) == 2
+
+
+@failing_endpoint('metric_data', raises=ForceAgentDisconnect)
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'harvest_pipeline.enabled': True,
+})
+def test_harvest_pipeline_deferred_shutdown():
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    session = app._active_session
+
+    app.harvest()
+    assert app._harvest_pipeline.drain(timeout=10.0)
+
+    # The disconnect from the sender thread is left for the harvest
+    # thread, so the session remains active until the next harvest.
+    assert app._active_session is session
+    assert app._deferred_shutdown == (session, False)
+
+    app.harvest()
+
+    assert app._active_session is None
+    assert app._agent_shutdown
+
+
+@failing_endpoint('analytic_event_data')
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'agent_limits.max_concurrent_sends': 4,
+})
+def test_concurrent_sends_rollback(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    app.record_transaction(transaction_node)
+
+    endpoints_called = []
+
+    @validate_metric_payload(endpoints_called=endpoints_called)
+    def _harvest():
+        app.harvest()
+
+    _harvest()
+
+    # All endpoints are sent to even though one of them failed, but only
+    # the data for the failed endpoint is rolled back. The metric data is
+    # not sent when any of the other endpoints fail.
+    assert 'analytic_event_data' in endpoints_called
+    assert 'custom_event_data' in endpoints_called
+    assert 'error_event_data' in endpoints_called
+    assert 'metric_data' not in endpoints_called
+
+    assert app._stats_engine.transaction_events.num_seen == 1
+    assert app._stats_engine.custom_events.num_seen == 0
+    assert app._stats_engine.error_events.num_seen == 0
+
+
+@pytest.mark.parametrize('concurrency', (1, 4))
+def test_harvest_sends_exception_precedence(concurrency):
+    sent = []
+
+    def _send(name, exc=None):
+        def send():
+            sent.append(name)
+            if exc is not None:
+                raise exc()
+        return send
+
+    sends = HarvestSends(concurrency)
+
+    with pytest.raises(ForceAgentDisconnect):
+        sends.add(_send('a'))
+        sends.add(_send('b', ForceAgentDisconnect))
+        sends.add(_send('c', RetryDataForRequest))
+        sends.wait()
+
+    if concurrency == 1:
+        # Serial sends stop at the first failure.
+        assert sent == ['a', 'b']
+    else:
+        assert sorted(sent) == ['a', 'b', 'c']
+
+
 @override_generic_settings(settings, {
     'developer_mode': True,
     'license_key': '**NOT A LICENSE KEY**',
@@ -624,6 +976,23 @@ def test_compute_sampled_no_reset():
     assert app.compute_sampled() is True
 
 
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'adaptive_sampler.sharded': True,
+})
+def test_compute_sampled_sharded():
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    assert type(app.adaptive_sampler) is ShardedAdaptiveSampler
+
+    # First harvest, first N should be sampled
+    for _ in range(settings.sampling_target):
+        assert app.compute_sampled() is True
+
+    assert app.compute_sampled() is False
+
+
 def test_analytic_event_sampling_info():
 
     synthetics_limit = 10
@@ -900,3 +1269,94 @@ def test_get_agent_commands_raises():
     app.connect_to_data_collector(None)
     with pytest.raises(RetryDataForRequest):
         app.process_agent_commands()
+
+
+AGGREGATOR_SOCKET_PATH = os.path.join(tempfile.gettempdir(),
+        'newrelic-test-aggregator-%d.sock' % os.getpid())
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'aggregator.enabled': True,
+    'aggregator.socket_path': AGGREGATOR_SOCKET_PATH,
+})
+def test_harvest_aggregator(transaction_node, monkeypatch):
+    aggregator = Application('Python Agent Test (Harvest Loop)')
+    aggregator.connect_to_data_collector(None)
+
+    server = AggregatorServer(AGGREGATOR_SOCKET_PATH,
+            lambda app_name, message: aggregator.merge_forwarded_harvest(
+            message))
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    sent = []
+    monkeypatch.setattr(app, '_send_harvest',
+            lambda job, internal_metrics: sent.append(job))
+
+    app.record_transaction(transaction_node)
+
+    # While the aggregator is not running the worker reports the data
+    # itself, rather than it being lost.
+    app.harvest()
+
+    assert len(sent) == 1
+
+    server.start()
+
+    try:
+        app.record_transaction(transaction_node)
+        app.harvest()
+
+    finally:
+        server.stop()
+
+    assert len(sent) == 1
+
+    metric_data = dict((key['name'], value) for key, value in
+            aggregator._stats_engine.metric_data() if not key['scope'])
+
+    assert metric_data['OtherTransaction/all'][0] == 1
+    assert metric_data[
+            'Supportability/Python/Aggregator/Unavailable'][0] == 1
+    assert aggregator._transaction_count == 1
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'aggregator.enabled': True,
+    'aggregator.socket_path': AGGREGATOR_SOCKET_PATH,
+})
+def test_harvest_aggregator_not_connected(transaction_node, monkeypatch):
+    # The aggregator has not yet connected to the data collector.
+    aggregator = Application('Python Agent Test (Harvest Loop)')
+
+    server = AggregatorServer(AGGREGATOR_SOCKET_PATH,
+            lambda app_name, message: aggregator.merge_forwarded_harvest(
+            message))
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    sent = []
+    monkeypatch.setattr(app, '_send_harvest',
+            lambda job, internal_metrics: sent.append(job))
+
+    server.start()
+
+    try:
+        app.record_transaction(transaction_node)
+        app.harvest()
+
+    finally:
+        server.stop()
+
+    # The snapshot is rejected by the aggregator, so the worker reports
+    # the data itself rather than it being lost.
+    assert len(sent) == 1
+    assert sent[0].stats.transaction_events.num_seen == 1
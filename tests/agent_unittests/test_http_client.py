@@ -28,7 +28,11 @@ from newrelic.common.agent_http import (
     InsecureHttpClient,
     ServerlessModeClient,
 )
-from newrelic.common.encoding_utils import ensure_str
+from newrelic.common.encoding_utils import (
+    ensure_str,
+    json_encode,
+    json_encode_chunks,
+)
 from newrelic.common.object_names import callable_name
 from newrelic.core.internal_metrics import InternalTraceContext
 from newrelic.core.stats_engine import CustomMetrics
@@ -336,6 +340,80 @@ def test_http_payload_compression(server, client_cls, method, threshold):
     assert sent_payload == payload
 
 
+@pytest.mark.parametrize(
+    "payload",
+    (
+        [],
+        ("run_id", {"events_seen": 2}, [[{"a": 1}, {}, {}], [{"b": u"\xe9"}, {}, {}]]),
+        ("run_id", 0.0, 1.0, [[{"name": "a"}, [1, 2.0]]]),
+    ),
+)
+@pytest.mark.parametrize("chunk_size", (1, 64 * 1024))
+def test_json_encode_chunks(payload, chunk_size):
+    expected = json_encode(payload).encode("utf-8")
+
+    chunks = list(json_encode_chunks(payload, chunk_size=chunk_size))
+
+    assert b"".join(chunks) == expected
+    if chunk_size == 1:
+        assert len(chunks) > 1 or len(expected) <= 2
+
+    # Generators are streamed in the same way as lists.
+    generator = (item for item in payload)
+    assert b"".join(json_encode_chunks(generator, chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize("threshold", (0, 100))
+def test_http_streamed_payload_compression(server, threshold):
+    payload = ("run_id", {"events_seen": 20}, [[{"name": "*"}, {}, {}]] * 20)
+    expected = json_encode(payload).encode("utf-8")
+
+    internal_metrics = CustomMetrics()
+
+    with ApplicationModeClient(
+        "localhost",
+        server.port,
+        disable_certificate_validation=True,
+        compression_threshold=threshold,
+    ) as client:
+        with InternalTraceContext(internal_metrics):
+            status, data = client.send_request(
+                payload=json_encode_chunks(payload, chunk_size=16),
+                params={"method": "test"},
+            )
+
+    assert status == 200
+    sent_payload = data.split(b"\n")[-1]
+
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(sent_payload) + decompressor.flush() == expected
+
+    internal_metrics = dict(internal_metrics.metrics())
+    assert internal_metrics["Supportability/Python/Collector/ZLIB/Bytes/test"][
+        :2
+    ] == [1, len(expected)]
+    assert internal_metrics["Supportability/Python/Collector/Output/Bytes/test"][
+        :2
+    ] == [1, len(sent_payload)]
+
+
+def test_http_streamed_payload_below_threshold(server):
+    payload = [1, [2, 3]]
+
+    with HttpClient(
+        "localhost", server.port, disable_certificate_validation=True
+    ) as client:
+        status, data = client.send_request(
+            payload=json_encode_chunks(payload, chunk_size=1),
+            params={"method": "test"},
+        )
+
+    assert status == 200
+    data = data.split(b"\n")
+    assert data[-1] == b"[1,[2,3]]"
+    assert b"content-encoding: Identity" in data
+
+
 def test_cert_path(server):
     with HttpClient("localhost", server.port, ca_bundle_path=SERVER_CERT) as client:
         status, data = client.send_request()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+import struct
+
+import pytest
+
+from newrelic.core.metric import ApdexMetric, TimeMetric
+from newrelic.core.snapshot_format import (FORMAT_MAGIC, FORMAT_VERSION,
+        SnapshotFormatError, decode_snapshot, encode_snapshot)
+from newrelic.core.stats_engine import CountStats
+
+from testing_support.fixtures import create_stats_engine
+
+
+def _populated_stats_engine(num_metrics=3):
+    stats = create_stats_engine()
+
+    for index in range(num_metrics):
+        stats.record_time_metric(TimeMetric(name=u'Function/ü/%d' % index,
+                scope='WebTransaction/Function/view', duration=0.5,
+                exclusive=0.25))
+
+    stats.record_apdex_metric(ApdexMetric(name='Apdex', satisfying=1,
+            tolerating=2, frustrating=0, apdex_t=0.5))
+    stats.stats_table.merge_stats(('Custom/count', ''),
+            CountStats(call_count=3))
+
+    stats.transaction_events.add([{'type': 'Transaction'}, {}, {}], 1.5)
+    stats.transaction_events.add([{'type': 'Transaction'}, {}, {}], 0.5)
+    stats.span_events.add([{'type': 'Span'}, {}, {}], 0.75)
+    stats.synthetics_events.add([{'type': 'Transaction'}, {}, {}])
+
+    return stats
+
+
+def _round_trip(data):
+    return decode_snapshot(encode_snapshot(data))
+
+
+def test_round_trip_metrics():
+    data = _populated_stats_engine().forwarded_data()
+
+    result = _round_trip(data)
+
+    assert sorted(result['metrics']) == sorted(
+            (tuple(key), kind, stats) for key, kind, stats in data['metrics'])
+
+    counts = dict((key[0], stats[0]) for key, kind, stats in
+            result['metrics'])
+
+    assert type(counts['Apdex']) is int
+    assert type(counts['Custom/count']) is int
+
+
+def test_round_trip_events():
+    data = _populated_stats_engine().forwarded_data()
+
+    result = _round_trip(data)
+
+    for name in ('transaction_events', 'span_events', 'error_events',
+            'custom_events'):
+        capacity, num_seen, pq = data[name]
+        assert result[name][:2] == (capacity, num_seen)
+        assert sorted((entry[0], entry[-1]) for entry in result[name][2]) == \
+                sorted((entry[0], entry[-1]) for entry in pq)
+
+    assert result['synthetics_events'] == (data['synthetics_events'][0],
+            data['synthetics_events'][1],
+            [list(sample) for sample in data['synthetics_events'][2]])
+
+
+def test_round_trip_absent_reservoirs():
+    data = _populated_stats_engine().harvest_snapshot(
+            flexible=True).forwarded_data()
+
+    result = _round_trip(data)
+
+    for name in ('transaction_events', 'span_events', 'error_events',
+            'custom_events', 'synthetics_events'):
+        assert result.get(name) == data[name]
+
+
+def test_round_trip_rendered_data():
+    data = {
+        'metrics': [],
+        'errors': [[0.0, 'WebTransaction/Function/view', 'oops',
+                'builtins:ValueError', {'userAttributes': {}}]],
+        'slow_sql': [['path', '/view', 1, 'SELECT 1', 'Datastore/all',
+                1, 1.0, 1.0, 1.0, 'params']],
+        'transaction_traces': [[0.0, 1.0, 'path', None, 'data', 'guid',
+                None, False, None, None]],
+    }
+
+    result = _round_trip(data)
+
+    assert result['errors'] == data['errors']
+    assert result['slow_sql'] == data['slow_sql']
+    assert result['transaction_traces'] == data['transaction_traces']
+
+
+def test_round_trip_merge():
+    worker = _populated_stats_engine()
+
+    expected = create_stats_engine()
+    expected.merge_forwarded_data(worker.forwarded_data())
+
+    aggregator = create_stats_engine()
+    aggregator.merge_forwarded_data(_round_trip(worker.forwarded_data()))
+
+    assert list(aggregator.metric_data()) == list(expected.metric_data())
+    assert (aggregator.transaction_events.num_seen ==
+            expected.transaction_events.num_seen)
+    assert (sorted(aggregator.transaction_events.samples) ==
+            sorted(expected.transaction_events.samples))
+
+
+def test_smaller_than_pickle():
+    data = _populated_stats_engine(num_metrics=500).forwarded_data()
+
+    assert len(encode_snapshot(data)) < len(pickle.dumps(data, 2))
+
+
+def test_unsupported_version():
+    encoded = encode_snapshot({'metrics': []})
+    encoded = struct.pack('!4sB', FORMAT_MAGIC, FORMAT_VERSION + 1) + \
+            encoded[5:]
+
+    with pytest.raises(SnapshotFormatError):
+        decode_snapshot(encoded)
+
+
+def test_invalid_magic():
+    with pytest.raises(SnapshotFormatError):
+        decode_snapshot(b'XXXX' + encode_snapshot({'metrics': []})[4:])
+
+
+def test_truncated():
+    encoded = encode_snapshot(_populated_stats_engine().forwarded_data())
+
+    with pytest.raises(SnapshotFormatError):
+        decode_snapshot(encoded[:-1])
+
+
+def test_unknown_section_skipped():
+    encoded = encode_snapshot({'metrics': [(('Custom/a', ''), 0,
+            [1, 1.0, 1.0, 1.0, 1.0, 1.0])]})
+
+    encoded += struct.pack('!BI', 255, 3) + b'abc'
+
+    assert decode_snapshot(encoded)['metrics'] == [(('Custom/a', ''), 0,
+            [1, 1.0, 1.0, 1.0, 1.0, 1.0])]
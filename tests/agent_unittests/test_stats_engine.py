@@ -0,0 +1,373 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import random
+
+from newrelic.core.internal_metrics import InternalTraceContext
+from newrelic.core.metric import ApdexMetric, TimeMetric, TimeMetricBatch
+from newrelic.core.stats_engine import (StatsTable, CompactStatsTable,
+        CountStats, CustomMetrics, TimeStats, SampledDataSet, DeferredEvent,
+        _event_stats)
+
+from testing_support.fixtures import create_stats_engine
+
+
+def _record_metrics(table):
+    table.merge_time_metric(('Function/a', ''), TimeMetric(
+            name='Function/a', scope='', duration=2.0, exclusive=1.0))
+    table.merge_time_metric(('Function/a', ''), TimeMetric(
+            name='Function/a', scope='', duration=1.0, exclusive=None))
+    table.merge_time_metric(('Function/a', 'WebTransaction/x'), TimeMetric(
+            name='Function/a', scope='WebTransaction/x', duration=3.0,
+            exclusive=0.5))
+    table.merge_time_metric(('Function/b', ''), TimeMetric(
+            name='Function/b', scope='', duration=0.0, exclusive=0.0))
+
+    table.merge_apdex_metric(('Apdex', ''), ApdexMetric(name='Apdex',
+            satisfying=1, tolerating=0, frustrating=0, apdex_t=0.5))
+    table.merge_apdex_metric(('Apdex', ''), ApdexMetric(name='Apdex',
+            satisfying=0, tolerating=1, frustrating=0, apdex_t=0.25))
+
+    table.merge_stats(('Custom/count', ''), CountStats(call_count=3))
+    table.merge_stats(('Custom/count', ''), CountStats(call_count=4))
+    table.merge_stats(('Custom/value', ''), TimeStats(1, 5, 5, 5, 5, 25))
+    table.merge_stats(('Custom/value', ''), TimeStats(1, 2, 2, 2, 2, 4))
+
+
+def _as_dict(table):
+    return dict((key, list(value)) for key, value in table.items())
+
+
+def test_compact_stats_table_matches_stats_table():
+    expected = StatsTable()
+    compact = CompactStatsTable()
+
+    _record_metrics(expected)
+    _record_metrics(compact)
+
+    assert len(compact) == len(expected)
+    assert _as_dict(compact) == _as_dict(expected)
+
+    assert ('Function/a', '') in compact
+    assert compact[('Function/a', '')].call_count == 2
+    assert compact[('Function/a', '')].total_exclusive_call_time == 2.0
+    assert compact.get(('Missing', '')) is None
+
+    assert type(compact[('Custom/count', '')]) is CountStats
+    assert type(compact[('Custom/value', '')]) is TimeStats
+
+
+@pytest.mark.parametrize('other_type', (StatsTable, CompactStatsTable))
+@pytest.mark.parametrize('empty', (True, False))
+def test_compact_stats_table_merge_table(other_type, empty):
+    expected = StatsTable()
+    compact = CompactStatsTable()
+
+    if not empty:
+        _record_metrics(expected)
+        _record_metrics(compact)
+
+    other = other_type()
+    _record_metrics(other)
+
+    # Merge from a separately populated table to avoid the default
+    # table adopting stats objects owned by the other table.
+
+    other_copy = StatsTable()
+    _record_metrics(other_copy)
+
+    expected.merge_table(other_copy)
+    compact.merge_table(other)
+
+    assert _as_dict(compact) == _as_dict(expected)
+
+
+def test_compact_stats_table_normalize():
+    def normalizer(name):
+        return name.replace('Function/b', 'Function/a'), False
+
+    expected = StatsTable()
+    compact = CompactStatsTable()
+
+    _record_metrics(expected)
+    _record_metrics(compact)
+
+    normalized = compact.normalize(normalizer)
+
+    assert isinstance(normalized, CompactStatsTable)
+    assert ('Function/b', '') not in normalized
+    assert _as_dict(normalized) == _as_dict(expected.normalize(normalizer))
+
+
+@pytest.mark.parametrize('compact_metrics', (True, False))
+def test_stats_engine_metric_table(compact_metrics):
+    stats = create_stats_engine({
+        'stats_engine.compact_metrics': compact_metrics})
+
+    table_type = compact_metrics and CompactStatsTable or StatsTable
+    assert type(stats.stats_table) is table_type
+
+    workarea = stats.create_workarea()
+    workarea.record_time_metric(TimeMetric(name='Function/a', scope='',
+            duration=1.0, exclusive=None))
+    workarea.record_custom_metric('Custom/a', 2)
+    stats.merge(workarea)
+    stats.merge(workarea)
+
+    assert stats.metrics_count() == 2
+
+    metric_data = dict(((key['name'], key['scope']), value)
+            for key, value in stats.metric_data())
+    assert metric_data[('Function/a', '')] == [2, 2.0, 2.0, 1.0, 1.0, 2.0]
+    assert metric_data[('Custom/a', '')] == [2, 4, 4, 2, 2, 8]
+
+    snapshot = stats.harvest_snapshot()
+
+    assert snapshot.metrics_count() == 2
+    assert stats.metrics_count() == 0
+    assert type(stats.stats_table) is table_type
+
+
+_TIME_METRICS = [
+    TimeMetric(name='Datastore/statement/Postgres/users/select', scope='',
+            duration=0.25, exclusive=0.25),
+    TimeMetric(name='Datastore/statement/Postgres/users/select', scope='',
+            duration=0.5, exclusive=0.25),
+    TimeMetric(name='Datastore/statement/Postgres/users/select',
+            scope='WebTransaction/Function/view', duration=0.5,
+            exclusive=None),
+    TimeMetric(name='Datastore/all', scope=None, duration=0.75,
+            exclusive=None),
+    TimeMetric(name='Datastore/statement/Postgres/users/select', scope='',
+            duration=0.125, exclusive=0.0),
+]
+
+
+def test_time_metric_batch_aggregates():
+    batch = TimeMetricBatch()
+    batch.extend(_TIME_METRICS)
+
+    assert len(batch) == 3
+
+    stats = dict(batch.stats())
+
+    assert stats[('Datastore/statement/Postgres/users/select', '')] == (
+            3, 0.875, 0.5, 0.125, 0.5, 0.328125)
+    assert stats[('Datastore/all', '')] == (1, 0.75, 0.75, 0.75, 0.75,
+            0.5625)
+
+
+@pytest.mark.parametrize('table_type', (StatsTable, CompactStatsTable))
+def test_merge_time_metric_batch(table_type):
+    expected = table_type()
+    table = table_type()
+
+    for _ in range(2):
+        for metric in _TIME_METRICS:
+            expected.merge_time_metric((metric.name, metric.scope or ''),
+                    metric)
+
+        batch = TimeMetricBatch()
+        batch.extend(_TIME_METRICS)
+        table.merge_time_metric_batch(batch)
+
+    assert _as_dict(table) == _as_dict(expected)
+
+
+def _sequential_data_set(capacity, samples, priorities):
+    data_set = SampledDataSet(capacity)
+    for sample, priority in zip(samples, priorities):
+        data_set.add(sample, priority)
+    return data_set
+
+
+@pytest.mark.parametrize('capacity', (0, 1, 10, 100))
+@pytest.mark.parametrize('num_initial', (0, 5, 50))
+def test_sampled_data_set_add_many(capacity, num_initial):
+    samples = list(range(200))
+
+    priorities = [random.random() for _ in samples]
+
+    expected = _sequential_data_set(capacity, samples, priorities)
+
+    data_set = _sequential_data_set(capacity, samples[:num_initial],
+            priorities[:num_initial])
+    data_set.add_many(samples[num_initial:], priorities[num_initial:])
+
+    assert data_set.num_seen == expected.num_seen == len(samples)
+    assert data_set.num_samples == expected.num_samples
+    assert sorted(data_set.samples) == sorted(expected.samples)
+
+    if data_set.num_samples:
+        minimum = min(entry[0] for entry in data_set.pq)
+        assert data_set.pq[0][0] == minimum
+
+
+def test_sampled_data_set_minimum_priority_published():
+    class DataSet(SampledDataSet):
+        @property
+        def pq(self):
+            return self._pq
+
+        @pq.setter
+        def pq(self, pq):
+            # The minimum priority must be correct for any thread reading
+            # it as soon as the samples are replaced.
+            if getattr(self, 'heap', False) and pq:
+                assert pq[0][0] == min(entry[0] for entry in pq)
+            self._pq = pq
+
+    data_set = DataSet(10)
+    data_set.add_many(range(10), [i / 10.0 for i in range(10)])
+
+    assert data_set.minimum_priority == 0.0
+
+    data_set.add_many(range(10, 15), [1.0 - i / 10.0 for i in range(5)])
+
+    assert data_set.minimum_priority == 0.5
+
+
+@pytest.mark.parametrize('capacity', (0, 10, 1000))
+def test_sampled_data_set_merge(capacity):
+    other = SampledDataSet(10)
+    other.add_many(range(30), [i / 30.0 for i in range(30)])
+
+    data_set = SampledDataSet(capacity)
+    data_set.add_many(range(100, 105), [1.0] * 5)
+    data_set.merge(other)
+
+    assert data_set.num_seen == 35
+    assert data_set.num_samples == min(capacity, 15)
+
+    if capacity == 10:
+        assert sorted(data_set.samples) == (list(range(25, 30)) +
+                list(range(100, 105)))
+
+    assert data_set.sampling_info == {
+        'reservoir_size': capacity,
+        'events_seen': 35,
+    }
+
+
+def test_deferred_events_created_when_harvested():
+    created = []
+
+    def _event(index):
+        created.append(index)
+        return [{'index': index}, {}, {}]
+
+    data_set = SampledDataSet(2)
+
+    for index in range(4):
+        data_set.add(DeferredEvent(_event, index), priority=index)
+
+    # Events evicted from the reservoir are never created.
+
+    assert created == []
+
+    assert sorted(event[0]['index'] for event in data_set.samples) == [2, 3]
+    assert sorted(event[0]['index'] for event in data_set) == [2, 3]
+
+    assert sorted(created) == [2, 3]
+
+
+def test_event_stats_from_batch():
+    batch = TimeMetricBatch()
+    batch.extend(_TIME_METRICS)
+
+    assert batch.get('Datastore/all') == (1, 0.75, 0.75, 0.75, 0.75,
+            0.5625)
+    assert batch.get('External/all') is None
+
+    stats = _event_stats(batch)
+
+    assert list(stats) == [('Datastore/all', '')]
+    assert stats[('Datastore/all', '')].total_call_time == 0.75
+    assert stats[('Datastore/all', '')].call_count == 1
+
+
+class _SpanEventsTransaction(object):
+
+    def __init__(self, priority, num_spans):
+        self.priority = priority
+        self.num_spans = num_spans
+        self.created = 0
+
+    def span_event_count(self):
+        return self.num_spans
+
+    def span_events(self, settings):
+        for index in range(self.num_spans):
+            self.created += 1
+            yield [{'guid': index}, {}, {}]
+
+
+def _span_events_stats_engine(capacity):
+    return create_stats_engine({
+        'event_harvest_config.harvest_limits.span_event_data': capacity})
+
+
+@pytest.mark.parametrize('threshold', (False, True))
+def test_span_events_skipped_below_minimum_priority(threshold):
+    stats = _span_events_stats_engine(2)
+    full = _span_events_stats_engine(2)
+
+    full.span_events.add_many([[{}, {}, {}]] * 2, [1.0, 1.0])
+
+    # Where the reservoir the span events will be merged into is full,
+    # its minimum priority is passed as the threshold.
+
+    if threshold:
+        minimum = full.span_events.minimum_priority
+    else:
+        stats = full
+        minimum = None
+
+    metrics = CustomMetrics()
+
+    with InternalTraceContext(metrics):
+        transaction = _SpanEventsTransaction(1.0, 3)
+        stats._record_span_events(transaction, minimum)
+
+    assert transaction.created == 0
+    assert stats.span_events.num_seen == (3 if threshold else 5)
+
+    assert dict(metrics.metrics())[
+            'Supportability/Python/SpanEvent/Skipped/Priority'][0] == 3
+
+
+def test_span_events_skipped_over_capacity():
+    stats = _span_events_stats_engine(2)
+
+    metrics = CustomMetrics()
+
+    with InternalTraceContext(metrics):
+        transaction = _SpanEventsTransaction(0.5, 5)
+        stats._record_span_events(transaction)
+
+    assert transaction.created == 2
+    assert stats.span_events.num_seen == 5
+    assert [event[0]['guid'] for event in stats.span_events.samples] == [0, 1]
+
+    assert dict(metrics.metrics())[
+            'Supportability/Python/SpanEvent/Skipped/Capacity'][0] == 3
+
+    # A transaction with a higher priority still has span events created.
+
+    transaction = _SpanEventsTransaction(1.0, 1)
+    stats._record_span_events(transaction)
+
+    assert transaction.created == 1
+    assert stats.span_events.num_seen == 6
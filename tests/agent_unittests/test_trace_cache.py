@@ -0,0 +1,110 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.core.trace_cache import TraceCache, current_task, task_lookup
+
+try:
+    import thread
+except ImportError:
+    import _thread as thread
+
+asyncio = pytest.importorskip('asyncio')
+
+
+def _trace_cache():
+    cache = TraceCache()
+    cache.asyncio = asyncio
+    cache.greenlet = False
+
+    return cache
+
+
+def test_thread_id_outside_event_loop():
+    cache = _trace_cache()
+
+    assert cache.current_thread_id() == thread.get_ident()
+
+    result = []
+
+    def _run():
+        result.append(cache.current_thread_id() == thread.get_ident())
+
+    worker = threading.Thread(target=_run)
+    worker.start()
+    worker.join()
+
+    assert result == [True]
+
+
+def test_task_id_in_event_loop():
+    cache = _trace_cache()
+
+    @asyncio.coroutine
+    def _task_id():
+        return cache.current_thread_id(), id(current_task(asyncio))
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        thread_id, task_id = loop.run_until_complete(_task_id())
+    finally:
+        loop.close()
+
+    assert thread_id == task_id
+
+    # Once the loop is no longer running, the thread ID is used again.
+
+    assert cache.current_thread_id() == thread.get_ident()
+
+
+def test_task_lookup_fallback():
+    class Module(object):
+        class Task(object):
+            @staticmethod
+            def current_task():
+                return 'task'
+
+    assert task_lookup(Module)() == 'task'
+
+
+def test_thread_id_lookup_outside_event_loop():
+    calls = []
+
+    class Module(object):
+        @staticmethod
+        def _get_running_loop():
+            return None
+
+        @staticmethod
+        def current_task(loop=None):
+            calls.append(loop)
+            raise RuntimeError('no running event loop')
+
+    cache = TraceCache()
+    cache.asyncio = Module
+    cache.greenlet = False
+
+    # Each lookup is done on entering and exiting a trace. Outside of an
+    # event loop, checking for the running loop avoids the exception
+    # raised when asking for the current task.
+
+    assert cache.current_thread_id() == thread.get_ident()
+    assert cache.current_thread_id() == thread.get_ident()
+
+    assert calls == []
+
@@ -0,0 +1,118 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.memcache_trace import MemcacheTrace
+from newrelic.api.message_trace import MessageTrace
+from newrelic.api.solr_trace import SolrTrace
+from newrelic.core.config import global_settings
+from newrelic.core.node_mixin import EMPTY_ATTRIBUTES, EMPTY_CHILDREN
+
+# The default limit on the number of segments for a transaction trace.
+
+NUM_SEGMENTS = 2000
+
+
+def _function_traces(count):
+    return [FunctionTrace('view_%d' % (index % 10)) for index in range(count)]
+
+
+def _function_nodes(count):
+    nodes = []
+
+    for index in range(count):
+        trace = FunctionTrace('view_%d' % (index % 10))
+        trace.start_time = index
+        trace.end_time = trace.duration = trace.exclusive = 0.001
+        nodes.append(trace.create_node())
+
+    return nodes
+
+
+@pytest.mark.parametrize('trace', (
+    FunctionTrace('view'),
+    MemcacheTrace('get'),
+    MessageTrace('library', 'Produce', 'Queue', 'name'),
+    SolrTrace('library', 'query'),
+))
+def test_leaf_node_shares_empty_containers(trace):
+    node = trace.create_node()
+
+    assert node.children is EMPTY_CHILDREN
+    assert node.agent_attributes is EMPTY_ATTRIBUTES
+    assert node.user_attributes is EMPTY_ATTRIBUTES
+
+    assert not hasattr(node, '__dict__')
+
+    settings = global_settings()
+
+    assert node.span_event(settings)[1] == {}
+    assert EMPTY_ATTRIBUTES == {}
+
+
+def test_node_user_attributes_processed():
+    trace = FunctionTrace('view')
+    trace.user_attributes['key'] = 'value'
+
+    node = trace.create_node()
+
+    assert node.user_attributes == {'key': 'value'}
+    assert node.processed_user_attributes == {'key': 'value'}
+
+
+def _memory_per_object(factory):
+    tracemalloc = pytest.importorskip('tracemalloc')
+
+    # The objects are created once before measuring so that any one off
+    # allocations, such as interned strings, are not counted.
+
+    factory(NUM_SEGMENTS)
+
+    tracemalloc.start()
+
+    try:
+        before = tracemalloc.take_snapshot()
+        objects = factory(NUM_SEGMENTS)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before,
+            'filename'))
+
+    return size / float(len(objects))
+
+
+def test_trace_node_memory_per_segment():
+    per_node = _memory_per_object(_function_nodes)
+
+    # Each node holds its own guid, so anything more than the node tuple,
+    # the guid and the floats for the times indicates containers are
+    # being retained for each node.
+
+    assert per_node < 400, per_node
+
+
+def test_trace_memory_per_call():
+    per_trace = _memory_per_object(_function_traces)
+
+    # Each traced call allocates the trace, its guid and the containers for
+    # children and attributes. The initial state of the trace is shared,
+    # with the trace itself only holding state which changes, so anything
+    # more indicates the initial state is being allocated for each call.
+    # Previously each trace took about 780 bytes.
+
+    assert per_trace < 650, per_trace
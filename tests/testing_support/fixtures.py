@@ -49,12 +49,15 @@ from newrelic.core.agent import shutdown_agent
 from newrelic.core.attribute import create_attributes
 from newrelic.core.attribute_filter import (AttributeFilter,
         DST_ERROR_COLLECTOR, DST_TRANSACTION_TRACER)
-from newrelic.core.config import (apply_config_setting, flatten_settings,
-        global_settings)
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.core.config import (apply_config_setting,
+        finalize_application_settings, flatten_settings, global_settings)
 from newrelic.common.agent_http import DeveloperModeClient
 from newrelic.core.database_utils import SQLConnections
 from newrelic.core.internal_metrics import InternalTraceContext
-from newrelic.core.stats_engine import CustomMetrics
+from newrelic.core.stats_engine import (CustomMetrics, DeferredEvent,
+        StatsEngine)
 
 from newrelic.network.exceptions import RetryDataForRequest
 
@@ -1822,6 +1825,9 @@ def validate_transaction_event_sample_data(required_attrs,
 
         sample = _bind_params(*args, **kwargs)
 
+        if isinstance(sample, DeferredEvent):
+            sample = sample.materialize()
+
         assert isinstance(sample, list)
         assert len(sample) == 3
 
@@ -2338,6 +2344,29 @@ def code_coverage_fixture(source=['newrelic']):
     return _code_coverage_fixture
 
 
+def create_stats_engine(overrides={}):
+    """Return a StatsEngine object, not belonging to any application, reset
+    with the default application settings updated with the overrides.
+
+    """
+
+    stats = StatsEngine()
+    stats.reset_stats(finalize_application_settings(overrides))
+    return stats
+
+
+def trace_batch_loop(count):
+    """Run a loop such as in a batch job, creating the same function trace
+    and datastore trace on each iteration, within the current transaction.
+
+    """
+
+    for _ in range(count):
+        with FunctionTrace('loop'):
+            with DatastoreTrace('Postgres', 'users', 'select'):
+                pass
+
+
 def reset_core_stats_engine():
 
     @function_wrapper
@@ -2482,6 +2511,10 @@ def validate_analytics_catmap_data(name, expected_attributes=(),
             return sample
 
         sample = _bind_params(*args, **kwargs)
+
+        if isinstance(sample, DeferredEvent):
+            sample = sample.materialize()
+
         samples.append(sample)
         return wrapped(*args, **kwargs)
 